@@ -0,0 +1,87 @@
+
+import simpy
+from timeit import default_timer as timer
+from hwsim_utils import HW_sim_object
+from pifo_storage import PIFOEntry
+import scheduling_tree
+
+class CountingEnvironment(simpy.Environment):
+    """
+    simpy Environment that counts the number of events it processes
+    """
+    def __init__(self, *args, **kwargs):
+        super(CountingEnvironment, self).__init__(*args, **kwargs)
+        self.event_cnt = 0
+
+    def step(self):
+        self.event_cnt += 1
+        super(CountingEnvironment, self).step()
+
+
+class LegacyClock(object):
+    """
+    Context manager that swaps the HW_sim_object delay API for the original
+    implementation, which spawned a new process for every clock cycle.
+    Used to produce "before" numbers in the benchmarks.
+    """
+    def __enter__(self):
+        self.wait_clock = HW_sim_object.wait_clock
+        self.wait_cycles = HW_sim_object.wait_cycles
+        HW_sim_object.wait_clock = legacy_wait_clock
+        HW_sim_object.wait_cycles = legacy_wait_cycles
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        HW_sim_object.wait_clock = self.wait_clock
+        HW_sim_object.wait_cycles = self.wait_cycles
+        return False
+
+def legacy_clock(self):
+    yield self.env.timeout(self.period)
+
+def legacy_wait_clock(self):
+    return self.env.process(legacy_clock(self))
+
+def legacy_cycles(self, num_cycles):
+    # the process waits out the last cycle itself rather than in another
+    # process, so the caller resumes in the same order among the processes of
+    # that cycle as when it looped over wait_clock
+    for i in range(num_cycles - 1):
+        yield legacy_wait_clock(self)
+    if num_cycles > 0:
+        yield self.env.timeout(self.period)
+
+def legacy_wait_cycles(self, num_cycles):
+    return self.env.process(legacy_cycles(self, num_cycles))
+
+
+class LegacyPIFOEntries(object):
+    """
+    Context manager that gives every PIFO entry the same sequence number, so
+    that entries with equal ranks are ordered by comparing their data as in
+    the original (rank, data) entries.
+    """
+    def __enter__(self):
+        self.entry = scheduling_tree.PIFOEntry
+        scheduling_tree.PIFOEntry = legacy_entry
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        scheduling_tree.PIFOEntry = self.entry
+        return False
+
+def legacy_entry(rank, seq, data):
+    return PIFOEntry(rank, 0, data)
+
+
+def run_tb(tb_class, *args, **kwargs):
+    """
+    Run a testbench to completion in a CountingEnvironment and return
+    (tb, env, wall time in seconds)
+    """
+    env = CountingEnvironment()
+    period = 1
+    tb = tb_class(env, period, *args, **kwargs)
+    start = timer()
+    env.run()
+    return (tb, env, timer() - start)
@@ -0,0 +1,55 @@
+import sys
+from bench_utils import LegacyClock, run_tb
+from rr_tb import RR_tb
+from strict_tb import Strict_tb
+from hstfq_tb import HSTFQ_tb
+
+TESTBENCHES = [RR_tb, Strict_tb, HSTFQ_tb]
+
+def report(name, tb, env, wall_time):
+    num_pkts = len(tb.arbiter.pkts)
+    print '{:<10} {:<8} {:>10} {:>12.0f} {:>12.1f} {:>10.2f}'.format(name, tb.sched_alg, env.event_cnt, env.event_cnt/wall_time, env.event_cnt/float(num_pkts), wall_time)
+
+def timestamps(tb):
+    """
+    (time, sport) of every pkt as it entered and as it left the switch
+    """
+    return ([(t, pkt.sport) for (t, meta, pkt) in tb.arbiter.pkts] +
+            [(t, pkt.sport) for (t, meta, pkt) in tb.receiver.pkts])
+
+def check_timestamps(before, after):
+    """
+    Check that the pkts enter and leave the switch in the same cycles with
+    the per-cycle processes as with the batched timeouts, returns the # of mismatches
+    """
+    (before_times, after_times) = (timestamps(before[1]), timestamps(after[1]))
+    errors = abs(len(before_times) - len(after_times))
+    errors += sum(1 for (x, y) in zip(before_times, after_times) if x != y)
+    if errors > 0:
+        print 'ERROR: {}: {} of {} pkt timestamps differ'.format(after[1].sched_alg, errors, len(before_times))
+    return errors
+
+def main():
+    """
+    Compare the number of simpy events and events per second with the original
+    per-cycle wait_clock processes vs. batched wait_cycles timeouts, and check
+    that the pkt timestamps are the same
+    """
+    results = []
+    errors = 0
+    for tb_class in TESTBENCHES:
+        with LegacyClock():
+            before = ('before',) + run_tb(tb_class)
+        after = ('after',) + run_tb(tb_class)
+        errors += check_timestamps(before, after)
+        results += [before, after]
+
+    print '{:<10} {:<8} {:>10} {:>12} {:>12} {:>10}'.format('', 'alg', 'events', 'events/s', 'events/pkt', 'wall (s)')
+    for result in results:
+        report(*result)
+    if errors > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+
+from timeit import default_timer as timer
+from hwsim_utils import *
+from sched_algs import *
+from fast_sim import FastClock, FastIngressPipe, FastEgressPipe
+
+NUM_PKTS = 100000
+NUM_FLOWS = 4
+REPEATS = 5
+
+def legacy_ingress(pipe, meta, pkt):
+    """
+    The if/elif chain that IngressPipe.process_pkts used to walk for every pkt
+    """
+    if pipe.sched_alg == "Invert_pkts":
+        return InvertPkts.ingress(pipe, meta, pkt)
+    elif pipe.sched_alg == "STFQ":
+        return STFQ.ingress(pipe, meta, pkt)
+    elif pipe.sched_alg == "HSTFQ":
+        return HSTFQ.ingress(pipe, meta, pkt)
+    elif pipe.sched_alg == "MinRate":
+        return MinRate.ingress(pipe, meta, pkt)
+    elif pipe.sched_alg == "RR":
+        return RR.ingress(pipe, meta, pkt)
+    elif pipe.sched_alg == "WRR":
+        return WRR.ingress(pipe, meta, pkt)
+    elif pipe.sched_alg == "Strict":
+        return Strict.ingress(pipe, meta, pkt)
+
+def legacy_egress(pipe, meta, pkt):
+    """
+    The if/elif chain that EgressPipe.process_pkts used to walk for every pkt
+    """
+    if pipe.sched_alg == "Invert_pkts":
+        return InvertPkts.egress(pipe, meta, pkt)
+    elif pipe.sched_alg == "STFQ":
+        return STFQ.egress(pipe, meta, pkt)
+    elif pipe.sched_alg == "HSTFQ":
+        return HSTFQ.egress(pipe, meta, pkt)
+    return ()
+
+def make_pipes(sched_alg):
+    clock = FastClock()
+    alg = get_sched_alg(sched_alg)
+    gstate = alg.make_gstate()
+    if sched_alg == "HSTFQ":
+        istate = HSTFQIngressState(dict((f, 1) for f in range(NUM_FLOWS)), {0: 1, 1: 1})
+    elif sched_alg == "MinRate":
+        istate = MinRateIngressState(dict((f, 2) for f in range(NUM_FLOWS)))
+    elif sched_alg == "WRR":
+        istate = WRRIngressState(dict((f, 1) for f in range(NUM_FLOWS)))
+    else:
+        istate = alg.make_istate()
+    ingress = FastIngressPipe(clock, 1, gstate, sched_alg, istate)
+    egress = FastEgressPipe(clock, 1, gstate, sched_alg)
+    return (ingress, egress)
+
+def make_pkts(sched_alg):
+    sched_meta = {"STFQ": STFQMeta, "HSTFQ": HSTFQMeta}.get(sched_alg)
+    pkts = []
+    for f in range(NUM_FLOWS):
+        pkt = PktRecord(64, sport=f)
+        meta = StdMetadata(len(pkt), 0b00000001, 0b00000100, [0, 0], 0, sched_meta=sched_meta() if sched_meta else None)
+        pkts.append((meta, pkt))
+    return pkts
+
+def bench(sched_alg, ingress_dispatch, egress_dispatch):
+    (ingress, egress) = make_pipes(sched_alg)
+    pkts = make_pkts(sched_alg)
+    start = timer()
+    for i in xrange(NUM_PKTS):
+        (meta, pkt) = pkts[i % NUM_FLOWS]
+        ingress.env.now = i
+        for event in ingress_dispatch(ingress, meta, pkt):
+            pass
+        for event in egress_dispatch(egress, meta, pkt):
+            pass
+    return (timer() - start)*1e9/NUM_PKTS
+
+def registry_ingress(pipe, meta, pkt):
+    return pipe.alg_ingress(pipe, meta, pkt)
+
+def registry_egress(pipe, meta, pkt):
+    if pipe.alg_egress is None:
+        return ()
+    return pipe.alg_egress(pipe, meta, pkt)
+
+def main():
+    """
+    Per pkt cost of the ingress and egress scheduling algorithm including the
+    dispatch on sched_alg, with the old if/elif chains and with the registry
+    """
+    print '{:<12} {:>14} {:>16} {:>10}'.format('sched_alg', 'chain (ns/pkt)', 'registry (ns/pkt)', 'saved')
+    for sched_alg in ["STFQ", "HSTFQ", "MinRate", "RR", "WRR", "Strict"]:
+        # best of several alternating runs to filter out noise
+        chain = registry = float('inf')
+        for i in range(REPEATS):
+            chain = min(chain, bench(sched_alg, legacy_ingress, legacy_egress))
+            registry = min(registry, bench(sched_alg, registry_ingress, registry_egress))
+        print '{:<12} {:>14.0f} {:>16.0f} {:>9.0f}%'.format(sched_alg, chain, registry, 100.0*(chain - registry)/chain)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,484 @@
+
+import gc
+from collections import deque
+from itertools import count
+from heapq import heappush, heappop
+from bisect import bisect_left
+from hwsim_utils import *
+from p4_ingress import IngressPipe
+from p4_egress import EgressPipe
+from scheduling_tree import resolve_shape, admit
+from pifo_storage import PIFOEntry, make_storage, DROP_MAX
+from trace_utils import sport_flowID, TracePktGenerator
+from sched_algs import get_sched_alg
+from latency_stats import LatencyStats
+from pifo_metrics import PIFOCounters
+
+class FastClock(object):
+    """
+    Stands in for the simpy Environment of the pipelines: only tracks the time
+    """
+    def __init__(self):
+        self.now = 0
+
+
+class FastIngressPipe(IngressPipe):
+    """
+    IngressPipe whose scheduling algorithms are called directly rather than
+    from a simpy process
+    """
+    def __init__(self, clock, period, global_state, sched_alg, istate):
+        self.env = clock
+        self.period = period
+        self.sim_done = False
+        self.gstate = global_state
+        self.sched_alg = sched_alg
+        self.istate = istate
+        self.alg_ingress = get_sched_alg(sched_alg).ingress
+
+    def wait_clock(self):
+        return 1
+
+    def wait_cycles(self, num_cycles):
+        return num_cycles
+
+    def process(self, meta, pkt):
+        """
+        Run the scheduling algorithm on the pkt and return the # of cycles it took
+        """
+        return sum(self.alg_ingress(self, meta, pkt))
+
+
+class FastEgressPipe(EgressPipe):
+    """
+    EgressPipe whose post-scheduling algorithms are called directly rather
+    than from a simpy process
+    """
+    def __init__(self, clock, period, global_state, sched_alg):
+        self.env = clock
+        self.period = period
+        self.sim_done = False
+        self.gstate = global_state
+        self.sched_alg = sched_alg
+        self.alg_egress = get_sched_alg(sched_alg).egress
+
+    def wait_clock(self):
+        return 1
+
+    def wait_cycles(self, num_cycles):
+        return num_cycles
+
+    def process(self, meta, pkt):
+        """
+        Run the post-scheduling algorithm on the pkt and return the # of cycles it took
+        """
+        if self.alg_egress is None:
+            return 0
+        return sum(self.alg_egress(self, meta, pkt))
+
+
+class FastTreeNode(PIFOCounters):
+    def __init__(self, ID, parent, clock, period, max_size=None, drop_policy=DROP_MAX, pop_max=False, storage=None, write_latency=1, read_latency=1):
+        self.ID = ID
+        self.parent = parent
+        self.env = clock
+        self.period = period
+        self.max_size = max_size
+        self.drop_policy = drop_policy
+        self.write_latency = write_latency
+        self.read_latency = read_latency
+        self.values = make_storage(max_size, drop_policy, pop_max, storage)
+        # same as PIFO.seq
+        self.seq = count()
+        self.drop_cnt = 0
+        # a read is waiting for this node to be written
+        self.read_pending = False
+        self.stall_start = None
+        self.init_counters()
+
+    def occupancy(self):
+        return len(self.values)
+
+    def write(self, rank, data):
+        # admit() has already made room for the entry
+        self.enq_cnt += 1
+        self.values.push(PIFOEntry(rank, next(self.seq), data))
+        self.depth_changed()
+
+
+class FastSwitchSim(object):
+    """
+    Discrete event model of a Switch testbench that does not use simpy. Pkt
+    arrivals, the arbiter, ingress rank computation, scheduling tree writes and
+    reads, egress processing and the egress link are modeled with the same
+    cycle latencies as the simpy engine, but only the events that change state
+    are simulated, and the ones that would be processed right after the event
+    that causes them (the egress of a popped pkt, the ingress of a queued pkt)
+    are handled directly. With DROP_TAIL or DROP_HEAD nodes in a multi-level
+    tree, a leaf that is read and written in the same cycle may see the two in
+    a different order than the simpy engine, so the dropped pkts can differ.
+    Likewise, a read and a write that are issued to a node in the same cycle
+    are ordered by the kind of event that issued them, while in the simpy
+    engine the order depends on the handshakes in flight, which irregular
+    arrivals (e.g. from a TracePktGenerator) occasionally expose.
+    """
+    # order of events that happen in the same cycle, a WAKE is the retry of a
+    # read that waited for a write, which polled on an older timeout than the writes.
+    # A WRITE of a node pointer follows the write of the child in fewer handshakes
+    # than a POP takes to follow the read, but the LEAF_WRITE of an admitted pkt
+    # waits for the ingress to see its scheduling algorithm process end.
+    WAKE, WRITE, HANDOFF, INGRESS, POP, LEAF_WRITE, ADMIT, READ = range(8)
+
+    def __init__(self, period, generators, sched_alg, shape, global_state, istate, egress_link_rate, max_node_size=None,
+                 drop_policy=DROP_MAX, flowID_func=sport_flowID, storage=None, keep_latency=True):
+        """
+        generators: PktGenerator or TracePktGenerator objects describing the input flows (they are never run)
+        keep_latency: record the latency of every outgoing pkt in self.latency, same as Switch.latency
+        """
+        self.period = period
+        self.generators = generators
+        self.sched_alg = sched_alg
+        self.shape = shape
+        self.egress_link_rate = egress_link_rate
+
+        self.clock = FastClock()
+        self.ingress = FastIngressPipe(self.clock, period, global_state, sched_alg, istate)
+        self.egress = FastEgressPipe(self.clock, period, global_state, sched_alg)
+
+        self.nodes = {}
+        self.root = None
+        for (ID, parent_ID, max_size, policy, pop_max, storage) in resolve_shape(shape, max_node_size, drop_policy, storage):
+            parent = self.nodes[parent_ID] if parent_ID is not None else None
+            node = FastTreeNode(ID, parent, self.clock, period, max_size, policy, pop_max, storage)
+            if parent is None:
+                self.root = node
+            self.nodes[ID] = node
+
+        # same as Scheduling_tree.drop_cnt and flow_drop_cnts
+        self.flowID_func = flowID_func
+        self.drop_cnt = 0
+        self.flow_drop_cnts = {}
+        self.latency = LatencyStats(period, flowID_func) if keep_latency else None
+
+        # maps id(pkt) to len(pkt) since computing the length of a scapy pkt is expensive
+        self.pkt_lens = {}
+        # same format as Arbiter.pkts and PktReceiver.pkts
+        self.input_pkts = []
+        self.output_pkts = []
+
+    @classmethod
+    def from_testbench(cls, tb):
+        """
+        Build the fast model of a (not yet run) Switch_testbench
+        """
+        switch = tb.switch
+        if switch.tm.pipelined_writes or switch.tm.prefetch_reads:
+            raise ValueError('The fast engine only models the non-pipelined scheduling tree enqueue and dequeue')
+        if switch.tm.buffer is not None:
+            raise ValueError('The fast engine does not model shared buffers')
+        if not tb.arbiter.poll_when_idle or not all(node.poll_when_empty for node in switch.tm.nodes.values()):
+            raise ValueError('The fast engine only models an arbiter and scheduling tree nodes that poll while idle')
+        return cls(tb.period, tb.generators, switch.ingress.sched_alg, switch.tm.shape, switch.global_state,
+                   switch.ingress.istate, tb.egress_link_rate, switch.tm.max_node_size, switch.tm.drop_policy, switch.tm.flowID_func,
+                   switch.tm.storage, switch.latency is not None)
+
+    def metrics(self, end_time=None):
+        """
+        Same as Scheduling_tree.metrics
+        end_time: time up to which the depths are averaged, by default the last
+                  event. A simpy testbench runs on for the idle cycles it takes
+                  its processes to see that the simulation is done.
+        """
+        if end_time is not None:
+            self.clock.now = end_time
+        return dict((ID, node.metrics()) for (ID, node) in self.nodes.items())
+
+    def schedule(self, time, kind, *args):
+        heappush(self.events, (time, kind, next(self.event_ids), args))
+
+    def run(self):
+        self.events = []
+        self.event_ids = count()
+        self.tree_ready = 0
+        # the ADMIT of the last handed off pkt has not happened yet, so
+        # tree_ready is not known and the handoff of next_handoff has to wait
+        self.admit_pending = False
+        self.next_handoff = None
+        self.ingress_queue = deque(self.arbitrate())
+
+        if len(self.ingress_queue) > 0:
+            (t, meta, pkt) = self.ingress_queue.popleft()
+            self.schedule(t, self.INGRESS, meta, pkt)
+        self.read(0)
+
+        # indexed by event kind
+        handlers = [self.pop, self.write, self.handoff, self.ingress_pkt, self.pop, self.write, self.admit, self.pop_root]
+        events = self.events
+        clock = self.clock
+        # the events are short lived tuples without cycles, which would only
+        # make the cyclic garbage collector scan the whole heap over and over
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            while events:
+                (time, kind, event_id, args) = heappop(events)
+                clock.now = time
+                handlers[kind](time, *args)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        self.event_cnt = next(self.event_ids)
+
+    #############
+    ## Sources ##
+    #############
+
+    def gen_pkts(self, gen):
+        """
+        Returns the list of (time, meta, pkt) put into the output pipe of a PktGenerator
+        or TracePktGenerator. The metadata must not be modified, pkts without a
+        pkt_mod_cb share it.
+        """
+        if isinstance(gen, TracePktGenerator):
+            pkts = []
+            for (cycle, meta, pkt) in gen.arrivals():
+                self.pkt_lens[id(pkt)] = len(pkt)
+                pkts.append((cycle*gen.period, meta, pkt))
+            return pkts
+        if gen.pkt_limit is None and gen.cycle_limit is None:
+            raise ValueError('PktGenerator needs a pkt_limit or cycle_limit to run in the fast engine')
+        stop_time = gen.cycle_limit*gen.period if gen.cycle_limit is not None else None
+        bursty = gen.burst_size is not None and gen.burst_delay is not None
+        # pkts are never modified after they are generated so without a callback
+        # they can all share the base pkt, which saves building each one
+        if gen.pkt_mod_cb is None:
+            meta = gen.base_meta.clone()
+            pkt = gen.base_pkt
+            self.pkt_lens[id(pkt)] = len(pkt)
+            cycle_delay = serialization_cycles(pkt, gen.rate)
+        pkts = []
+        now = 0
+        burst_cnt = 0
+        in_burst = False
+        while (gen.pkt_limit is None and now < stop_time) or (gen.pkt_limit is not None and len(pkts) < gen.pkt_limit):
+            if bursty and not in_burst:
+                now += gen.burst_delay*gen.period
+                in_burst = True
+                continue
+            if gen.pkt_mod_cb is not None:
+                meta = gen.base_meta.clone()
+                pkt = gen.base_pkt.copy()
+                gen.pkt_mod_cb(meta, pkt)
+                self.pkt_lens[id(pkt)] = len(pkt)
+                cycle_delay = serialization_cycles(pkt, gen.rate)
+            now += cycle_delay*gen.period
+            pkts.append((now, meta, pkt))
+            if bursty:
+                burst_cnt += 1
+                if burst_cnt == gen.burst_size:
+                    burst_cnt = 0
+                    in_burst = False
+        return pkts
+
+    def arbitrate(self):
+        """
+        Model the round robin Arbiter: input i is checked in cycles i, i + n,
+        i + 2n, ... and at most one pkt is forwarded per check. A pkt put into
+        an input in the cycle of its check is only forwarded then if the
+        generator ran before the arbiter in that cycle (see gen_first). The
+        generated metadata becomes the record in self.input_pkts and the switch
+        gets a copy.
+        """
+        num_pipes = len(self.generators)
+        pipe_pkts = [self.gen_pkts(gen) for gen in self.generators]
+        put_cycles = [[int(t/self.period) for (t, meta, pkt) in pkts] for pkts in pipe_pkts]
+        # gen_order[i][k] is whether generator i runs before the arbiter in the cycle of its k-th put
+        gen_order = [[] for gen in self.generators]
+        # a TracePktGenerator waits for each put with a timeout that is older
+        # than the arbiter's so it always runs first
+        traces = [isinstance(gen, TracePktGenerator) for gen in self.generators]
+        # a bursty PktGenerator starts with a delay and runs before the arbiter,
+        # the others start to send after it
+        first = [not trace and gen.burst_size is not None and gen.burst_delay is not None
+                 for (gen, trace) in zip(self.generators, traces)]
+        get_cycles = []
+        heads = [0]*num_pipes
+        # (cycle, i) of the next check of input i that may forward its head pkt
+        checks = []
+        for i in range(num_pipes):
+            if len(put_cycles[i]) > 0:
+                heappush(checks, (self.next_check(put_cycles[i][0], i), i))
+        arbitrated = []
+        while checks:
+            (cycle, i) = heappop(checks)
+            k = heads[i]
+            if cycle == put_cycles[i][k] and not traces[i] and not self.gen_first(put_cycles[i], k, gen_order[i], first[i], get_cycles):
+                heappush(checks, (cycle + num_pipes, i))
+                continue
+            (t, meta, pkt) = pipe_pkts[i][k]
+            arbitrated.append((cycle*self.period, meta, pkt))
+            get_cycles.append(cycle)
+            heads[i] += 1
+            if heads[i] < len(put_cycles[i]):
+                heappush(checks, (self.next_check(max(put_cycles[i][k + 1], cycle + 1), i), i))
+        self.input_pkts.extend(arbitrated)
+        return [(t, meta.clone(), pkt) for (t, meta, pkt) in arbitrated]
+
+    def next_check(self, cycle, i):
+        """
+        First cycle from cycle on in which the arbiter checks input i
+        """
+        return cycle + (i - cycle) % len(self.generators)
+
+    def gen_first(self, put_cycles, k, order, first, get_cycles):
+        """
+        Whether a PktGenerator runs before the arbiter in the cycle of its k-th
+        put. Every cycle the simpy processes resume in the same order as in the
+        previous cycle, except that the arbiter moves to the end in a cycle in
+        which it forwards a pkt and the generator in one in which it sends a
+        pkt. So the generator runs first if the arbiter was the last of the two
+        to move on its own, keeps the order it had at its previous put if both
+        last moved in that cycle and otherwise has the order it started with
+        (first). order caches the results for the earlier puts.
+        """
+        while len(order) <= k:
+            n = len(order)
+            cycle = put_cycles[n]
+            g = bisect_left(get_cycles, cycle) - 1
+            last_get = get_cycles[g] if g >= 0 else None
+            last_put = put_cycles[n - 1] if n > 0 else None
+            if last_put == cycle:
+                order.append(order[n - 1])
+            elif last_put is None:
+                order.append(first or last_get is not None)
+            elif last_get is None or last_put > last_get:
+                order.append(False)
+            elif last_get > last_put:
+                order.append(True)
+            else:
+                order.append(order[n - 1])
+        return order[k]
+
+    ############
+    ## Events ##
+    ############
+
+    def ingress_pkt(self, now, meta, pkt):
+        meta.ingress_time = now
+        cycles = self.ingress.process(meta, pkt)
+        handoff_time = now + cycles*self.period
+        if self.admit_pending and handoff_time > now:
+            # the ADMIT of the previous pkt schedules the handoff
+            self.next_handoff = (handoff_time, meta, pkt)
+        else:
+            self.schedule(max(handoff_time, self.tree_ready), self.HANDOFF, meta, pkt)
+
+    def handoff(self, now, meta, pkt):
+        if now < self.tree_ready:
+            # wait for the scheduling tree to accept the pkt
+            self.schedule(self.tree_ready, self.HANDOFF, meta, pkt)
+            return
+        # the drop policies see the reads of this cycle
+        self.admit_pending = True
+        self.schedule(now, self.ADMIT, meta, pkt)
+        # the ingress can start on the next pkt as soon as this one is handed off,
+        # nothing else that happens in this cycle comes before it
+        if len(self.ingress_queue) > 0:
+            (t, next_meta, next_pkt) = self.ingress_queue.popleft()
+            if t <= now:
+                self.ingress_pkt(now, next_meta, next_pkt)
+            else:
+                self.schedule(t, self.INGRESS, next_meta, next_pkt)
+
+    def admit(self, now, meta, pkt):
+        meta.enq_time = now
+        (num_levels, dropped) = admit(self.nodes, meta, pkt)
+        if dropped is not None:
+            (drop_meta, drop_pkt) = dropped
+            flowID = self.flowID_func(drop_pkt)
+            self.drop_cnt += 1
+            self.flow_drop_cnts[flowID] = self.flow_drop_cnts.get(flowID, 0) + 1
+        # enqueue into the leaf and then the node pointers up to the root
+        write_time = now
+        node = self.nodes[meta.leaf_node]
+        data = (meta, pkt)
+        kind = self.LEAF_WRITE
+        for level in range(num_levels):
+            write_time += node.write_latency*self.period
+            self.schedule(write_time, kind, node, meta.ranks[level], data)
+            kind = self.WRITE
+            data = node.ID
+            node = node.parent
+        self.tree_ready = write_time
+        self.admit_pending = False
+        if self.next_handoff is not None:
+            (t, next_meta, next_pkt) = self.next_handoff
+            self.next_handoff = None
+            self.schedule(max(t, write_time), self.HANDOFF, next_meta, next_pkt)
+
+    def write(self, now, node, rank, data):
+        node.write(rank, data)
+        if node.read_pending:
+            node.read_pending = False
+            # a polling read checks before the write in this cycle, the POPs of a cycle come before its ADMITs
+            if now == node.stall_start or node.write_latency <= 1:
+                self.schedule(now + self.period, self.WAKE, node)
+            else:
+                self.pop(now, node)
+
+    def read(self, now):
+        """
+        Issue a read of the root in cycle now, which may be later than the
+        current time. Its POP is scheduled right away unless the root has no
+        read latency, then the POP must come after the ADMITs of that cycle.
+        """
+        if self.root.read_latency == 0:
+            self.schedule(now, self.READ)
+        else:
+            self.pop_root(now)
+
+    def pop_root(self, now):
+        self.schedule(now + self.root.read_latency*self.period, self.POP, self.root)
+
+    def pop(self, now, node):
+        if len(node.values) == 0:
+            # wait for the next write
+            node.read_pending = True
+            node.stall_start = now
+            return
+        data = node.values.pop().data
+        node.deq_cnt += 1
+        node.depth_changed()
+        if node.stall_start is not None:
+            node.stall_cycles += (now - node.stall_start)/self.period
+            node.stall_start = None
+        if type(data) == int:
+            child = self.nodes[data]
+            self.schedule(now + child.read_latency*self.period, self.POP, child)
+        else:
+            (meta, pkt) = data
+            meta.deq_time = now
+            # an egress in this cycle would be the next event anyway, the only
+            # ones that can come before it are other POPs and WRITEs, which it does not depend on
+            self.egress_pkt(now, meta, pkt)
+
+    def rcv_cycles(self, pkt):
+        """
+        # of cycles to send pkt on the egress link, using the length recorded when it was generated
+        """
+        pkt_time = self.pkt_lens[id(pkt)]*8/self.egress_link_rate # ns
+        return int(pkt_time/NSEC_PER_CYCLE + 0.5)
+
+    def egress_pkt(self, now, meta, pkt):
+        cycles = self.egress.process(meta, pkt)
+        meta.egress_time = now + cycles*self.period
+        if self.latency is not None:
+            self.latency.record(meta, pkt)
+        # model the PktReceiver
+        rcv_time = meta.egress_time
+        cycle_delay = self.rcv_cycles(pkt)
+        if cycle_delay > 2:
+            rcv_time += (cycle_delay - 2)*self.period
+        self.output_pkts.append((rcv_time, meta, pkt))
+        # the receiver is ready for the next pkt
+        self.read(rcv_time)
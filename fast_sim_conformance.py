@@ -0,0 +1,151 @@
+
+import sys
+import simpy
+from timeit import default_timer as timer
+from hwsim_utils import PktRecord, StdMetadata
+from scheduling_tree import Scheduling_tree
+from fast_sim import FastSwitchSim
+from strict_tb import Strict_tb
+from rr_tb import RR_tb
+from wrr_tb import WRR_tb
+from stfq_tb import STFQ_tb
+from hstfq_tb import HSTFQ_tb
+from minRate_tb import MinRate_tb
+
+# Invert_pkts_tb drives the switch directly rather than through PktGenerators
+# so it cannot be converted to the fast engine
+TESTBENCHES = [Strict_tb, RR_tb, WRR_tb, STFQ_tb, HSTFQ_tb, MinRate_tb]
+
+def pkt_key(record):
+    # PIFO entries with equal rank leave in write order so the flow and all
+    # ranks and latency timestamps of every pkt must match
+    (t, meta, pkt) = record
+    return (t, pkt.sport, meta.leaf_node, tuple(meta.ranks), meta.ingress_time, meta.enq_time, meta.deq_time, meta.egress_time)
+
+def compare(name, expected, actual):
+    """
+    Compare two lists of (time, meta, pkt) records and return the # of mismatches
+    """
+    errors = 0
+    if len(expected) != len(actual):
+        print 'ERROR: {}: expected {} pkts, got {}'.format(name, len(expected), len(actual))
+        errors += 1
+    for (i, exp, act) in zip(range(len(expected)), expected, actual):
+        if pkt_key(exp) != pkt_key(act):
+            if errors < 10:
+                print 'ERROR: {} pkt {}: simpy = {}, fast = {}'.format(name, i, pkt_key(exp), pkt_key(act))
+            errors += 1
+    return errors
+
+def compare_metrics(name, expected, actual):
+    """
+    Compare the PIFOMetrics of every scheduling tree node and return the # of mismatches
+    """
+    errors = 0
+    for ID in sorted(expected.keys()):
+        if expected[ID] != actual.get(ID):
+            print 'ERROR: {} node {}: simpy = {}, fast = {}'.format(name, ID, expected[ID], actual.get(ID))
+            errors += 1
+    return errors
+
+def check_counts(name, metrics):
+    """
+    Check that every entry written into a node was read or is still in it,
+    none of the testbenches drop pkts. Returns the # of mismatches
+    """
+    errors = 0
+    for ID in sorted(metrics.keys()):
+        m = metrics[ID]
+        if m.enq_cnt != m.deq_cnt + m.depth:
+            print 'ERROR: {} node {}: enq_cnt = {}, deq_cnt = {}, depth = {}'.format(name, ID, m.enq_cnt, m.deq_cnt, m.depth)
+            errors += 1
+    return errors
+
+def prefetch_restore(env, tree, pkts, num_reads):
+    """
+    Write the first pkt, give the tree time to prefetch it, write the others
+    and then read num_reads pkts
+    """
+    tree.pkt_in_pipe.put(pkts[0])
+    yield env.timeout(10)
+    for data in pkts[1:]:
+        tree.pkt_in_pipe.put(data)
+    yield env.timeout(10)
+    for i in range(num_reads):
+        tree.ready_out_pipe.put(1)
+        yield tree.pkt_out_pipe.get()
+
+def check_prefetch_restore(max_node_size, num_reads, num_restores, num_drops):
+    """
+    The fast engine does not model prefetch_reads, so check the simpy
+    scheduling tree on its own: a pkt with a smaller rank that arrives after
+    the prefetch makes the tree put the prefetched entries back, which must not
+    count as reads nor overfill a node. Returns the # of mismatches
+    """
+    name = 'prefetch restore (max_node_size = {})'.format(max_node_size)
+    env = simpy.Environment()
+    tree = Scheduling_tree(env, 1, simpy.Store(env), simpy.Store(env), simpy.Store(env), simpy.Store(env), {0: [1, 2]},
+                           max_node_size=max_node_size, prefetch_reads=True)
+    pkt = PktRecord(64)
+    pkts = [(StdMetadata(len(pkt), 0, 0, [rank, rank], 1), pkt) for rank in [5, 1]]
+    env.run(until=env.process(prefetch_restore(env, tree, pkts, num_reads)))
+    metrics = tree.metrics()
+    errors = check_counts(name, metrics)
+    if (tree.prefetch_restore_cnt, tree.drop_cnt) != (num_restores, num_drops):
+        print 'ERROR: {}: {} restores and {} drops, expected {} and {}'.format(name, tree.prefetch_restore_cnt, tree.drop_cnt, num_restores, num_drops)
+        errors += 1
+    for ID in sorted(metrics.keys()):
+        if max_node_size is not None and metrics[ID].max_depth > max_node_size:
+            print 'ERROR: {} node {}: max_depth = {}'.format(name, ID, metrics[ID].max_depth)
+            errors += 1
+    return errors
+
+def run_simpy(tb_class):
+    env = simpy.Environment()
+    tb = tb_class(env, 1)
+    start = timer()
+    env.run()
+    elapsed = timer() - start
+    return (tb.arbiter.pkts, tb.receiver.pkts, tb.switch.tm.metrics(), env.now, elapsed)
+
+def run_fast(tb_class, end_time):
+    """
+    end_time: time at which the simpy run ended, the node metrics are taken then
+    """
+    sim = FastSwitchSim.from_testbench(tb_class(simpy.Environment(), 1))
+    start = timer()
+    sim.run()
+    elapsed = timer() - start
+    return (sim.input_pkts, sim.output_pkts, sim.metrics(end_time), elapsed)
+
+def main():
+    """
+    Run every testbench in both the simpy and the fast engine and check that
+    they produce the same input and output pkts and scheduling tree node
+    metrics, and that the node counters add up
+    """
+    results = []
+    total_errors = 0
+    for tb_class in TESTBENCHES:
+        (simpy_in, simpy_out, simpy_metrics, end_time, simpy_time) = run_simpy(tb_class)
+        (fast_in, fast_out, fast_metrics, fast_time) = run_fast(tb_class, end_time)
+        name = tb_class.__name__
+        errors = compare(name + ' input', simpy_in, fast_in) + compare(name + ' output', simpy_out, fast_out)
+        errors += compare_metrics(name, simpy_metrics, fast_metrics)
+        errors += check_counts(name + ' simpy', simpy_metrics) + check_counts(name + ' fast', fast_metrics)
+        total_errors += errors
+        results.append((name, len(simpy_out), errors, simpy_time, fast_time))
+
+    total_errors += check_prefetch_restore(None, 2, 1, 0)
+    # the prefetched pkt still takes up its leaf, so the second pkt is dropped
+    total_errors += check_prefetch_restore(1, 1, 0, 1)
+
+    print '{:<12} {:>8} {:>8} {:>10} {:>10} {:>9}'.format('testbench', '# pkts', 'errors', 'simpy (s)', 'fast (s)', 'speedup')
+    for (name, num_pkts, errors, simpy_time, fast_time) in results:
+        print '{:<12} {:>8} {:>8} {:>10.3f} {:>10.3f} {:>8.1f}x'.format(name, num_pkts, errors, simpy_time, fast_time, simpy_time/fast_time)
+    if total_errors > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,21 @@
 
 import sys, os
-from scapy.all import *
+from copy import copy, deepcopy
 import simpy
-from copy import deepcopy
+
+# only the layers that PktRecord stands in for, scapy.all loads every layer.
+# Note that scapy.packet imports matplotlib.pyplot if matplotlib is installed,
+# so the pyplot backend is already chosen once this module is loaded
+from scapy.layers.l2 import Ether
+from scapy.layers.inet import IP, TCP, UDP
+from scapy.utils import wrpcap, PcapWriter
 
 NSEC_PER_CYCLE = 5 # ns
 
 class StdMetadata(object):
+    __slots__ = ('pkt_len', 'src_port', 'dst_port', 'ranks', 'leaf_node', 'sched_meta',
+                 'ingress_time', 'enq_time', 'deq_time', 'egress_time')
+
     def __init__(self, pkt_len, src_port, dst_port, ranks, leaf_node, sched_meta=None):
         self.pkt_len = pkt_len
         self.src_port = src_port
@@ -15,6 +24,33 @@ class StdMetadata(object):
         self.leaf_node = leaf_node
         # scheduling alg specific metadata:
         self.sched_meta = sched_meta
+        # times at which the pkt entered the ingress, was enqueued into and
+        # dequeued from the scheduling tree and left the egress
+        self.ingress_time = None
+        self.enq_time = None
+        self.deq_time = None
+        self.egress_time = None
+
+    def clone(self):
+        """
+        Much cheaper equivalent of deepcopy(self). A subclass keeps its type and
+        gets a shallow copy of its own fields, a sched_meta without a clone()
+        method is deep copied.
+        """
+        if type(self) is StdMetadata:
+            meta = StdMetadata(self.pkt_len, self.src_port, self.dst_port, list(self.ranks), self.leaf_node)
+            meta.ingress_time = self.ingress_time
+            meta.enq_time = self.enq_time
+            meta.deq_time = self.deq_time
+            meta.egress_time = self.egress_time
+        else:
+            # copies the slots of every class and any __dict__
+            meta = copy(self)
+            meta.ranks = list(self.ranks)
+        sched_meta = self.sched_meta
+        if sched_meta is not None:
+            meta.sched_meta = sched_meta.clone() if hasattr(sched_meta, 'clone') else deepcopy(sched_meta)
+        return meta
 
     def __str__(self):
         return '{{ pkt_len: {}, src_port: {:08b}, dst_port: {:08b}, ranks: {}, leaf_node: {}, sched_meta: {}}}'.format(self.pkt_len, self.src_port, self.dst_port, self.ranks, self.leaf_node, self.sched_meta)
@@ -25,17 +61,148 @@ def pad_pkt(pkt, size):
     else:
         return pkt / ('\x00'*(size - len(pkt)))
 
+class PktRecordEther(object):
+    """
+    pkt[Ether] of a PktRecord, which does not model the MAC addresses: reading
+    them raises AttributeError rather than returning the IP addresses
+    """
+    __slots__ = ('pkt',)
+    type = 0x0800
+
+    def __init__(self, pkt):
+        self.pkt = pkt
+
+    def __getattr__(self, field):
+        raise AttributeError('PktRecord does not model the Ether field {}'.format(field))
+
+    def getfieldval(self, field):
+        return getattr(self, field)
+
+    def summary(self):
+        return 'Ether / ' + self.pkt.summary()
+
+class PktRecord(object):
+    """
+    Compact stand-in for an Ether/IP/TCP (or UDP) scapy pkt that only carries
+    the 5-tuple, length and IP id. It supports the parts of the scapy API used
+    by the simulator (len(pkt), IP in pkt, pkt[IP].src, pkt.sport, getfieldval,
+    copy, summary) and is only converted to scapy when pcap output is needed.
+    """
+    __slots__ = ('proto', 'src', 'dst', 'sport', 'dport', 'length', 'id')
+
+    def __init__(self, length, src='127.0.0.1', dst='127.0.0.1', sport=20, dport=80, proto=6, id=1):
+        self.length = length
+        self.src = src
+        self.dst = dst
+        self.sport = sport
+        self.dport = dport
+        self.proto = proto
+        self.id = id
+
+    @classmethod
+    def from_scapy(cls, pkt):
+        l4 = pkt[IP].payload
+        return cls(len(pkt), pkt[IP].src, pkt[IP].dst, l4.sport, l4.dport, pkt[IP].proto, pkt[IP].id)
+
+    def to_scapy(self):
+        if self.proto == 17:
+            l4 = UDP(sport=self.sport, dport=self.dport)
+        else:
+            l4 = TCP(sport=self.sport, dport=self.dport)
+        pkt = Ether()/IP(src=self.src, dst=self.dst, proto=self.proto, id=self.id)/l4
+        return pad_pkt(pkt, self.length)
+
+    def __len__(self):
+        return self.length
+
+    def __contains__(self, layer):
+        return layer in (Ether, IP) or (layer == TCP and self.proto == 6) or (layer == UDP and self.proto == 17)
+
+    def __getitem__(self, layer):
+        if layer not in self:
+            raise IndexError('Layer [{}] not found'.format(layer.__name__))
+        if layer == Ether:
+            return PktRecordEther(self)
+        # all of the IP and L4 fields live in the one record
+        return self
+
+    def getfieldval(self, field):
+        return getattr(self, field)
+
+    def copy(self):
+        return PktRecord(self.length, self.src, self.dst, self.sport, self.dport, self.proto, self.id)
+
+    def summary(self):
+        return 'PktRecord {}:{} > {}:{} proto {} len {} id {}'.format(self.src, self.sport, self.dst, self.dport, self.proto, self.length, self.id)
+
+    def __str__(self):
+        return str(self.to_scapy())
+
+def to_scapy_pkts(pkts):
+    """
+    Convert any PktRecords in pkts to scapy pkts (e.g. to write them to a pcap file)
+    """
+    return [pkt.to_scapy() if isinstance(pkt, PktRecord) else pkt for pkt in pkts]
+
+def serialization_cycles(pkt, rate):
+    """
+    # of clock cycles needed to send pkt at rate (Gbps)
+    """
+    pkt_time = len(pkt)*8/rate # ns
+    return int(pkt_time/NSEC_PER_CYCLE + 0.5)
+
+class NotifyStore(simpy.Store):
+    """
+    simpy Store that wakes up a listener event when an item is put into it, so
+    that a consumer of several stores can sleep until any of them has data
+    """
+    def __init__(self, env, capacity=float('inf')):
+        super(NotifyStore, self).__init__(env, capacity)
+        self.put_listener = None
+
+    def _do_put(self, event):
+        ret = super(NotifyStore, self)._do_put(event)
+        listener = self.put_listener
+        if event.triggered and listener is not None:
+            self.put_listener = None
+            if not listener.triggered:
+                listener.succeed()
+        return ret
+
+class ClockEdge(simpy.events.Event):
+    """
+    Event at the start of the cycle delay time units from now, which is
+    processed before all of the other events of that cycle
+    """
+    def __init__(self, env, delay):
+        super(ClockEdge, self).__init__(env)
+        self._ok = True
+        self._value = None
+        env.schedule(self, simpy.events.URGENT, delay)
+
 class HW_sim_object(object):
     def __init__(self, env, period):
         self.env = env
         self.period = period
         self.sim_done = False
 
-    def clock(self):
-        yield self.env.timeout(self.period)
-
     def wait_clock(self):
-        return self.env.process(self.clock())
+        return self.env.timeout(self.period)
+
+    def wait_cycles(self, num_cycles):
+        """
+        Wait num_cycles clock cycles with a single timeout event rather than
+        one event per cycle
+        """
+        return self.env.timeout(num_cycles*self.period)
+
+    def wait_next_cycle(self):
+        """
+        Wait until the start of the next clock cycle. A process that is woken
+        up by another one resumes first in the next cycle no matter in which
+        order the two ran in this cycle.
+        """
+        return ClockEdge(self.env, self.period)
 
 
 class PktGenerator(HW_sim_object):
@@ -50,6 +217,7 @@ class PktGenerator(HW_sim_object):
         self.base_pkt = base_pkt
         self.pkt_mod_cb = pkt_mod_cb
         self.pkt_limit = pkt_limit
+        self.cycle_limit = cycle_limit
         self.pkt_cnt = 0
         self.burst_size = burst_size
         self.burst_delay = burst_delay
@@ -68,11 +236,13 @@ class PktGenerator(HW_sim_object):
         self.proc = self.env.process(self.gen_pkts())
 
     def start_timer(self, cycle_limit):
-        for i in range(cycle_limit):
-            yield self.wait_clock()  
+        yield self.wait_cycles(cycle_limit)
         self.sim_done = True
 
     def gen_pkts(self):
+        # wait one cycle at a time and send every pkt from its own process: the
+        # arbiter only sees a pkt in the cycle it is put if the generator resumed
+        # before it, and a single timeout for a whole delay would change that order
         while (self.pkt_limit is None and not self.sim_done) or (self.pkt_limit is not None and self.pkt_cnt < self.pkt_limit):
             if self.burst_size is not None and self.burst_delay is not None:
                 if self.snd_state == self.BURST and self.burst_cnt < self.burst_size:
@@ -95,26 +265,31 @@ class PktGenerator(HW_sim_object):
 
     def send_pkt(self):
             pkt = self.base_pkt.copy()
-            meta = deepcopy(self.base_meta) 
+            meta = self.base_meta.clone()
             # invoke provided callback to provide programmability
             if self.pkt_mod_cb is not None:
                 self.pkt_mod_cb(meta, pkt)
             # rate limiting
-            pkt_time = len(pkt)*8/self.rate # ns
-            cycle_delay = int(pkt_time/NSEC_PER_CYCLE + 0.5)
-            for i in range(cycle_delay):
+            for i in range(serialization_cycles(pkt, self.rate)):
                 yield self.wait_clock()
             self.pkt_out_pipe.put((meta, pkt))
             self.pkt_cnt += 1
 
 
 class PktReceiver(HW_sim_object):
-    def __init__(self, env, period, pkt_in_pipe, ready_pipe, rate):
+    def __init__(self, env, period, pkt_in_pipe, ready_pipe, rate, keep_pkts=True, recorder=None):
+        """
+        keep_pkts: keep every received pkt in self.pkts (otherwise they are only counted)
+        recorder: optional object whose record(time, meta, pkt) is called for every received pkt
+        """
         super(PktReceiver, self).__init__(env, period)
         self.pkt_in_pipe = pkt_in_pipe
         self.ready_pipe = ready_pipe
         self.rate = rate
+        self.keep_pkts = keep_pkts
+        self.recorder = recorder
         self.pkts = []
+        self.pkt_cnt = 0
 
         self.run()
 
@@ -125,19 +300,39 @@ class PktReceiver(HW_sim_object):
         while not self.sim_done:
             self.ready_pipe.put(1)
             (meta, pkt) = yield self.pkt_in_pipe.get()
-            pkt_time = len(pkt)*8/self.rate # ns
-            cycle_delay = int(pkt_time/NSEC_PER_CYCLE + 0.5)
-            for i in range(cycle_delay-2):
-                yield self.wait_clock()
-            self.pkts.append((self.env.now, meta, pkt))
+            cycle_delay = serialization_cycles(pkt, self.rate)
+            if cycle_delay > 2:
+                yield self.wait_cycles(cycle_delay-2)
+            self.pkt_cnt += 1
+            if self.keep_pkts:
+                self.pkts.append((self.env.now, meta, pkt))
+            if self.recorder is not None:
+                self.recorder.record(self.env.now, meta, pkt)
 
 
 class Arbiter(HW_sim_object):
-    def __init__(self, env, period, input_pipes, output_pipe):
+    def __init__(self, env, period, input_pipes, output_pipe, copy_records=True, keep_pkts=True, recorder=None, poll_when_idle=True):
+        """
+        copy_records: record copies of the pkts and metadata as they enter the
+                      switch. If False the recorded objects are the ones sent to
+                      the switch, so their metadata will reflect later updates.
+        keep_pkts: keep every pkt in self.pkts (otherwise they are only counted)
+        recorder: optional object whose record(time, meta, pkt) is called for every pkt
+                  as it enters the switch
+        poll_when_idle: keep checking the input pipes every cycle while they are all
+                        empty. Otherwise sleep until a pkt is put into one of them and
+                        resume at the start of the next cycle, which saves the idle
+                        events but can forward the pkt a cycle later than polling.
+        """
         super(Arbiter, self).__init__(env, period)
         self.input_pipes = input_pipes
         self.output_pipe = output_pipe
+        self.copy_records = copy_records
+        self.keep_pkts = keep_pkts
+        self.recorder = recorder
+        self.poll_when_idle = poll_when_idle
         self.pkts = []
+        self.pkt_cnt = 0
 
         self.run()
 
@@ -149,13 +344,47 @@ class Arbiter(HW_sim_object):
         """
         Arbitrate between the input pipes and create one output pipe
         """
+        num_pipes = len(self.input_pipes)
+        i = 0
         while not self.sim_done:
-            for pipe in self.input_pipes:
-                if len(pipe.items) > 0:
-                    (meta, pkt) = yield pipe.get()
-                    self.output_pipe.put((meta, pkt))
-                    self.pkts.append((self.env.now, deepcopy(meta), pkt.copy()))
-                yield self.wait_clock()
+            pipe = self.input_pipes[i]
+            if len(pipe.items) > 0:
+                (meta, pkt) = yield pipe.get()
+                self.output_pipe.put((meta, pkt))
+                self.pkt_cnt += 1
+                if self.keep_pkts and self.copy_records:
+                    self.pkts.append((self.env.now, meta.clone(), pkt.copy()))
+                elif self.keep_pkts:
+                    self.pkts.append((self.env.now, meta, pkt))
+                if self.recorder is not None:
+                    self.recorder.record(self.env.now, meta, pkt)
+            elif self.can_sleep():
+                # sleep until a pkt arrives and then pick up the round robin
+                # in the next cycle where it would have been if we had kept polling
+                start = self.env.now
+                yield self.wait_input()
+                yield self.wait_next_cycle()
+                i = (i + int((self.env.now - start)/self.period)) % num_pipes
+                continue
+            yield self.wait_clock()
+            i = (i + 1) % num_pipes
+
+    def can_sleep(self):
+        """
+        The arbiter may sleep if all inputs are empty and can notify it on arrival
+        """
+        if self.poll_when_idle:
+            return False
+        for pipe in self.input_pipes:
+            if len(pipe.items) > 0 or not isinstance(pipe, NotifyStore):
+                return False
+        return True
+
+    def wait_input(self):
+        wakeup = self.env.event()
+        for pipe in self.input_pipes:
+            pipe.put_listener = wakeup
+        return wakeup
 
 
 
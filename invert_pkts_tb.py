@@ -3,6 +3,7 @@ import simpy
 from hwsim_utils import *
 from switch import Switch
 from switch_tb import Switch_testbench
+from sim_profiler import profile_env
 
 class Invert_pkts_tb(Switch_testbench):
     def __init__(self, env, period):
@@ -57,9 +58,12 @@ class Invert_pkts_tb(Switch_testbench):
 
 def main():
     env = simpy.Environment()
+    profiler = profile_env(env)
     period = 1
     tb = Invert_pkts_tb(env, period)
     env.run()
+    if profiler is not None:
+        profiler.print_report()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,68 @@
+
+import sys
+import math
+import random
+from latency_stats import LatencyHistogram, REPORT_PERCENTILES
+
+NUM_VALUES = 100000
+PERCENTILES = [1, 10, 25] + REPORT_PERCENTILES + [99.99, 100]
+SEED = 1
+
+def distributions(rng):
+    """
+    Returns a list of (name, values) with latencies in cycles
+    """
+    return [('uniform', [rng.randint(0, 100000) for i in range(NUM_VALUES)]),
+            ('exponential', [int(rng.expovariate(1.0/2000)) for i in range(NUM_VALUES)]),
+            ('lognormal', [int(rng.lognormvariate(8, 2)) for i in range(NUM_VALUES)]),
+            ('small', [rng.randint(0, 200) for i in range(NUM_VALUES)])]
+
+def exact_percentile(sorted_values, p):
+    """
+    Smallest value that is at least as large as p percent of the values
+    """
+    rank = max(1, int(math.ceil(p/100.0*len(sorted_values))))
+    return sorted_values[rank - 1]
+
+def check(name, values, precision_bits):
+    """
+    Returns (largest relative error, # of errors) of the histogram percentiles,
+    which must never be below the exact percentile and at most a
+    2^-(precision_bits - 1) fraction above it
+    """
+    hist = LatencyHistogram(precision_bits)
+    for value in values:
+        hist.record(value)
+    sorted_values = sorted(values)
+    bound = 2.0**(1 - precision_bits)
+    max_error = 0.0
+    errors = 0
+    for p in PERCENTILES:
+        exact = exact_percentile(sorted_values, p)
+        approx = hist.percentile(p)
+        error = float(approx - exact)/exact if exact > 0 else float(approx)
+        max_error = max(max_error, error)
+        if approx < exact or error > bound:
+            print 'ERROR: {} {} bits p{}: exact = {}, histogram = {}'.format(name, precision_bits, p, exact, approx)
+            errors += 1
+    return (max_error, errors)
+
+def main():
+    """
+    Check the percentiles of LatencyHistogram against the exact percentiles
+    of several latency distributions
+    """
+    rng = random.Random(SEED)
+    total_errors = 0
+    print '{:<12} {:>5} {:>10} {:>10} {:>8}'.format('values', 'bits', 'max error', 'bound', 'errors')
+    for (name, values) in distributions(rng):
+        for precision_bits in [7, 8]:
+            (max_error, errors) = check(name, values, precision_bits)
+            total_errors += errors
+            print '{:<12} {:>5} {:>9.3f}% {:>9.3f}% {:>8}'.format(name, precision_bits, max_error*100, 2.0**(1 - precision_bits)*100, errors)
+    if total_errors > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
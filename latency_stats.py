@@ -0,0 +1,169 @@
+
+import math
+from array import array
+import numpy as np
+from hwsim_utils import NSEC_PER_CYCLE
+from trace_utils import sport_flowID
+
+# latency components reported by LatencyStats: (name, start timestamp, end timestamp) in StdMetadata
+LATENCY_COMPONENTS = [('total', 'ingress_time', 'egress_time'),
+                      ('queueing', 'enq_time', 'deq_time')]
+REPORT_PERCENTILES = [50, 99, 99.9]
+
+class LatencyHistogram(object):
+    """
+    HDR-style histogram of non-negative integers. Values below
+    2^precision_bits are counted exactly and larger values in buckets that
+    are at most a 2^-(precision_bits - 1) fraction of the value wide (0.78%
+    with the default 8 bits), so the memory used only depends on the largest
+    value, not on the # of values.
+    """
+    def __init__(self, precision_bits=8):
+        self.precision_bits = precision_bits
+        self.sub_buckets = 1 << precision_bits
+        self.counts = array('l')
+        self.total = 0
+        self.sum = 0
+        self.min_value = None
+        self.max_value = None
+
+    def bucket(self, value):
+        if value < self.sub_buckets:
+            return value
+        # the top precision_bits bits of the value pick the bucket
+        shift = value.bit_length() - self.precision_bits
+        half = self.sub_buckets >> 1
+        return self.sub_buckets + (shift - 1)*half + (value >> shift) - half
+
+    def bucket_value(self, index):
+        """
+        Largest value that is counted in bucket index
+        """
+        if index < self.sub_buckets:
+            return index
+        half = self.sub_buckets >> 1
+        (shift, offset) = divmod(index - self.sub_buckets, half)
+        return ((offset + half + 1) << (shift + 1)) - 1
+
+    def record(self, value, count=1):
+        if value < 0:
+            raise ValueError('LatencyHistogram only records non-negative values, got {}'.format(value))
+        value = int(value)
+        index = value if value < self.sub_buckets else self.bucket(value)
+        if index >= len(self.counts):
+            self.counts.extend([0]*(index + 1 - len(self.counts)))
+        self.counts[index] += count
+        self.total += count
+        self.sum += value*count
+        if self.total == count:
+            (self.min_value, self.max_value) = (value, value)
+        elif value < self.min_value:
+            self.min_value = value
+        elif value > self.max_value:
+            self.max_value = value
+
+    def merge(self, other):
+        """
+        Add the counts of another histogram with the same precision_bits
+        """
+        if other.precision_bits != self.precision_bits:
+            raise ValueError('Cannot merge histograms with precision_bits {} and {}'.format(self.precision_bits, other.precision_bits))
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0]*(len(other.counts) - len(self.counts)))
+        for (index, count) in enumerate(other.counts):
+            self.counts[index] += count
+        self.total += other.total
+        self.sum += other.sum
+        for value in (other.min_value, other.max_value):
+            if value is not None:
+                self.min_value = value if self.min_value is None else min(self.min_value, value)
+                self.max_value = value if self.max_value is None else max(self.max_value, value)
+
+    def mean(self):
+        return float(self.sum)/self.total if self.total > 0 else float('nan')
+
+    def percentile(self, p):
+        """
+        Smallest recorded value (up to the bucket width) that is at least as
+        large as p percent of the values
+        """
+        if self.total == 0:
+            return float('nan')
+        rank = max(1, int(math.ceil(p/100.0*self.total)))
+        cum_counts = np.cumsum(np.frombuffer(self.counts, dtype=np.int_))
+        index = int(np.searchsorted(cum_counts, rank))
+        return min(self.bucket_value(index), self.max_value)
+
+
+class LatencyStats(object):
+    """
+    Streaming per-flow latency histograms of the pkts that leave a switch,
+    computed from the StdMetadata timestamps (see LATENCY_COMPONENTS).
+    Latencies are counted in cycles and reported in ns.
+    """
+    def __init__(self, period=1, flowID_func=sport_flowID, precision_bits=8):
+        self.period = period
+        self.flowID_func = flowID_func
+        self.precision_bits = precision_bits
+        # maps component name to a dictionary mapping flowID to its LatencyHistogram
+        self.histograms = dict((name, {}) for (name, start, end) in LATENCY_COMPONENTS)
+        # maps flowID to its (total, queueing) histograms
+        self.flow_histograms = {}
+
+    def record(self, meta, pkt):
+        flowID = self.flowID_func(pkt)
+        hists = self.flow_histograms.get(flowID)
+        if hists is None:
+            hists = self.add_flow(flowID)
+        (total, queueing) = hists
+        total.record((meta.egress_time - meta.ingress_time)/self.period)
+        queueing.record((meta.deq_time - meta.enq_time)/self.period)
+
+    def add_flow(self, flowID):
+        hists = []
+        for (name, start, end) in LATENCY_COMPONENTS:
+            hist = LatencyHistogram(self.precision_bits)
+            self.histograms[name][flowID] = hist
+            hists.append(hist)
+        self.flow_histograms[flowID] = hists
+        return hists
+
+    def flowIDs(self):
+        return sorted(self.flow_histograms.keys())
+
+    def histogram(self, component='total', flowID=None):
+        """
+        Histogram of one flow, or of all flows merged if flowID is None
+        """
+        flows = self.histograms[component]
+        if flowID is not None:
+            return flows[flowID]
+        merged = LatencyHistogram(self.precision_bits)
+        for hist in flows.values():
+            merged.merge(hist)
+        return merged
+
+    def percentiles(self, component='total', percentiles=REPORT_PERCENTILES, flowID=None):
+        """
+        Returns the latency percentiles in ns
+        """
+        hist = self.histogram(component, flowID)
+        return [hist.percentile(p)*NSEC_PER_CYCLE for p in percentiles]
+
+    def report(self, percentiles=REPORT_PERCENTILES):
+        """
+        Returns a list of (flowID, component, # pkts, mean, percentiles...) rows
+        with latencies in ns, flowID 'all' is the merge of all flows
+        """
+        rows = []
+        for flowID in ['all'] + self.flowIDs():
+            for (name, start, end) in LATENCY_COMPONENTS:
+                hist = self.histogram(name, None if flowID == 'all' else flowID)
+                rows.append((flowID, name, hist.total, hist.mean()*NSEC_PER_CYCLE) +
+                            tuple(hist.percentile(p)*NSEC_PER_CYCLE for p in percentiles))
+        return rows
+
+    def print_report(self, percentiles=REPORT_PERCENTILES):
+        print '{:>6} {:>10} {:>8} {:>10} '.format('flow', 'latency', '# pkts', 'mean (ns)') + ' '.join('{:>10}'.format('p{} (ns)'.format(p)) for p in percentiles)
+        for row in self.report(percentiles):
+            print '{:>6} {:>10} {:>8} {:>10.1f} '.format(*row[:4]) + ' '.join('{:>10.0f}'.format(val) for val in row[4:])
@@ -0,0 +1,72 @@
+
+import os
+import sys
+import simpy
+from fast_sim import FastSwitchSim
+from fast_sim_conformance import compare, compare_metrics
+from sweep import TESTBENCHES
+
+CYCLE_LIMIT = 2000
+# small enough that every testbench drops pkts
+SCHED_NODE_SIZE = 8
+# pkts that can be past the scheduling tree or not in it yet: in the ingress, the egress and on the link
+PIPELINE_PKTS = 3
+
+def drain_cycles(tb):
+    """
+    Upper bound on the cycles needed to send the pkts left in the switch
+    when the input ends: every node full of pkts of the largest size, plus
+    the pkts in the pipelines
+    """
+    max_len = tb.input_columns.arrays()['length'].max()
+    pkt_cycles = int(max_len*8/tb.egress_link_rate/5) + 1
+    return (len(tb.switch.tm.nodes)*SCHED_NODE_SIZE + PIPELINE_PKTS)*pkt_cycles
+
+def check(name, tb_class):
+    """
+    Run a lossy configuration of the testbench in both engines.
+    Returns (# input pkts, # drops, end cycle, # errors).
+    """
+    # the testbenches print their pkt counts and write their pkts to data/
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    env = simpy.Environment()
+    tb = tb_class(env, 1, sched_node_size=SCHED_NODE_SIZE, cycle_limit=CYCLE_LIMIT, keep_pkts=True)
+    env.run()
+    sim = FastSwitchSim.from_testbench(tb_class(simpy.Environment(), 1, sched_node_size=SCHED_NODE_SIZE, cycle_limit=CYCLE_LIMIT, keep_pkts=False))
+    sim.run()
+    sys.stdout = stdout
+
+    drops = tb.switch.tm.drop_cnt
+    errors = 0
+    if drops == 0:
+        print 'ERROR: {}: no pkts were dropped'.format(name)
+        errors += 1
+    if tb.receiver.pkt_cnt + drops != tb.arbiter.pkt_cnt:
+        print 'ERROR: {}: {} input pkts, {} output pkts, {} drops'.format(name, tb.arbiter.pkt_cnt, tb.receiver.pkt_cnt, drops)
+        errors += 1
+    # the testbench must stop once the pkts that were not dropped are out rather than time out
+    max_cycles = CYCLE_LIMIT + drain_cycles(tb)
+    if env.now > max_cycles:
+        print 'ERROR: {}: ran until cycle {}, expected at most {}'.format(name, env.now, max_cycles)
+        errors += 1
+    errors += compare(name + ' output', tb.receiver.pkts, sim.output_pkts)
+    errors += compare_metrics(name, tb.switch.tm.metrics(), sim.metrics(env.now))
+    return (tb.arbiter.pkt_cnt, drops, env.now, errors)
+
+def main():
+    """
+    Check that the testbenches end soon after the cycle limit when the
+    scheduling tree drops pkts, and that the fast engine drops the same pkts
+    """
+    results = [(name,) + check(name, getattr(__import__(module), cls)) for (name, (module, cls)) in sorted(TESTBENCHES.items())]
+
+    print '{:<10} {:>8} {:>8} {:>8} {:>8}'.format('testbench', '# pkts', 'drops', 'cycles', 'errors')
+    for result in results:
+        print '{:<10} {:>8} {:>8} {:>8} {:>8}'.format(*result)
+    if sum(result[-1] for result in results) > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+
+import sys, subprocess, resource
+from copy import deepcopy
+from timeit import default_timer as timer
+from hwsim_utils import StdMetadata
+from p4_ingress import HSTFQMeta
+
+NUM_PKTS = 1000000
+
+class LegacyStdMetadata(object):
+    """
+    StdMetadata and HSTFQMeta as they were before __slots__ and clone()
+    """
+    def __init__(self, pkt_len, src_port, dst_port, ranks, leaf_node, sched_meta=None):
+        self.pkt_len = pkt_len
+        self.src_port = src_port
+        self.dst_port = dst_port
+        self.ranks = ranks
+        self.leaf_node = leaf_node
+        self.sched_meta = sched_meta
+
+class LegacyHSTFQMeta(object):
+    def __init__(self):
+        self.flow_start = 0
+        self.class_start = 0
+
+def copy_metadata(mode, num_pkts):
+    """
+    Make the two metadata copies per pkt that the generator and arbiter make
+    (one that is sent through the switch and one that is recorded)
+    """
+    copies = []
+    if mode == 'before':
+        base_meta = LegacyStdMetadata(64, 0b00000001, 0b00000100, [0, 0], 0, sched_meta=LegacyHSTFQMeta())
+        for i in range(num_pkts):
+            meta = deepcopy(base_meta)
+            copies.append((meta, deepcopy(meta)))
+    else:
+        base_meta = StdMetadata(64, 0b00000001, 0b00000100, [0, 0], 0, sched_meta=HSTFQMeta())
+        for i in range(num_pkts):
+            meta = base_meta.clone()
+            copies.append((meta, meta.clone()))
+    return copies
+
+def measure(mode, num_pkts):
+    """
+    Returns (time in seconds, bytes allocated). Uses tracemalloc where it is
+    available and the growth of the peak RSS otherwise.
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = timer()
+    copies = copy_metadata(mode, num_pkts)
+    elapsed = timer() - start
+    if tracemalloc is not None:
+        (current, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    else:
+        peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before)*1024
+    return (elapsed, peak)
+
+def main():
+    """
+    Compare deepcopy of the original dict based metadata with clone of the
+    __slots__ metadata for a 1M pkt run. Each mode runs in
+    its own process so that the memory measurements are independent.
+    """
+    if len(sys.argv) == 3:
+        (elapsed, peak) = measure(sys.argv[1], int(sys.argv[2]))
+        print elapsed, peak
+        return
+
+    results = {}
+    for mode in ['before', 'after']:
+        out = subprocess.check_output([sys.executable, __file__, mode, str(NUM_PKTS)])
+        (elapsed, peak) = out.split()
+        results[mode] = (float(elapsed), int(peak))
+
+    print '{:<10} {:>10} {:>12}'.format('mode', 'time (s)', 'memory (MB)')
+    for mode in ['before', 'after']:
+        (elapsed, peak) = results[mode]
+        print '{:<10} {:>10.2f} {:>12.1f}'.format(mode, elapsed, peak/1e6)
+    print 'speedup = {:.1f}x, memory reduction = {:.1f}x'.format(results['before'][0]/results['after'][0], results['before'][1]/float(results['after'][1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import os
+import sys
+import tempfile
+import simpy
+from timeit import default_timer as timer
+from traffic_gen import PoissonTraffic
+from trace_tb import Trace_tb
+
+# sampling intervals (cycles) to compare against running without the sampler
+INTERVALS = [10000, 1000, 100]
+CYCLE_LIMIT = 1000000
+NUM_RUNS = 7
+SEED = 1
+
+def run(metrics_interval=None, metrics_csv=None):
+    """
+    Returns the wall time of an HSTFQ Trace_tb run with Poisson traffic that loads the egress link to 95%
+    """
+    env = simpy.Environment()
+    tb = Trace_tb(env, 1, PoissonTraffic(100, 9.5, seed=SEED), sched_alg="HSTFQ", cycle_limit=CYCLE_LIMIT,
+                  metrics_interval=metrics_interval, metrics_csv=metrics_csv)
+    start = timer()
+    env.run()
+    return timer() - start
+
+def main():
+    """
+    Measure the overhead of sampling the scheduling tree node metrics into
+    ring buffers, and of also streaming them to a CSV file
+    """
+    # the testbench prints its pkt counts
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    csv_file = os.path.join(tempfile.mkdtemp(), 'metrics.csv')
+    configs = [(None, None)] + [(interval, None) for interval in INTERVALS] + [(interval, csv_file) for interval in INTERVALS]
+    # interleave the configurations and keep the best of several runs to filter out noise from other processes
+    times = dict((config, float('inf')) for config in configs)
+    for i in range(NUM_RUNS):
+        for config in configs:
+            times[config] = min(times[config], run(*config))
+    base_time = times[(None, None)]
+    results = [(interval, times[(interval, None)], times[(interval, csv_file)]) for interval in INTERVALS]
+    os.remove(csv_file)
+    os.rmdir(os.path.dirname(csv_file))
+    sys.stdout = stdout
+
+    print 'no sampler: {:.3f} s'.format(base_time)
+    print '{:>10} {:>12} {:>9} {:>12} {:>9}'.format('interval', 'ring (s)', 'overhead', 'CSV (s)', 'overhead')
+    for (interval, ring_time, csv_time) in results:
+        print '{:>10} {:>12.3f} {:>8.1f}% {:>12.3f} {:>8.1f}%'.format(interval, ring_time, (ring_time/base_time - 1)*100,
+                                                                   csv_time, (csv_time/base_time - 1)*100)
+
+
+if __name__ == '__main__':
+    main()
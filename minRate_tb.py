@@ -5,21 +5,27 @@ from switch import Switch
 from switch_tb import Switch_testbench
 from p4_ingress import MinRateIngressState
 from stats_utils import StatsGenerator
-import matplotlib
-import matplotlib.pyplot as plt
+from sim_profiler import profile_env
+
+CYCLE_LIMIT = 5000
+RATES = [1, 2, 10, 25] # Gbps
+SCHED_TREE_SHAPE = {0: [1, 2]}
 
 class MinRate_tb(Switch_testbench):
-    def __init__(self, env, period):
+    def __init__(self, env, period, rates=RATES, flow_min_rate=None, sched_tree_shape=SCHED_TREE_SHAPE, sched_node_size=None, cycle_limit=CYCLE_LIMIT, keep_pkts=True, sched_storage=None):
+        """
+        flow_min_rate: defaults to a min rate of 2 Gbps for every flow
+        """
         super(MinRate_tb, self).__init__(env, period)
 
         self.sched_alg = "MinRate"
-        self.sched_tree_shape = {0: [1, 2]}
-        rates = [1, 2, 10, 25]
-        flow_min_rate = {}
-        for i in range(len(rates)):
-            flow_min_rate[i] = 2
+        self.sched_tree_shape = sched_tree_shape
+        if flow_min_rate is None:
+            flow_min_rate = {}
+            for i in range(len(rates)):
+                flow_min_rate[i] = 2
         istate = MinRateIngressState(flow_min_rate)
-        self.switch = Switch(self.env, self.period, self.sw_ready_out_pipe, self.sw_pkt_in_pipe, self.sw_pkt_out_pipe, self.start_dequeue_pipe, self.sched_tree_shape, self.sched_alg, istate)
+        self.switch = Switch(self.env, self.period, self.sw_ready_out_pipe, self.sw_pkt_in_pipe, self.sw_pkt_out_pipe, self.start_dequeue_pipe, self.sched_tree_shape, self.sched_alg, istate, sched_node_size=sched_node_size, keep_pkts=keep_pkts, sched_storage=sched_storage)
 
         # start dequeueing immediately
         self.start_dequeue_pipe.put(1)
@@ -29,20 +35,20 @@ class MinRate_tb(Switch_testbench):
         self.generators = []
         self.pkt_gen_pipes = []
         for i in range(num_flows):
-            pipe = simpy.Store(env)
+            pipe = NotifyStore(env)
             rate = rates[i] # Gbps
             flowID = i
-            pkt = Ether()/IP()/TCP(sport=flowID)/('\x00'*10)
+            pkt = PktRecord.from_scapy(Ether()/IP()/TCP(sport=flowID)/('\x00'*10))
             ranks = [0, 0]
             meta = StdMetadata(len(pkt), 0b00000001, 0b00000100, ranks, 0)
-            pkt_gen = PktGenerator(env, period, pipe, rate, pkt, meta, cycle_limit=5000)
+            pkt_gen = PktGenerator(env, period, pipe, rate, pkt, meta, cycle_limit=cycle_limit)
             self.generators.append(pkt_gen)
             self.pkt_gen_pipes.append(pipe)
 
         self.egress_link_rate = 10 # Gbps
 
-        self.arbiter = Arbiter(env, period, self.pkt_gen_pipes, self.sw_pkt_in_pipe)
-        self.receiver = PktReceiver(env, period, self.sw_pkt_out_pipe, self.sw_ready_out_pipe, self.egress_link_rate)
+        self.arbiter = Arbiter(env, period, self.pkt_gen_pipes, self.sw_pkt_in_pipe, keep_pkts=keep_pkts, recorder=self.input_columns)
+        self.receiver = PktReceiver(env, period, self.sw_pkt_out_pipe, self.sw_ready_out_pipe, self.egress_link_rate, keep_pkts=keep_pkts, recorder=self.output_columns)
 
         self.env.process(self.wait_complete()) 
 
@@ -51,33 +57,42 @@ class MinRate_tb(Switch_testbench):
         for gen in self.generators:
             yield gen.proc
 
-        # wait for receiver to receive all pkts
-        while len(self.receiver.pkts) < len(self.arbiter.pkts):
+        # wait for receiver to receive all pkts that were not dropped, a
+        # generator ends as soon as it puts its last pkt so the arbiter may not have it yet
+        num_pkts = sum(gen.pkt_cnt for gen in self.generators)
+        timeout_val = 100000 # cycles
+        cnt = 0
+        while self.receiver.pkt_cnt + self.switch.tm.drop_cnt < num_pkts and cnt < timeout_val:
             yield self.wait_clock()
+            cnt += 1
 
         yield self.env.process(self.cleanup_switch())
         self.arbiter.sim_done = True
         self.receiver.sim_done = True
 
-        print '# input pkts = {}'.format(len(self.arbiter.pkts))
+        print '# input pkts = {}'.format(self.arbiter.pkt_cnt)
 #        print 'input pkts:'
 #        for (t, meta, pkt) in self.arbiter.pkts:
 #            print '({}) {}  ||  {}'.format(t, str(meta), pkt.summary())
 
-        print '# output pkts = {}'.format(len(self.receiver.pkts))
+        print '# output pkts = {}'.format(self.receiver.pkt_cnt)
 #        print 'output pkts:'
 #        for (t, meta, pkt) in self.receiver.pkts:
 #            print '({}) {}  ||  {}'.format(t, str(meta), pkt.summary())
 
-def plot_stats(input_pkts, output_pkts, egress_link_rate):
-    # convert cycles to ns and remove metadata from pkt_list
-    input_pkts = [(tup[0]*5, tup[2]) for tup in input_pkts]
-    output_pkts = [(tup[0]*5, tup[2]) for tup in output_pkts]
-    print 'input_pkts:  (start, end) = ({} ns, {} ns)'.format(input_pkts[0][0], input_pkts[-1][0])
-    print 'output_pkts: (start, end) = ({} ns, {} ns)'.format(output_pkts[0][0], output_pkts[-1][0])
-    flowID_tuple = ((IP, 'sport'),)
-    input_stats = StatsGenerator(flowID_tuple, input_pkts)
-    output_stats = StatsGenerator(flowID_tuple, output_pkts)
+def plot_stats(input_columns, output_columns, egress_link_rate):
+    # pyplot is slow to import and only needed to plot
+    import matplotlib
+    import matplotlib.pyplot as plt
+    input_pkts = input_columns.arrays()
+    output_pkts = output_columns.arrays()
+    # convert cycles to ns
+    input_times = input_pkts['time']*5
+    output_times = output_pkts['time']*5
+    print 'input_pkts:  (start, end) = ({} ns, {} ns)'.format(input_times[0], input_times[-1])
+    print 'output_pkts: (start, end) = ({} ns, {} ns)'.format(output_times[0], output_times[-1])
+    input_stats = StatsGenerator.from_arrays(input_times, input_pkts['flow_id'], input_pkts['length'])
+    output_stats = StatsGenerator.from_arrays(output_times, output_pkts['flow_id'], output_pkts['length'])
     # create plots
     fig, axarr = plt.subplots(2)
     plt.sca(axarr[0])
@@ -94,11 +109,14 @@ def plot_stats(input_pkts, output_pkts, egress_link_rate):
 
 def main():
     env = simpy.Environment()
+    profiler = profile_env(env)
     period = 1
     tb = MinRate_tb(env, period)
     env.run()
+    if profiler is not None:
+        profiler.print_report()
 
-    plot_stats(tb.arbiter.pkts, tb.receiver.pkts, tb.egress_link_rate)
+    plot_stats(tb.input_columns, tb.output_columns, tb.egress_link_rate)
 
 
 if __name__ == '__main__':
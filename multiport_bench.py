@@ -0,0 +1,27 @@
+
+from bench_utils import run_tb
+from multiport_tb import MultiPort_tb
+
+PORTS = [1, 4, 16, 64]
+FLOWS_PER_PORT = 4
+CYCLE_LIMIT = 10000
+
+def main():
+    """
+    Scale the # of ports at a fixed load per port and report the simulated
+    egress throughput and the simulation cost per pkt
+    """
+    results = []
+    for num_ports in PORTS:
+        (tb, env, wall) = run_tb(MultiPort_tb, num_ports=num_ports, num_flows=FLOWS_PER_PORT*num_ports, link_rates=[10], cycle_limit=CYCLE_LIMIT)
+        num_pkts = tb.rcvd_pkt_cnt()
+        throughput = sum(stats[3] for stats in tb.port_stats())
+        results.append((num_ports, num_pkts, throughput, wall, num_pkts/wall, float(env.event_cnt)/num_pkts))
+
+    print '{:>6} {:>8} {:>18} {:>9} {:>10} {:>12}'.format('ports', '# pkts', 'egress tput (Gbps)', 'wall (s)', 'pkts/s', 'events/pkt')
+    for result in results:
+        print '{:>6} {:>8} {:>18.2f} {:>9.2f} {:>10.0f} {:>12.1f}'.format(*result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+
+import simpy
+import numpy as np
+from hwsim_utils import *
+from switch import MultiPortSwitch
+from switch_tb import Switch_testbench
+from p4_ingress import STFQMeta, HSTFQMeta, HSTFQIngressState, MinRateIngressState, WRRIngressState
+from shared_buffer import SharedBuffer
+from sim_profiler import profile_env
+
+CYCLE_LIMIT = 20000
+NUM_PORTS = 32
+NUM_FLOWS = 256
+FLOW_RATES = [0.1, 0.2, 0.3, 0.4] # Gbps, assigned round robin to the flows
+LINK_RATES = [10, 1] # Gbps, assigned round robin to the ports
+SCHED_TREE_SHAPE = {0: []}
+# HSTFQ and MinRate put the pkts into one of two classes
+CLASS_TREE_SHAPE = {0: [1, 2]}
+CLASS_WEIGHTS = {0: 1, 1: 1}
+SUPPORTED_SCHED_ALGS = ["RR", "Strict", "STFQ", "HSTFQ", "MinRate", "WRR"]
+
+class MultiPort_tb(Switch_testbench):
+    def __init__(self, env, period, num_ports=NUM_PORTS, num_flows=NUM_FLOWS, flow_rates=FLOW_RATES, link_rates=LINK_RATES,
+                 sched_alg="STFQ", sched_tree_shape=None, sched_node_size=None, cycle_limit=CYCLE_LIMIT,
+                 buffer_size=None, buffer_alpha=1.0, buffer_port_alpha=None, pipelined_writes=False, prefetch_reads=False, sched_storage=None,
+                 metrics_interval=None, metrics_csv=None, flow_weights=None, class_weights=CLASS_WEIGHTS, flow_min_rate=None):
+        """
+        Flow i is sent to port i % num_ports. The flows all share one input
+        (Arbiter) and every port has its own PktReceiver.
+        sched_tree_shape: defaults to CLASS_TREE_SHAPE for HSTFQ and MinRate and a single PIFO otherwise
+        flow_weights: WRR and HSTFQ flow weights, defaults to a weight of 1 for every flow
+        class_weights: HSTFQ class weights
+        flow_min_rate: MinRate min rates, defaults to 2 Gbps for every flow
+        buffer_size: if given, the ports share a SharedBuffer of this many bytes
+                     with dynamic thresholds buffer_alpha (per node) and buffer_port_alpha (per port)
+        pipelined_writes, prefetch_reads, sched_storage, metrics_interval, metrics_csv: see MultiPortSwitch
+        """
+        super(MultiPort_tb, self).__init__(env, period)
+
+        if sched_alg not in SUPPORTED_SCHED_ALGS:
+            raise ValueError('MultiPort_tb supports sched_alg {}, got {}'.format(SUPPORTED_SCHED_ALGS, sched_alg))
+        self.sched_alg = sched_alg
+        if sched_tree_shape is None:
+            sched_tree_shape = CLASS_TREE_SHAPE if sched_alg in ("HSTFQ", "MinRate") else SCHED_TREE_SHAPE
+        self.sched_tree_shape = sched_tree_shape
+        self.num_ports = num_ports
+        self.egress_link_rates = [link_rates[port % len(link_rates)] for port in range(num_ports)]
+
+        self.ready_pipes = [simpy.Store(env) for port in range(num_ports)]
+        self.pkt_out_pipes = [simpy.Store(env) for port in range(num_ports)]
+        self.start_dequeue_pipes = [simpy.Store(env) for port in range(num_ports)]
+        self.buffer = None
+        if buffer_size is not None:
+            self.buffer = SharedBuffer(env, buffer_size, buffer_alpha, buffer_port_alpha)
+        if flow_weights is None:
+            flow_weights = dict((flowID, 1) for flowID in range(num_flows))
+        if flow_min_rate is None:
+            flow_min_rate = dict((flowID, 2) for flowID in range(num_flows))
+        # every port has its own ingress state
+        if sched_alg == "HSTFQ":
+            istates = [HSTFQIngressState(flow_weights, class_weights) for port in range(num_ports)]
+        elif sched_alg == "MinRate":
+            istates = [MinRateIngressState(flow_min_rate) for port in range(num_ports)]
+        elif sched_alg == "WRR":
+            istates = [WRRIngressState(flow_weights) for port in range(num_ports)]
+        else:
+            istates = None
+        self.switch = MultiPortSwitch(self.env, self.period, self.sw_pkt_in_pipe, self.ready_pipes, self.pkt_out_pipes, self.start_dequeue_pipes,
+                                      self.sched_tree_shape, self.sched_alg, istates, sched_node_size=sched_node_size, shared_buffer=self.buffer,
+                                      pipelined_writes=pipelined_writes, prefetch_reads=prefetch_reads, sched_storage=sched_storage,
+                                      metrics_interval=metrics_interval, metrics_csv=metrics_csv)
+
+        # start dequeueing immediately
+        for pipe in self.start_dequeue_pipes:
+            pipe.put(1)
+
+        # create flows
+        self.generators = []
+        self.pkt_gen_pipes = []
+        for flowID in range(num_flows):
+            pipe = NotifyStore(env)
+            rate = flow_rates[flowID % len(flow_rates)] # Gbps
+            port = flowID % num_ports
+            pkt = PktRecord.from_scapy(Ether()/IP()/TCP(sport=flowID)/('\x00'*10))
+            if sched_alg == "HSTFQ":
+                meta = StdMetadata(len(pkt), 0b00000001, 1 << port, [0, 0], 0, sched_meta=HSTFQMeta())
+            elif sched_alg == "MinRate":
+                meta = StdMetadata(len(pkt), 0b00000001, 1 << port, [0, 0], 0)
+            else:
+                sched_meta = STFQMeta() if sched_alg == "STFQ" else None
+                meta = StdMetadata(len(pkt), 0b00000001, 1 << port, [0], 0, sched_meta=sched_meta)
+            pkt_gen = PktGenerator(env, period, pipe, rate, pkt, meta, cycle_limit=cycle_limit)
+            self.generators.append(pkt_gen)
+            self.pkt_gen_pipes.append(pipe)
+
+        self.arbiter = Arbiter(env, period, self.pkt_gen_pipes, self.sw_pkt_in_pipe, keep_pkts=False, recorder=self.input_columns)
+        # all ports record into output_columns, the flowID identifies the port
+        self.receivers = []
+        for port in range(num_ports):
+            receiver = PktReceiver(env, period, self.pkt_out_pipes[port], self.ready_pipes[port], self.egress_link_rates[port],
+                                   keep_pkts=False, recorder=self.output_columns)
+            self.receivers.append(receiver)
+
+        self.env.process(self.wait_complete())
+
+    def rcvd_pkt_cnt(self):
+        return sum(receiver.pkt_cnt for receiver in self.receivers)
+
+    def drop_cnt(self):
+        return self.switch.drop_cnt + sum(port.tm.drop_cnt for port in self.switch.ports)
+
+    def wait_complete(self):
+        # wait for all pkts to be inserted
+        for gen in self.generators:
+            yield gen.proc
+
+        # wait for the receivers to receive all pkts that were not dropped, a
+        # generator ends as soon as it puts its last pkt so the arbiter may not have it yet
+        num_pkts = sum(gen.pkt_cnt for gen in self.generators)
+        timeout_val = 1000000 # cycles
+        cnt = 0
+        while self.rcvd_pkt_cnt() + self.drop_cnt() < num_pkts and cnt < timeout_val:
+            yield self.wait_clock()
+            cnt += 1
+
+        yield self.env.process(self.cleanup_switch())
+        self.arbiter.sim_done = True
+        for receiver in self.receivers:
+            receiver.sim_done = True
+
+        print '# input pkts = {}'.format(self.arbiter.pkt_cnt)
+        print '# output pkts = {}'.format(self.rcvd_pkt_cnt())
+        print '# dropped pkts = {}'.format(self.drop_cnt())
+
+    def port_stats(self):
+        """
+        Returns a list of (port, link rate, # pkts, throughput in Gbps) over the whole run
+        """
+        input_pkts = self.input_columns.arrays()
+        output_pkts = self.output_columns.arrays()
+        duration = (output_pkts['time'][-1] - input_pkts['time'][0])*NSEC_PER_CYCLE
+        ports = output_pkts['flow_id'] % self.num_ports
+        port_bytes = np.bincount(ports, weights=output_pkts['length'], minlength=self.num_ports)
+        stats = []
+        for port in range(self.num_ports):
+            stats.append((port, self.egress_link_rates[port], self.receivers[port].pkt_cnt, port_bytes[port]*8.0/duration))
+        return stats
+
+
+def main():
+    env = simpy.Environment()
+    profiler = profile_env(env)
+    period = 1
+    tb = MultiPort_tb(env, period)
+    env.run()
+    if profiler is not None:
+        profiler.print_report()
+
+    print '{:>6} {:>12} {:>8} {:>8} {:>16}'.format('port', 'link (Gbps)', '# pkts', '# drops', 'throughput (Gbps)')
+    for (port, link_rate, num_pkts, throughput) in tb.port_stats():
+        num_drops = tb.switch.ports[port].tm.drop_cnt
+        print '{:>6} {:>12} {:>8} {:>8} {:>16.3f}'.format(port, link_rate, num_pkts, num_drops, throughput)
+
+
+if __name__ == '__main__':
+    main()
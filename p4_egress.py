@@ -1,9 +1,13 @@
 
 import simpy
 from hwsim_utils import *
+from sched_algs import get_sched_alg
 
 class EgressPipe(HW_sim_object):
-    def __init__(self, env, period, ready_in_pipe, ready_out_pipe, pkt_in_pipe, pkt_out_pipe, start_dequeue_pipe, global_state, sched_alg):
+    def __init__(self, env, period, ready_in_pipe, ready_out_pipe, pkt_in_pipe, pkt_out_pipe, start_dequeue_pipe, global_state, sched_alg, latency=None):
+        """
+        latency: optional LatencyStats that every outgoing pkt is recorded in
+        """
         super(EgressPipe, self).__init__(env, period)
         self.ready_in_pipe = ready_in_pipe
         self.ready_out_pipe = ready_out_pipe
@@ -14,6 +18,8 @@ class EgressPipe(HW_sim_object):
 
         self.gstate = global_state
         self.sched_alg = sched_alg
+        self.alg_egress = get_sched_alg(sched_alg).egress
+        self.latency = latency
 
         # register processes for simulation
         self.run()
@@ -36,40 +42,11 @@ class EgressPipe(HW_sim_object):
             (meta, pkt) = yield self.pkt_in_pipe.get()
 
             # This is where the post-scheduling algorithm goes
-            if self.sched_alg == "Invert_pkts":
-                yield self.env.process(self.invert_pkts_egress(meta, pkt))
-            elif self.sched_alg == "STFQ":
-                yield self.env.process(self.STFQ_egress(meta, pkt))
-            elif self.sched_alg == "HSTFQ":
-                # TODO: HSTFQ actually seems to work pretty well without this... why???
-                yield self.env.process(self.HSTFQ_egress(meta, pkt)) 
+            if self.alg_egress is not None:
+                yield self.env.process(self.alg_egress(self, meta, pkt))
 
+            meta.egress_time = self.env.now
+            if self.latency is not None:
+                self.latency.record(meta, pkt)
             # write metadata and pkt out
             self.pkt_out_pipe.put((meta, pkt))
-
-    def invert_pkts_egress(self, meta, pkt):
-        print 'meta = {}'.format(str(meta))
-        print 'pkt_id = {}'.format(pkt[IP].id)
-        yield self.wait_clock()
-
-    def STFQ_egress(self, meta, pkt):
-        """
-        Egress processing for Start Time Fair Queueing
-        """
-        self.gstate.virtual_time = meta.sched_meta.start
-        yield self.wait_clock()
-
-    def HSTFQ_egress(self, meta, pkt):
-        """
-        Egress processing for Hierarchical Start Time Fair Queueing
-        """
-        classID = pkt.sport % 2
-        self.gstate.flow_virtual_time[classID] = meta.sched_meta.flow_start
-        self.gstate.class_virtual_time = meta.sched_meta.class_start
-        yield self.wait_clock()
-
-
-
-
-
-
@@ -0,0 +1,68 @@
+
+import random
+from timeit import default_timer as timer
+from heapq import heappush, heapify
+from pifo_storage import MinMaxHeap, make_storage, bounded_push, DROP_POLICIES
+
+SIZES = [64, 1024, 16384, 262144, 1048576]
+SEED = 1
+
+def legacy_overflow(values, rank, data):
+    """The original list+heapq write path of a full PIFO"""
+    heappush(values, (rank, data))
+    values.remove(max(values))
+    heapify(values)
+
+def bench_legacy(size, num_ops):
+    rng = random.Random(SEED)
+    values = [(rng.random(), i) for i in range(size)]
+    heapify(values)
+    ranks = [rng.random() for i in range(num_ops)]
+    start = timer()
+    for i in range(num_ops):
+        legacy_overflow(values, ranks[i], i)
+    return num_ops/(timer() - start)
+
+def bench_minmax(size, num_ops):
+    rng = random.Random(SEED)
+    values = MinMaxHeap()
+    for i in range(size):
+        values.push((rng.random(), i))
+    ranks = [rng.random() for i in range(num_ops)]
+    start = timer()
+    for i in range(num_ops):
+        values.pushpop_max((ranks[i], i))
+    return num_ops/(timer() - start)
+
+def bench_policy(size, num_ops, drop_policy):
+    rng = random.Random(SEED)
+    values = make_storage(size, drop_policy)
+    for i in range(size):
+        values.push((rng.random(), i))
+    ranks = [rng.random() for i in range(num_ops)]
+    start = timer()
+    for i in range(num_ops):
+        bounded_push(values, size, drop_policy, (ranks[i], i))
+    return num_ops/(timer() - start)
+
+def main():
+    """
+    Measure the throughput of writes into a full PIFO (every write causes a drop)
+    """
+    print '{:>10} {:>18} {:>18} {:>10}'.format('size', 'list+heapq (op/s)', 'min-max (op/s)', 'speedup')
+    for size in SIZES:
+        # the legacy path is O(n) per write so scale down the # of ops for large sizes
+        legacy_ops = max(10, min(10000, 10**7 // size))
+        legacy_rate = bench_legacy(size, legacy_ops)
+        minmax_rate = bench_minmax(size, 100000)
+        print '{:>10} {:>18.0f} {:>18.0f} {:>9.1f}x'.format(size, legacy_rate, minmax_rate, minmax_rate/legacy_rate)
+
+    print
+    print '{:>10} '.format('size') + ' '.join('{:>18}'.format(policy + ' (op/s)') for policy in DROP_POLICIES)
+    for size in SIZES:
+        rates = [bench_policy(size, 100000, policy) for policy in DROP_POLICIES]
+        print '{:>10} '.format(size) + ' '.join('{:>18.0f}'.format(rate) for rate in rates)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+
+import csv
+from collections import namedtuple
+import numpy as np
+from hwsim_utils import HW_sim_object
+
+class PIFOMetrics(namedtuple('PIFOMetrics', ['enq_cnt', 'deq_cnt', 'drop_cnt', 'depth', 'max_depth', 'avg_depth', 'stall_cycles'])):
+    """
+    Snapshot of the counters of a PIFO:
+      enq_cnt, deq_cnt: # of entries written into and read out of the PIFO
+      drop_cnt: # of writes that found the PIFO full
+      depth, max_depth: current and highest # of entries held
+      avg_depth: time-weighted average # of entries held
+      stall_cycles: cycles that reads spent waiting for an entry to be written
+    """
+    __slots__ = ()
+
+
+class PIFOCounters(object):
+    """
+    Mixin that maintains the PIFOMetrics counters of a PIFO, the class must
+    set self.env (or a stand in with a now attribute), self.period,
+    self.values and self.drop_cnt.
+    """
+    def init_counters(self):
+        self.enq_cnt = 0
+        self.deq_cnt = 0
+        self.stall_cycles = 0
+        self.depth = len(self.values)
+        self.max_depth = self.depth
+        # integral of the depth over time from start_time to depth_time
+        self.start_time = self.env.now
+        self.depth_time = self.env.now
+        self.depth_area = 0
+
+    def depth_changed(self):
+        """
+        Must be called whenever entries are added to or removed from self.values
+        """
+        now = self.env.now
+        self.depth_area += self.depth*(now - self.depth_time)
+        self.depth_time = now
+        self.depth = len(self.values)
+        if self.depth > self.max_depth:
+            self.max_depth = self.depth
+
+    def metrics(self):
+        now = self.env.now
+        area = self.depth_area + self.depth*(now - self.depth_time)
+        avg_depth = float(area)/(now - self.start_time) if now > self.start_time else float(self.depth)
+        return PIFOMetrics(self.enq_cnt, self.deq_cnt, self.drop_cnt, self.depth, self.max_depth, avg_depth, self.stall_cycles)
+
+
+class PIFOMetricsSampler(HW_sim_object):
+    """
+    Samples the PIFOMetrics of every node of a Scheduling_tree every interval
+    cycles into ring buffers that hold the last capacity samples, so it can be
+    left on in long runs. Stops when the tree does.
+    """
+    def __init__(self, env, period, tree, interval=1000, capacity=1024, csv_file=None, hooks=None):
+        """
+        csv_file: optional file name to stream every sample to, one row per node
+        hooks: optional list of callables that are called as hook(cycle, samples)
+               after every sample, where samples maps node ID to its PIFOMetrics
+        """
+        super(PIFOMetricsSampler, self).__init__(env, period)
+        self.tree = tree
+        self.interval = interval
+        self.capacity = capacity
+        self.hooks = hooks if hooks is not None else []
+        self.node_IDs = sorted(tree.nodes.keys())
+        self.nodes = [tree.nodes[ID] for ID in self.node_IDs]
+        self.cycles = np.zeros(capacity, dtype=np.int64)
+        self.samples = np.zeros((capacity, len(self.nodes), len(PIFOMetrics._fields)))
+        self.sample_cnt = 0
+
+        self.csv_file = None
+        self.csv_writer = None
+        if csv_file is not None:
+            self.csv_file = open(csv_file, 'wb')
+            self.csv_writer = csv.writer(self.csv_file)
+            self.csv_writer.writerow(['cycle', 'node'] + list(PIFOMetrics._fields))
+
+        # register processes for simulation
+        self.run()
+
+    def run(self):
+        self.env.process(self.sample_metrics())
+
+    def sample_metrics(self):
+        while not self.sim_done and not self.tree.sim_done:
+            yield self.wait_cycles(self.interval)
+            if not self.sim_done:
+                self.sample()
+        self.close()
+
+    def sample(self):
+        cycle = int(self.env.now/self.period)
+        row = self.sample_cnt % self.capacity
+        self.cycles[row] = cycle
+        metrics = [node.metrics() for node in self.nodes]
+        self.samples[row] = metrics
+        self.sample_cnt += 1
+        if self.csv_writer is not None:
+            self.csv_writer.writerows((cycle, ID) + node_metrics for (ID, node_metrics) in zip(self.node_IDs, metrics))
+        if len(self.hooks) > 0:
+            samples = dict(zip(self.node_IDs, metrics))
+            for hook in self.hooks:
+                hook(cycle, samples)
+
+    def close(self):
+        """
+        Take a last sample and close the CSV file
+        """
+        if self.sim_done:
+            return
+        self.sim_done = True
+        if self.sample_cnt == 0 or self.cycles[(self.sample_cnt - 1) % self.capacity] < int(self.env.now/self.period):
+            self.sample()
+        if self.csv_file is not None:
+            self.csv_file.close()
+
+    def dump(self):
+        """
+        Returns (cycles, samples) of the samples held in the ring buffers, oldest first:
+        cycles is an array and samples maps node ID to a dictionary mapping each
+        PIFOMetrics field to an array
+        """
+        num_samples = min(self.sample_cnt, self.capacity)
+        rows = (self.sample_cnt - num_samples + np.arange(num_samples)) % self.capacity
+        samples = {}
+        for (i, ID) in enumerate(self.node_IDs):
+            samples[ID] = dict((field, self.samples[rows, i, j]) for (j, field) in enumerate(PIFOMetrics._fields))
+        return (self.cycles[rows], samples)
@@ -0,0 +1,421 @@
+
+from collections import deque, namedtuple
+from heapq import heappush, heappop, heappushpop, heapify
+
+# what a full PIFO drops when a new entry arrives
+DROP_MAX = 'max'   # the max rank entry (possibly the new one)
+DROP_TAIL = 'tail' # the new entry
+DROP_HEAD = 'head' # the min rank entry, i.e. the next one to be dequeued (possibly the new one)
+DROP_POLICIES = (DROP_MAX, DROP_TAIL, DROP_HEAD)
+
+# PIFO storage engines, the default picks a heap based on how the PIFO is used
+HEAP_STORAGE = 'heap'
+CALENDAR_STORAGE = 'calendar'
+STORAGES = (HEAP_STORAGE, CALENDAR_STORAGE)
+
+class PIFOEntry(namedtuple('PIFOEntry', ['rank', 'seq', 'data'])):
+    """
+    Entry of a PIFO. seq is the # of entries written into the PIFO before
+    this one, so entries with equal ranks leave in FIFO order and the data
+    (a (meta, pkt) tuple or a child node ID) is never compared.
+    """
+    __slots__ = ()
+
+class HeapStorage(object):
+    """
+    Unbounded PIFO storage backed by a binary heap (heapq). Removing the
+    maximum entry is O(n), so this should only be used for nodes that never
+    need to evict.
+    """
+    def __init__(self):
+        self.heap = []
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __iter__(self):
+        return iter(self.heap)
+
+    def push(self, item):
+        heappush(self.heap, item)
+
+    def restore(self, item):
+        """Put back an entry that was just popped"""
+        heappush(self.heap, item)
+
+    def pop(self):
+        return heappop(self.heap)
+
+    def peek(self):
+        return self.heap[0]
+
+    def pushpop_min(self, item):
+        """
+        Insert item and then remove the min entry, returning the entry that
+        was removed (which may be item itself)
+        """
+        return heappushpop(self.heap, item)
+
+    def pop_max(self):
+        item = max(self.heap)
+        self.heap.remove(item)
+        heapify(self.heap)
+        return item
+
+    def peek_max(self):
+        return max(self.heap)
+
+
+class MinMaxHeap(object):
+    """
+    Double-ended priority queue implemented as a min-max heap. Entries on even
+    levels are smaller than all of their descendants and entries on odd levels
+    are larger than all of their descendants, so both the minimum and the
+    maximum can be found in O(1) and removed in O(log n).
+    """
+    def __init__(self):
+        self.heap = []
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __iter__(self):
+        return iter(self.heap)
+
+    def push(self, item):
+        self.heap.append(item)
+        self._bubble_up(len(self.heap) - 1)
+
+    def restore(self, item):
+        """Put back an entry that was just popped"""
+        self.push(item)
+
+    def pop(self):
+        """Remove and return the min entry"""
+        return self._remove(0)
+
+    def peek(self):
+        return self.heap[0]
+
+    def pushpop_min(self, item):
+        """
+        Insert item and then remove the min entry, returning the entry that
+        was removed (which may be item itself)
+        """
+        if len(self.heap) == 0 or not self.heap[0] < item:
+            return item
+        evicted = self.heap[0]
+        self.heap[0] = item
+        self._trickle_down(0)
+        return evicted
+
+    def pop_max(self):
+        """Remove and return the max entry"""
+        return self._remove(self._max_index())
+
+    def peek_max(self):
+        return self.heap[self._max_index()]
+
+    def pushpop_max(self, item):
+        """
+        Insert item and then remove the max entry, returning the entry that
+        was removed (which may be item itself)
+        """
+        if len(self.heap) == 0 or not item < self.peek_max():
+            return item
+        evicted = self.pop_max()
+        self.push(item)
+        return evicted
+
+    def _max_index(self):
+        n = len(self.heap)
+        if n == 0:
+            raise IndexError('pop from empty heap')
+        elif n == 1:
+            return 0
+        elif n == 2 or self.heap[1] > self.heap[2]:
+            return 1
+        else:
+            return 2
+
+    def _remove(self, i):
+        heap = self.heap
+        last = heap.pop()
+        if i == len(heap):
+            return last
+        item = heap[i]
+        heap[i] = last
+        self._trickle_down(i)
+        return item
+
+    @staticmethod
+    def _is_min_level(i):
+        return ((i + 1).bit_length() - 1) % 2 == 0
+
+    def _bubble_up(self, i):
+        heap = self.heap
+        if i == 0:
+            return
+        p = (i - 1) // 2
+        if self._is_min_level(i):
+            if heap[i] > heap[p]:
+                heap[i], heap[p] = heap[p], heap[i]
+                self._bubble_up_max(p)
+            else:
+                self._bubble_up_min(i)
+        else:
+            if heap[i] < heap[p]:
+                heap[i], heap[p] = heap[p], heap[i]
+                self._bubble_up_min(p)
+            else:
+                self._bubble_up_max(i)
+
+    def _bubble_up_min(self, i):
+        heap = self.heap
+        while i > 2:
+            gp = ((i - 1) // 2 - 1) // 2
+            if heap[i] < heap[gp]:
+                heap[i], heap[gp] = heap[gp], heap[i]
+                i = gp
+            else:
+                return
+
+    def _bubble_up_max(self, i):
+        heap = self.heap
+        while i > 2:
+            gp = ((i - 1) // 2 - 1) // 2
+            if heap[i] > heap[gp]:
+                heap[i], heap[gp] = heap[gp], heap[i]
+                i = gp
+            else:
+                return
+
+    def _trickle_down(self, i):
+        if self._is_min_level(i):
+            self._trickle_down_min(i)
+        else:
+            self._trickle_down_max(i)
+
+    def _descendants(self, i):
+        """Indices of the children and grandchildren of i"""
+        n = len(self.heap)
+        first = 2*i + 1
+        indices = [c for c in (first, first + 1) if c < n]
+        for c in (first, first + 1):
+            g = 2*c + 1
+            indices.extend(x for x in (g, g + 1) if x < n)
+        return indices
+
+    def _trickle_down_min(self, i):
+        heap = self.heap
+        while True:
+            indices = self._descendants(i)
+            if len(indices) == 0:
+                return
+            m = min(indices, key=heap.__getitem__)
+            if not heap[m] < heap[i]:
+                return
+            heap[i], heap[m] = heap[m], heap[i]
+            if m <= 2*i + 2:
+                # m is a child of i
+                return
+            p = (m - 1) // 2
+            if heap[m] > heap[p]:
+                heap[m], heap[p] = heap[p], heap[m]
+            i = m
+
+    def _trickle_down_max(self, i):
+        heap = self.heap
+        while True:
+            indices = self._descendants(i)
+            if len(indices) == 0:
+                return
+            m = max(indices, key=heap.__getitem__)
+            if not heap[m] > heap[i]:
+                return
+            heap[i], heap[m] = heap[m], heap[i]
+            if m <= 2*i + 2:
+                # m is a child of i
+                return
+            p = (m - 1) // 2
+            if heap[m] < heap[p]:
+                heap[m], heap[p] = heap[p], heap[m]
+            i = m
+
+
+def check_rank(rank):
+    if not isinstance(rank, (int, long)):
+        raise ValueError('Calendar queue storage needs integer ranks, got {!r}, use {} storage for sched_algs with non-integer ranks '
+                         '(e.g. STFQ with non-integer weights)'.format(rank, HEAP_STORAGE))
+
+class CalendarQueue(object):
+    """
+    PIFO storage for integer ranks backed by a calendar queue: a circular array
+    of FIFO buckets, one per rank, covering a window of num_buckets ranks that
+    starts at the smallest rank that may be queued. Entries with ranks beyond
+    the window wait in an overflow heap until the window reaches them.
+    Enqueue and dequeue are O(1) amortized as long as the queued ranks span
+    less than num_buckets, and entries with equal ranks leave in FIFO order
+    without their data ever being compared.
+    """
+    def __init__(self, num_buckets=1024):
+        self.num_buckets = num_buckets
+        self.buckets = [deque() for i in range(num_buckets)]
+        # the window holds the ranks [lo, lo + num_buckets)
+        self.lo = 0
+        self.window_cnt = 0
+        # (rank, seq, item) of the entries beyond the window, seq keeps them in FIFO order
+        self.overflow = []
+        self.seq = 0
+        self.front_seq = 0
+
+    def __len__(self):
+        return self.window_cnt + len(self.overflow)
+
+    def __iter__(self):
+        for bucket in self.buckets:
+            for item in bucket:
+                yield item
+        for (rank, seq, item) in self.overflow:
+            yield item
+
+    def push(self, item):
+        rank = item[0]
+        lo = self.lo
+        if lo <= rank < lo + self.num_buckets and self.window_cnt > 0:
+            # common case: within the window of a non-empty queue,
+            # where a non-integer rank fails to index the buckets
+            try:
+                self.buckets[rank % self.num_buckets].append(item)
+            except TypeError:
+                check_rank(rank)
+                raise
+            self.window_cnt += 1
+            return
+        check_rank(rank)
+        if len(self) == 0:
+            self.lo = rank
+        elif rank < lo:
+            self._move_window(rank)
+        if rank < self.lo + self.num_buckets:
+            self.buckets[rank % self.num_buckets].append(item)
+            self.window_cnt += 1
+        else:
+            heappush(self.overflow, (rank, self.seq, item))
+            self.seq += 1
+
+    def restore(self, item):
+        """Put back an entry that was just popped, ahead of the entries with the same rank"""
+        rank = item[0]
+        if len(self) == 0:
+            self.lo = rank
+        elif rank < self.lo:
+            self._move_window(rank)
+        if rank < self.lo + self.num_buckets:
+            self.buckets[rank % self.num_buckets].appendleft(item)
+            self.window_cnt += 1
+        else:
+            self.front_seq -= 1
+            heappush(self.overflow, (rank, self.front_seq, item))
+
+    def pop(self):
+        bucket = self.buckets[self.lo % self.num_buckets]
+        if len(bucket) == 0:
+            bucket = self._min_bucket()
+        self.window_cnt -= 1
+        return bucket.popleft()
+
+    def peek(self):
+        return self._min_bucket()[0]
+
+    def pushpop_min(self, item):
+        """
+        Insert item and then remove the min entry, returning the entry that
+        was removed (which may be item itself)
+        """
+        if len(self) == 0 or item[0] < self.peek()[0]:
+            return item
+        evicted = self.pop()
+        self.push(item)
+        return evicted
+
+    def _min_bucket(self):
+        """
+        Advance the window to the smallest queued rank and return its bucket
+        """
+        if len(self) == 0:
+            raise IndexError('pop from empty calendar queue')
+        if self.window_cnt == 0:
+            # skip ahead to the first entry beyond the window
+            self.lo = self.overflow[0][0]
+            self._fill_window()
+        bucket = self.buckets[self.lo % self.num_buckets]
+        while len(bucket) == 0:
+            self.lo += 1
+            self._fill_window()
+            bucket = self.buckets[self.lo % self.num_buckets]
+        return bucket
+
+    def _fill_window(self):
+        """
+        Move the overflow entries that are now within the window into their buckets
+        """
+        end = self.lo + self.num_buckets
+        while len(self.overflow) > 0 and self.overflow[0][0] < end:
+            (rank, seq, item) = heappop(self.overflow)
+            self.buckets[rank % self.num_buckets].append(item)
+            self.window_cnt += 1
+
+    def _move_window(self, lo):
+        """
+        Move the start of the window back to lo, the entries that no longer
+        fit are moved to the overflow (ahead of any that are already there)
+        """
+        start = max(lo + self.num_buckets, self.lo)
+        for rank in range(self.lo + self.num_buckets - 1, start - 1, -1):
+            bucket = self.buckets[rank % self.num_buckets]
+            while len(bucket) > 0:
+                self.front_seq -= 1
+                heappush(self.overflow, (rank, self.front_seq, bucket.pop()))
+                self.window_cnt -= 1
+        self.lo = lo
+
+
+def make_storage(max_size=None, drop_policy=DROP_MAX, pop_max=False, storage=None, num_buckets=1024):
+    """
+    Pick the storage engine for a PIFO: PIFOs that evict the max entry need it
+    in O(log n), all others only ever pop the min.
+    pop_max: the max entry is removed from the PIFO even though it does not
+             evict it itself (e.g. by an ancestor in a scheduling tree)
+    storage: HEAP_STORAGE or CALENDAR_STORAGE (for integer ranks) to override the choice,
+             num_buckets is the size of the rank window of a CalendarQueue
+    """
+    if drop_policy not in DROP_POLICIES:
+        raise ValueError('Unknown drop_policy {}, expected one of {}'.format(drop_policy, DROP_POLICIES))
+    if storage is not None and storage not in STORAGES:
+        raise ValueError('Unknown storage {}, expected one of {}'.format(storage, STORAGES))
+    needs_max = pop_max or (max_size is not None and drop_policy == DROP_MAX)
+    if storage == CALENDAR_STORAGE:
+        if needs_max:
+            raise ValueError('Calendar queue storage cannot remove the max entry, use drop_policy {} or {}'.format(DROP_TAIL, DROP_HEAD))
+        return CalendarQueue(num_buckets)
+    elif needs_max:
+        return MinMaxHeap()
+    else:
+        return HeapStorage()
+
+def bounded_push(values, max_size, drop_policy, item):
+    """
+    Insert item into the storage of a PIFO that holds at most max_size entries.
+    Returns the entry that was dropped to make room (possibly item itself) or
+    None if nothing was dropped.
+    """
+    if max_size is None or len(values) < max_size:
+        values.push(item)
+        return None
+    elif drop_policy == DROP_TAIL:
+        return item
+    elif drop_policy == DROP_HEAD:
+        return values.pushpop_min(item)
+    else:
+        return values.pushpop_max(item)
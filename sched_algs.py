@@ -0,0 +1,396 @@
+
+from hwsim_utils import *
+
+# maps sched_alg name to its SchedAlg class
+SCHED_ALGS = {}
+
+def register_sched_alg(alg):
+    """
+    Class decorator that makes a SchedAlg available to the Switch by name
+    """
+    SCHED_ALGS[alg.name] = alg
+    return alg
+
+def get_sched_alg(name):
+    if name not in SCHED_ALGS:
+        raise ValueError('Unknown sched_alg {}, expected one of {}'.format(name, sorted(SCHED_ALGS.keys())))
+    return SCHED_ALGS[name]
+
+
+class SchedAlg(object):
+    """
+    A scheduling algorithm. The ingress and egress hooks are called with the
+    IngressPipe / EgressPipe as their first argument and yield the simulation
+    events they wait on (e.g. pipe.wait_clock()).
+    """
+    name = None
+
+    @staticmethod
+    def make_istate():
+        """
+        Default ingress state, used if the Switch is not given one
+        """
+        return None
+
+    @staticmethod
+    def make_gstate():
+        """
+        State shared by the ingress and egress
+        """
+        return None
+
+    @staticmethod
+    def ingress(pipe, meta, pkt):
+        """
+        Compute the ranks and leaf node of the pkt
+        """
+        raise NotImplementedError
+
+    # post-scheduling processing in the egress (None if there is none)
+    egress = None
+
+
+@register_sched_alg
+class InvertPkts(SchedAlg):
+    name = "Invert_pkts"
+
+    @staticmethod
+    def make_istate():
+        return InvPktsIngressState()
+
+    @staticmethod
+    def ingress(pipe, meta, pkt):
+        """
+        Scheduling algorithm to invert the order of incoming pkts (rank is strictly decreasing)
+        scheduling tree shape is assumed to be:
+          {0: []}
+        """
+        max_rank = 100
+        meta.ranks[0] = max_rank - pipe.istate.pkt_cnt
+        meta.leaf_node = 0
+        pipe.istate.pkt_cnt += 1
+        yield pipe.wait_clock()
+
+    @staticmethod
+    def egress(pipe, meta, pkt):
+        print 'meta = {}'.format(str(meta))
+        print 'pkt_id = {}'.format(pkt[IP].id)
+        yield pipe.wait_clock()
+
+
+@register_sched_alg
+class STFQ(SchedAlg):
+    name = "STFQ"
+
+    @staticmethod
+    def make_istate():
+        return STFQIngressState()
+
+    @staticmethod
+    def make_gstate():
+        return STFQ_global_state()
+
+    @staticmethod
+    def ingress(pipe, meta, pkt):
+        """
+        Start Time Fair Queueing (STFQ) - approximation of fair queueing
+        """
+        # flowID is 5-tuple
+        flowID = (pkt[IP].proto, pkt[IP].src, pkt[IP].dst, pkt.sport, pkt.dport)
+        pipe.istate.weights[flowID] = 1 # temporary
+        if flowID in pipe.istate.last_finish:
+            start = max(pipe.gstate.virtual_time, pipe.istate.last_finish[flowID])
+        else:
+            start = pipe.gstate.virtual_time
+        pipe.istate.last_finish[flowID] = start + meta.pkt_len / pipe.istate.weights[flowID]
+        meta.ranks[0] = start
+        meta.leaf_node = 0
+        meta.sched_meta.start = start
+        yield pipe.wait_clock()
+
+    @staticmethod
+    def egress(pipe, meta, pkt):
+        """
+        Egress processing for Start Time Fair Queueing
+        """
+        pipe.gstate.virtual_time = meta.sched_meta.start
+        yield pipe.wait_clock()
+
+
+@register_sched_alg
+class HSTFQ(SchedAlg):
+    name = "HSTFQ"
+
+    @staticmethod
+    def make_istate():
+        return HSTFQIngressState()
+
+    @staticmethod
+    def make_gstate():
+        return HSTFQ_global_state()
+
+    @staticmethod
+    def ingress(pipe, meta, pkt):
+        """
+        Hierarchical Start Time Fair Queueing (HSTFQ)
+        """
+        # flowID is just sport field
+        flowID = pkt.sport
+        classID = pkt.sport % 2
+
+        # rank computation for leaf node
+        if flowID in pipe.istate.flow_last_finish:
+            start = max(pipe.gstate.flow_virtual_time[classID], pipe.istate.flow_last_finish[flowID])
+        else:
+            start = pipe.gstate.flow_virtual_time[classID]
+        pipe.istate.flow_last_finish[flowID] = start + meta.pkt_len / pipe.istate.flow_weights[flowID]
+        meta.ranks[0] = start
+        meta.leaf_node = classID + 1
+        meta.sched_meta.flow_start = start
+
+        # rank computation for root node
+        if classID in pipe.istate.class_last_finish:
+            start = max(pipe.gstate.class_virtual_time, pipe.istate.class_last_finish[classID])
+        else:
+            start = pipe.gstate.class_virtual_time
+        pipe.istate.class_last_finish[classID] = start + meta.pkt_len / pipe.istate.class_weights[classID]
+        meta.ranks[1] = start
+        meta.sched_meta.class_start = start
+
+        yield pipe.wait_clock()
+
+    @staticmethod
+    def egress(pipe, meta, pkt):
+        """
+        Egress processing for Hierarchical Start Time Fair Queueing
+        """
+        # TODO: HSTFQ actually seems to work pretty well without this... why???
+        classID = pkt.sport % 2
+        pipe.gstate.flow_virtual_time[classID] = meta.sched_meta.flow_start
+        pipe.gstate.class_virtual_time = meta.sched_meta.class_start
+        yield pipe.wait_clock()
+
+
+@register_sched_alg
+class MinRate(SchedAlg):
+    name = "MinRate"
+
+    @staticmethod
+    def make_istate():
+        return MinRateIngressState()
+
+    @staticmethod
+    def ingress(pipe, meta, pkt):
+        """
+        Minimum Rate Gaurantees for flows
+        """
+        BURST_SIZE = 1500 # bytes
+        flowID = pkt.sport
+        assert(flowID in pipe.istate.flow_min_rate)
+        min_rate = pipe.istate.flow_min_rate[flowID]
+
+        flow_tb = pipe.istate.flow_tb
+        if flowID not in pipe.istate.flow_last_time:
+            pipe.istate.flow_last_time[flowID] = pipe.env.now
+        if flowID not in flow_tb:
+            flow_tb[flowID] = BURST_SIZE
+
+        # Replenish tokens
+        flow_tb[flowID] = flow_tb[flowID] + min_rate * (pipe.env.now - pipe.istate.flow_last_time[flowID])
+        if (flow_tb[flowID] > BURST_SIZE):
+            flow_tb[flowID] = BURST_SIZE
+
+        # Check if we have enough tokens
+        if (flow_tb[flowID] > len(pkt)):
+            # under min rate
+            over_min = 0
+            flow_tb[flowID] = flow_tb[flowID] - len(pkt)
+        else:
+            # over min rate
+            over_min = 1
+
+        pipe.istate.flow_last_time[flowID] = pipe.env.now
+        meta.ranks[0] = pipe.env.now # FIFO order at the leaf
+        meta.ranks[1] = over_min
+        meta.leaf_node = over_min + 1
+
+        yield pipe.wait_clock()
+
+
+@register_sched_alg
+class RR(SchedAlg):
+    name = "RR"
+
+    @staticmethod
+    def make_istate():
+        return RRIngressState()
+
+    @staticmethod
+    def ingress(pipe, meta, pkt):
+        """
+        Round Robin Scheduling
+        """
+        # flowID is just sport field
+        flowID = pkt.sport
+
+        if flowID not in pipe.istate.flow_last_rank:
+            rank = pipe.istate.max_rank + 1
+            pipe.istate.num_active_flows += 1
+        else:
+            rank = pipe.istate.flow_last_rank[flowID] + pipe.istate.num_active_flows
+
+        pipe.istate.max_rank = rank
+        pipe.istate.flow_last_rank[flowID] = rank
+        meta.ranks[0] = rank
+        meta.leaf_node = 0
+        yield pipe.wait_clock()
+
+
+@register_sched_alg
+class WRR(SchedAlg):
+    name = "WRR"
+
+    @staticmethod
+    def make_istate():
+        return WRRIngressState()
+
+    @staticmethod
+    def ingress(pipe, meta, pkt):
+        """
+        Weighted Round Robin Scheduling
+        """
+        # flowID is just sport field
+        flowID = pkt.sport
+
+        if flowID not in pipe.istate.flow_last_rank:
+            rank = pipe.istate.max_rank + 1
+            pipe.istate.num_active_flows += 1
+            pipe.istate.flow_cnt[flowID] = 1
+        else:
+            weight = pipe.istate.flow_weight[flowID]
+            if (pipe.istate.flow_cnt[flowID] == weight):
+                rank = pipe.istate.flow_last_rank[flowID] + pipe.istate.num_active_flows
+                pipe.istate.flow_cnt[flowID] = 1
+            else:
+                rank = pipe.istate.flow_last_rank[flowID]
+                pipe.istate.flow_cnt[flowID] += 1
+
+        if rank > pipe.istate.max_rank:
+            pipe.istate.max_rank = rank
+        pipe.istate.flow_last_rank[flowID] = rank
+        meta.ranks[0] = rank
+        meta.leaf_node = 0
+        yield pipe.wait_clock()
+
+
+@register_sched_alg
+class Strict(SchedAlg):
+    name = "Strict"
+
+    @staticmethod
+    def ingress(pipe, meta, pkt):
+        """
+        Strict Priority Scheduling
+        """
+        # flowID is just sport field
+        flowID = pkt.sport
+        rank = flowID
+        meta.ranks[0] = rank
+        meta.leaf_node = 0
+        yield pipe.wait_clock()
+
+
+###################
+## Ingress State ##
+###################
+
+class InvPktsIngressState(object):
+    def __init__(self):
+        self.pkt_cnt = 0
+
+
+class STFQIngressState(object):
+    def __init__(self):
+        # state for STFQ
+        #  last_finish: maps flowID to virtual finish time of previous pkt in flow
+        self.last_finish = {}
+        #  weights: maps flowID to flow weight
+        self.weights = {}
+
+class HSTFQIngressState(object):
+    def __init__(self, flow_weights=None, class_weights=None):
+        #  last_finish: maps flowID and classID to virtual finish time of previous pkt in flow
+        self.flow_last_finish = {}
+        self.class_last_finish = {}
+        #  weights: maps flowID and classID to weights
+        self.flow_weights = flow_weights if flow_weights is not None else {}
+        self.class_weights = class_weights if class_weights is not None else {}
+
+class MinRateIngressState(object):
+    def __init__(self, flow_min_rate=None):
+        self.flow_min_rate = flow_min_rate if flow_min_rate is not None else {}
+        self.flow_tb = {}
+        self.flow_last_time = {}
+
+class RRIngressState(object):
+    def __init__(self):
+        self.max_rank = 0
+        self.flow_last_rank = {}
+        self.num_active_flows = 0
+
+class WRRIngressState(object):
+    def __init__(self, weights=None):
+        self.max_rank = 0
+        self.flow_cnt = {}
+        self.flow_last_rank = {}
+        self.num_active_flows = 0
+        self.flow_weight = weights if weights is not None else {}
+
+##################
+## Global State ##
+##################
+
+class STFQ_global_state(object):
+    def __init__(self):
+        self.virtual_time = 0
+
+class HSTFQ_global_state(object):
+    def __init__(self):
+        self.flow_virtual_time = [0, 0]
+        self.class_virtual_time = 0
+
+##############
+## Metadata ##
+##############
+
+class STFQMeta(object):
+    __slots__ = ('start',)
+
+    def __init__(self):
+        self.start = 0
+
+    def clone(self):
+        meta = STFQMeta()
+        meta.start = self.start
+        return meta
+
+    def __str__(self):
+        return 'start = {}'.format(self.start)
+
+
+class HSTFQMeta(object):
+    __slots__ = ('flow_start', 'class_start')
+
+    def __init__(self):
+        self.flow_start = 0
+        self.class_start = 0
+
+    def clone(self):
+        meta = HSTFQMeta()
+        meta.flow_start = self.flow_start
+        meta.class_start = self.class_start
+        return meta
+
+    def __str__(self):
+        return 'flow_start = {}'.format(self.flow_start)
+        return 'class_start = {}'.format(self.class_start)
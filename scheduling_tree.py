@@ -1,12 +1,25 @@
 
 import sys, os
-from scapy.all import *
 import simpy
-from heapq import heappush, heappop, heapify
+from collections import namedtuple
+from itertools import count
 from hwsim_utils import *
+from pifo_storage import PIFOEntry, make_storage, bounded_push, DROP_MAX, DROP_TAIL, DROP_HEAD, DROP_POLICIES, HEAP_STORAGE, CALENDAR_STORAGE
+from trace_utils import sport_flowID
+from pifo_metrics import PIFOCounters, PIFOMetricsSampler
 
-class PIFO(HW_sim_object):
-    def __init__(self, env, period, r_in_pipe, r_out_pipe, w_in_pipe, w_out_pipe, write_latency=1, read_latency=1, max_size=None):
+class PIFO(HW_sim_object, PIFOCounters):
+    def __init__(self, env, period, r_in_pipe, r_out_pipe, w_in_pipe, w_out_pipe, write_latency=1, read_latency=1, max_size=None, drop_policy=DROP_MAX, pop_max=False,
+                 storage=None, poll_when_empty=True):
+        """
+        drop_policy: which entry to drop when a write arrives while the PIFO holds max_size entries
+        pop_max: the max entry may be removed by someone other than the PIFO itself
+        storage: HEAP_STORAGE or CALENDAR_STORAGE, by default a heap that suits the other settings
+        poll_when_empty: a read of an empty PIFO checks it again every cycle. Otherwise
+                         it sleeps until the next write and takes the entry at the start
+                         of the cycle after the write, which saves the idle events but
+                         can be a cycle later than a polling read.
+        """
         super(PIFO, self).__init__(env, period)
         self.r_in_pipe = r_in_pipe
         self.r_out_pipe = r_out_pipe
@@ -14,10 +27,17 @@ class PIFO(HW_sim_object):
         self.w_out_pipe = w_out_pipe
         self.write_latency = write_latency
         self.read_latency = read_latency
-        self.values = []
 
         self.max_size = max_size
+        self.drop_policy = drop_policy
+        self.values = make_storage(max_size, drop_policy, pop_max, storage)
+        # sequence numbers of the PIFOEntries, ties between equal ranks are broken in write order
+        self.seq = count()
         self.drop_cnt = 0
+        self.poll_when_empty = poll_when_empty
+        # event used to wake up a read that is waiting for data
+        self.data_avail = None
+        self.init_counters()
 
         # register processes for simulation
         self.run()
@@ -34,16 +54,14 @@ class PIFO(HW_sim_object):
             # wait to receive incoming data
             (rank, data) = yield self.w_in_pipe.get()
             # model write latency
-            for i in range(self.write_latency):
-                yield self.wait_clock()
+            if self.write_latency > 0:
+                yield self.wait_cycles(self.write_latency)
             # write pkt and metadata into pifo
-            if self.max_size is None or len(self.values) < self.max_size:
-                heappush(self.values, (rank, data))
-            else:
-                heappush(self.values, (rank, data))
-                self.values.remove(max(self.values))
-                heapify(self.values)
-                self.drop_cnt += 1
+            self.store(PIFOEntry(rank, next(self.seq), data))
+            # wake up a pending read
+            if self.data_avail is not None:
+                self.data_avail.succeed()
+                self.data_avail = None
             # indicate write_completion
             done = 1
             self.w_out_pipe.put(done)    
@@ -56,24 +74,56 @@ class PIFO(HW_sim_object):
             # wait to receive a read request
             read_req = yield self.r_in_pipe.get()
             # model read latency
-            for i in range(self.read_latency):
-                yield self.wait_clock()
+            if self.read_latency > 0:
+                yield self.wait_cycles(self.read_latency)
             # try to read data from pifo
             read_complete = False
+            stall_start = self.env.now
             while not read_complete and not self.sim_done:
                 if len(self.values) > 0:
-                    (rank, data) = heappop(self.values)
-                    self.r_out_pipe.put((rank, data))
+                    self.r_out_pipe.put(self.values.pop())
+                    self.deq_cnt += 1
+                    self.depth_changed()
+                    self.stall_cycles += (self.env.now - stall_start)/self.period
                     read_complete = True
-                else:
+                elif self.poll_when_empty:
                     yield self.wait_clock()
+                else:
+                    # sleep until the next write
+                    self.data_avail = self.env.event()
+                    yield self.data_avail
+                    yield self.wait_next_cycle()
+
+    def store(self, entry):
+        dropped = bounded_push(self.values, self.max_size, self.drop_policy, entry)
+        # a rejected entry only counts as a drop, an evicted one was counted when it was written
+        if dropped is not entry:
+            self.enq_cnt += 1
+        if dropped is not None:
+            self.drop_cnt += 1
+        self.depth_changed()
 
 class Scheduling_tree_node(PIFO):
-    def __init__(self, env, period, ID, r_in_pipe, r_out_pipe, w_in_pipe, w_out_pipe, children, parent, max_size=None):
-        super(Scheduling_tree_node, self).__init__(env, period, r_in_pipe, r_out_pipe, w_in_pipe, w_out_pipe, max_size=max_size)
+    def __init__(self, env, period, ID, r_in_pipe, r_out_pipe, w_in_pipe, w_out_pipe, children, parent, max_size=None, drop_policy=DROP_MAX, pop_max=False,
+                 storage=None, poll_when_empty=True):
+        super(Scheduling_tree_node, self).__init__(env, period, r_in_pipe, r_out_pipe, w_in_pipe, w_out_pipe, max_size=max_size, drop_policy=drop_policy, pop_max=pop_max,
+                                                   storage=storage, poll_when_empty=poll_when_empty)
         self.ID = ID
         self.children = children
         self.parent = parent
+        # # of admitted entries that have not been written yet
+        self.pending_writes = 0
+        # # of entries read by a prefetch that have not been handed off or put back yet
+        self.prefetched = 0
+
+    def occupancy(self):
+        return len(self.values) + self.pending_writes + self.prefetched
+
+    def store(self, entry):
+        # the Scheduling_tree has already made room for every write it admits
+        self.enq_cnt += 1
+        self.values.push(entry)
+        self.depth_changed()
 
     def __str__(self):
         children_strs = []
@@ -81,12 +131,122 @@ class Scheduling_tree_node(PIFO):
             children_strs.append(str(child))
         return '[{}, [{}]]'.format(self.ID, ','.join(children_strs))
 
+class NodeSpec(namedtuple('NodeSpec', ['ID', 'max_size', 'drop_policy', 'storage'])):
+    """
+    Node of a scheduling tree shape with its own capacity, drop policy and/or
+    storage engine, can be used wherever a shape has a node ID, e.g.
+      {NodeSpec(0, max_size=64): [NodeSpec(1, 16, DROP_TAIL, CALENDAR_STORAGE), 2]}
+    Settings that are None fall back to those of the Scheduling_tree.
+    """
+    __slots__ = ()
+
+    def __new__(cls, ID, max_size=None, drop_policy=None, storage=None):
+        return super(NodeSpec, cls).__new__(cls, ID, max_size, drop_policy, storage)
+
+def parse_shape(shape, parent_ID=None):
+    """
+    Recursive function to walk a scheduling tree shape. Returns a list of
+    (NodeSpec, parent_ID) tuples in which every node appears after its parent.
+    """
+    if (type(shape) == int):
+        # base case
+        return [(NodeSpec(shape), parent_ID)]
+    elif (type(shape) == NodeSpec):
+        return [(shape, parent_ID)]
+    elif (type(shape) == dict):
+        keys = shape.keys()
+        vals = shape.values()
+        if len(keys) != 1 or type(keys[0]) not in (int, NodeSpec) or type(vals[0]) != list:
+            # must be exactly one integer key with a list value
+            print >> sys.stderr, "ERROR: incorrct format of shape: {}".format(shape)
+            sys.exit(1)
+        spec = keys[0] if type(keys[0]) == NodeSpec else NodeSpec(keys[0])
+        nodes = [(spec, parent_ID)]
+        for child in vals[0]:
+            nodes += parse_shape(child, spec.ID)
+        return nodes
+    else:
+        print >> sys.stderr, "ERROR: incorrct format of shape: {}".format(shape)
+        sys.exit(1)
+
+def resolve_shape(shape, max_node_size=None, drop_policy=DROP_MAX, storage=None):
+    """
+    Returns a list of (ID, parent_ID, max_size, drop_policy, pop_max, storage)
+    tuples in which every node appears after its parent. pop_max is set for
+    the nodes below a node that evicts the max rank pkt of its subtree.
+    """
+    nodes = []
+    evicts_max = {}
+    for (spec, parent_ID) in parse_shape(shape):
+        max_size = spec.max_size if spec.max_size is not None else max_node_size
+        policy = spec.drop_policy if spec.drop_policy is not None else drop_policy
+        if policy not in DROP_POLICIES:
+            raise ValueError('Unknown drop_policy {} for node {}, expected one of {}'.format(policy, spec.ID, DROP_POLICIES))
+        pop_max = parent_ID is not None and evicts_max[parent_ID]
+        evicts_max[spec.ID] = pop_max or (max_size is not None and policy == DROP_MAX)
+        node_storage = spec.storage if spec.storage is not None else storage
+        nodes.append((spec.ID, parent_ID, max_size, policy, pop_max, node_storage))
+    return nodes
+
+def admit(nodes, meta, pkt):
+    """
+    Make room for a pkt in the nodes on its path from the leaf to the root.
+    The first full node on the path applies its drop policy: either the new
+    pkt is dropped or a pkt is evicted from the subtree of that node and the
+    new pkt takes over the evicted pkt's entries in the nodes above it.
+    Returns (num_levels, dropped) where num_levels is the # of nodes on the
+    path, starting at the leaf, that the pkt must be written into and dropped
+    is the (meta, pkt) that was dropped or None.
+    """
+    node = nodes[meta.leaf_node]
+    level = 0
+    while node is not None:
+        if node.max_size is not None and node.occupancy() >= node.max_size:
+            node.drop_cnt += 1
+            rank = meta.ranks[level]
+            if node.drop_policy == DROP_TAIL or len(node.values) == 0:
+                return (0, (meta, pkt))
+            elif node.drop_policy == DROP_HEAD and not node.values.peek().rank < rank:
+                return (0, (meta, pkt))
+            elif node.drop_policy == DROP_MAX and not rank < node.values.peek_max().rank:
+                return (0, (meta, pkt))
+            return (level + 1, evict(nodes, node))
+        node = node.parent
+        level += 1
+    return (level, None)
+
+def evict(nodes, node):
+    """
+    Remove the pkt at the head (DROP_HEAD) or with the max ranks (DROP_MAX) of
+    the subtree of node and return its (meta, pkt). Takes O(log n) per level.
+    """
+    pop_max = node.drop_policy != DROP_HEAD
+    while True:
+        data = node.values.pop_max().data if pop_max else node.values.pop().data
+        node.depth_changed()
+        if type(data) != int:
+            return data
+        node = nodes[data]
+
 class Scheduling_tree(HW_sim_object):
-    def __init__(self, env, period, ready_in_pipe, ready_out_pipe, pkt_in_pipe, pkt_out_pipe, shape, max_node_size=None):
+    def __init__(self, env, period, ready_in_pipe, ready_out_pipe, pkt_in_pipe, pkt_out_pipe, shape, max_node_size=None, pipelined_writes=False, prefetch_reads=False,
+                 drop_policy=DROP_MAX, flowID_func=sport_flowID, buffer=None, port=0, storage=None):
         """Shape specifies the shape of the scheduling tree:
            e.g. single pifo  --  0
                 2-level tree -- {0: [1, 2]}
                 3-level tree -- {0: [{1: [3, 4]}, {2: [5, 6]}]}
+           nodes can be given as a NodeSpec to override max_node_size, drop_policy and storage
+           drop_policy: which pkt a full node drops (DROP_MAX, DROP_TAIL or DROP_HEAD)
+           flowID_func: maps a dropped pkt to the flowID it is counted against in flow_drop_cnts
+           buffer: optional SharedBuffer that the pkts must also be admitted into,
+                   with port identifying this tree in it
+           storage: storage engine of the nodes (HEAP_STORAGE or CALENDAR_STORAGE for integer ranks),
+                    by default a heap that suits the drop policy
+           pipelined_writes: give each level of the enqueue path its own stage so that
+                             the next pkt can be written into its leaf while the previous
+                             pkt's node pointers are written into the upper levels
+           prefetch_reads: walk the tree for the next pkt as soon as the previous one
+                           is dequeued rather than when the next read request arrives
         """
         super(Scheduling_tree, self).__init__(env, period)
         self.ready_in_pipe = ready_in_pipe
@@ -95,53 +255,82 @@ class Scheduling_tree(HW_sim_object):
         self.pkt_out_pipe = pkt_out_pipe
         self.shape = shape
         self.max_node_size = max_node_size
+        self.drop_policy = drop_policy
+        self.storage = storage
+        self.flowID_func = flowID_func
+        self.buffer = buffer
+        self.port = port
+        # # of pkts dropped anywhere in the tree, in total and per flow
+        self.drop_cnt = 0
+        self.flow_drop_cnts = {}
+        self.pipelined_writes = pipelined_writes
+        self.prefetch_reads = prefetch_reads
+        # # of prefetched pkts that were put back because a smaller rank arrived
+        self.prefetch_restore_cnt = 0
         # this maps the node ID to the node itself 
         self.nodes = {}
         # tree is a pointer to the root node
-        self.tree = self.make_tree(shape, None, max_node_size)
+        self.tree = self.make_tree(shape, max_node_size, drop_policy, storage)
 
         # register processes for simulation
         self.run()
 
     def run(self):
-        self.env.process(self.write_sm())
-        self.env.process(self.read_sm())
+        if self.pipelined_writes:
+            # stage_pipes[i] holds the pkt that stage i hands to stage i + 1,
+            # stage 0 writes the leaf and stage i writes the i-th ancestor of the leaf
+            num_stages = self.depth()
+            self.stage_pipes = [simpy.Store(self.env, capacity=1) for i in range(num_stages - 1)]
+            self.env.process(self.leaf_write_stage())
+            for level in range(1, num_stages):
+                self.env.process(self.pointer_write_stage(level))
+        else:
+            self.env.process(self.write_sm())
+        if self.prefetch_reads:
+            self.env.process(self.prefetch_read_sm())
+        else:
+            self.env.process(self.read_sm())
+
+    def depth(self):
+        """
+        # of nodes on the longest path from a leaf to the root
+        """
+        max_depth = 0
+        for node in self.nodes.values():
+            depth = 0
+            while node is not None:
+                depth += 1
+                node = node.parent
+            max_depth = max(max_depth, depth)
+        return max_depth
 
     def __str__(self):
         return str(self.tree)
 
-    def make_tree(self, shape, parent, max_node_size):
-        """
-        Recursive function to make scheduling tree
-        """
-        r_in_pipe = simpy.Store(self.env)
-        r_out_pipe = simpy.Store(self.env)
-        w_in_pipe = simpy.Store(self.env)
-        w_out_pipe = simpy.Store(self.env)
-        if (type(shape) == int):
-            # base case
-            children = []
-            ID = shape
-            node = Scheduling_tree_node(self.env, self.period, ID, r_in_pipe, r_out_pipe, w_in_pipe, w_out_pipe, children, parent, max_node_size)
-        elif (type(shape) == dict):
-            keys = shape.keys()
-            vals = shape.values()
-            if len(keys) != 1 or type(keys[0]) != int or type(vals[0]) != list:
-                # must be exactly one integer key with a list value
-                print >> sys.stderr, "ERROR: incorrct format of shape: {}".format(shape)
-                sys.exit(1)
-            ID = keys[0]
-            node = Scheduling_tree_node(self.env, self.period, ID, r_in_pipe, r_out_pipe, w_in_pipe, w_out_pipe, [], parent, max_node_size)
-            children = []
-            for child in vals[0]:
-                child_node = self.make_tree(child, node)
-                children.append(child_node)
-            node.children = children
-        else:
-            print >> sys.stderr, "ERROR: incorrct format of shape: {}".format(shape)
-            sys.exit(1)
-        self.nodes[ID] = node
-        return node
+    def metrics(self):
+        """
+        Returns a dictionary mapping node ID to the PIFOMetrics of the node
+        """
+        return dict((ID, node.metrics()) for (ID, node) in self.nodes.items())
+
+    def make_tree(self, shape, max_node_size, drop_policy, storage):
+        """
+        Make the scheduling tree and return the root node
+        """
+        root = None
+        for (ID, parent_ID, max_size, policy, pop_max, node_storage) in resolve_shape(shape, max_node_size, drop_policy, storage):
+            r_in_pipe = simpy.Store(self.env)
+            r_out_pipe = simpy.Store(self.env)
+            w_in_pipe = simpy.Store(self.env)
+            w_out_pipe = simpy.Store(self.env)
+            parent = self.nodes[parent_ID] if parent_ID is not None else None
+            node = Scheduling_tree_node(self.env, self.period, ID, r_in_pipe, r_out_pipe, w_in_pipe, w_out_pipe, [], parent, max_size, policy, pop_max, node_storage)
+            if parent is None:
+                root = node
+            else:
+                parent.children.append(node)
+            self.nodes[ID] = node
+        return root
 
     def write_sm(self):
         """
@@ -151,25 +340,84 @@ class Scheduling_tree(HW_sim_object):
             self.ready_in_pipe.put(1) # to indicate ready to receive
             # wait to receive incoming data
             (meta, pkt) = yield self.pkt_in_pipe.get()
+            num_levels = self.admit_pkt(meta, pkt)
 
-            level = 0
-            # enqueue the pkt and metadata into the leaf node 
-            leaf_rank = meta.ranks[level]
-            leaf_node_ptr = meta.leaf_node
-            leaf_node = self.nodes[leaf_node_ptr]
-            leaf_node.w_in_pipe.put((leaf_rank, (meta, pkt)))
-            yield leaf_node.w_out_pipe.get()
-            parent = leaf_node.parent
-            child_ID = leaf_node.ID
-            while parent is not None:
-                # enqueue node pointers up to the root
-                node = parent
-                level += 1
-                rank = meta.ranks[level]
-                node.w_in_pipe.put((rank, child_ID))
+            # enqueue the pkt and metadata into the leaf node and then
+            # node pointers up to the root
+            node = self.nodes[meta.leaf_node]
+            data = (meta, pkt)
+            for level in range(num_levels):
+                node.w_in_pipe.put((meta.ranks[level], data))
                 yield node.w_out_pipe.get()
-                parent = node.parent
-                child_ID = node.ID
+                node.pending_writes -= 1
+                data = node.ID
+                node = node.parent
+
+    def admit_pkt(self, meta, pkt):
+        """
+        Apply the drop policies to an incoming pkt and return the # of levels
+        of its path that it must be written into (0 if it was dropped)
+        """
+        meta.enq_time = self.env.now
+        if self.buffer is not None and not self.buffer.admit(self.port, meta.leaf_node, meta.pkt_len):
+            self.record_drop(pkt)
+            return 0
+        (num_levels, dropped) = admit(self.nodes, meta, pkt)
+        if dropped is not None:
+            (drop_meta, drop_pkt) = dropped
+            self.record_drop(drop_pkt)
+            self.release_pkt(drop_meta)
+        node = self.nodes[meta.leaf_node]
+        for level in range(num_levels):
+            node.pending_writes += 1
+            node = node.parent
+        return num_levels
+
+    def record_drop(self, pkt):
+        flowID = self.flowID_func(pkt)
+        self.drop_cnt += 1
+        self.flow_drop_cnts[flowID] = self.flow_drop_cnts.get(flowID, 0) + 1
+
+    def release_pkt(self, meta):
+        """
+        Free the shared buffer space of a pkt that left the tree
+        """
+        if self.buffer is not None:
+            self.buffer.release(self.port, meta.leaf_node, meta.pkt_len)
+
+    def leaf_write_stage(self):
+        """
+        First stage of the pipelined enqueue: write the pkt into its leaf node
+        """
+        while not self.sim_done:
+            self.ready_in_pipe.put(1) # to indicate ready to receive
+            # wait to receive incoming data
+            (meta, pkt) = yield self.pkt_in_pipe.get()
+            num_levels = self.admit_pkt(meta, pkt)
+            if num_levels == 0:
+                continue
+            leaf_node = self.nodes[meta.leaf_node]
+            leaf_node.w_in_pipe.put((meta.ranks[0], (meta, pkt)))
+            yield leaf_node.w_out_pipe.get()
+            leaf_node.pending_writes -= 1
+            if num_levels > 1:
+                # wait for the next stage to accept the pkt
+                yield self.stage_pipes[0].put((meta, leaf_node, num_levels))
+
+    def pointer_write_stage(self, level):
+        """
+        Stage of the pipelined enqueue that writes the node pointers of the
+        ancestors that are level levels above the leaf
+        """
+        in_pipe = self.stage_pipes[level - 1]
+        while not self.sim_done:
+            (meta, child, num_levels) = yield in_pipe.get()
+            node = child.parent
+            node.w_in_pipe.put((meta.ranks[level], child.ID))
+            yield node.w_out_pipe.get()
+            node.pending_writes -= 1
+            if level + 1 < num_levels:
+                yield self.stage_pipes[level].put((meta, node, num_levels))
 
     def read_sm(self):
         """
@@ -181,12 +429,12 @@ class Scheduling_tree(HW_sim_object):
 
             # always remove from the root first
             self.tree.r_in_pipe.put(1)
-            (rank, data) = yield self.tree.r_out_pipe.get()
+            (rank, seq, data) = yield self.tree.r_out_pipe.get()
             while type(data) == int:
                 # data is a pointer to another node
                 node = self.nodes[data]
                 node.r_in_pipe.put(1)
-                (rank, data) = yield node.r_out_pipe.get()
+                (rank, seq, data) = yield node.r_out_pipe.get()
 
             try:
                 assert(type(data) == tuple)
@@ -195,7 +443,77 @@ class Scheduling_tree(HW_sim_object):
                 sys.exit(1)
 
             # data is now the metadata and pkt
+            data[0].deq_time = self.env.now
+            self.release_pkt(data[0])
             self.pkt_out_pipe.put(data)
 
+    def prefetch_read_sm(self):
+        """
+        State machine to dequeue from the scheduling tree that reads the next
+        pkt out of the tree while waiting for the read request. If an entry
+        that would have been read before the prefetched ones arrives in the
+        meantime, the prefetched entries are put back and the tree is read again.
+        The prefetched entries count toward the occupancy of their nodes until
+        the pkt is handed off, so that the drop policies keep room for them.
+        """
+        while not self.sim_done:
+            path = []
+            yield self.env.process(self.read_path(path))
+            # wait to receive a read request
+            read_req = yield self.ready_out_pipe.get()
+            if self.path_is_stale(path):
+                self.restore_path(path)
+                self.prefetch_restore_cnt += 1
+                path = []
+                yield self.env.process(self.read_path(path))
+            for (node, entry) in path:
+                node.prefetched -= 1
+            (node, (rank, seq, data)) = path[-1]
+            data[0].deq_time = self.env.now
+            self.release_pkt(data[0])
+            self.pkt_out_pipe.put(data)
 
+    def read_path(self, path):
+        """
+        Read from the root down to a leaf, appending (node, entry) to path for
+        every node that was read
+        """
+        # always remove from the root first
+        node = self.tree
+        while True:
+            node.r_in_pipe.put(1)
+            entry = yield node.r_out_pipe.get()
+            path.append((node, entry))
+            node.prefetched += 1
+            data = entry.data
+            if type(data) != int:
+                break
+            # data is a pointer to another node
+            node = self.nodes[data]
+
+        try:
+            assert(type(data) == tuple)
+        except AssertionError as e:
+            print >> sys.stderr, "ERROR: invalid type returned from node: {}".format(data)
+            sys.exit(1)
+
+    def path_is_stale(self, path):
+        """
+        Check if any node on the path now holds an entry that would be read
+        before the entry that was prefetched from it
+        """
+        for (node, entry) in path:
+            if len(node.values) > 0 and node.values.peek().rank < entry.rank:
+                return True
+        return False
 
+    def restore_path(self, path):
+        """
+        Put the prefetched entries back into their nodes, which kept room for them
+        """
+        for (node, entry) in path:
+            node.values.restore(entry)
+            node.prefetched -= 1
+            # the entry will be read again
+            node.deq_cnt -= 1
+            node.depth_changed()
@@ -0,0 +1,94 @@
+
+from array import array
+import numpy as np
+
+class SharedBuffer(object):
+    """
+    Packet buffer shared by the scheduling tree nodes of one or more switch
+    ports. Pkts are admitted with dynamic thresholds: a node (or port) may only
+    hold up to alpha times the currently unused part of the buffer, so the
+    share of a congested queue shrinks as the buffer fills up.
+    Occupancy is in bytes and is charged to the leaf node that holds the pkt.
+    """
+    def __init__(self, env, size, alpha=1.0, port_alpha=None, keep_series=False):
+        """
+        size: buffer size in bytes
+        alpha: dynamic threshold of every node
+        port_alpha: dynamic threshold of every port (None to not limit the ports)
+        keep_series: record the occupancy after every change, see occupancy(),
+                     the series grows by one row per pkt admitted or released
+        """
+        self.env = env
+        self.size = size
+        self.alpha = alpha
+        self.port_alpha = port_alpha
+        self.keep_series = keep_series
+
+        self.used = 0
+        # maps port and (port, node ID) to the # of bytes they hold
+        self.port_used = {}
+        self.node_used = {}
+        # # of pkts that were not admitted
+        self.drop_cnt = 0
+
+        # occupancy time series
+        self.times = array('l')
+        self.ports = array('l')
+        self.port_bytes = array('l')
+        self.total_bytes = array('l')
+
+    def threshold(self, alpha):
+        return alpha*(self.size - self.used)
+
+    def admit(self, port, node_ID, nbytes):
+        """
+        Allocate nbytes for a pkt that is written into node_ID of port.
+        Returns False (and allocates nothing) if the pkt must be dropped.
+        """
+        node = (port, node_ID)
+        node_used = self.node_used.get(node, 0)
+        port_used = self.port_used.get(port, 0)
+        if (self.used + nbytes > self.size or node_used >= self.threshold(self.alpha) or
+                (self.port_alpha is not None and port_used >= self.threshold(self.port_alpha))):
+            self.drop_cnt += 1
+            return False
+        self.node_used[node] = node_used + nbytes
+        self.port_used[port] = port_used + nbytes
+        self.used += nbytes
+        self.record(port)
+        return True
+
+    def release(self, port, node_ID, nbytes):
+        """
+        Free the bytes of a pkt that left node_ID of port (dequeued or evicted)
+        """
+        self.node_used[(port, node_ID)] -= nbytes
+        self.port_used[port] -= nbytes
+        self.used -= nbytes
+        self.record(port)
+
+    def record(self, port):
+        if self.keep_series:
+            self.times.append(self.env.now)
+            self.ports.append(port)
+            self.port_bytes.append(self.port_used[port])
+            self.total_bytes.append(self.used)
+
+    def occupancy(self):
+        """
+        Returns a dictionary of NumPy arrays with one row per change of the
+        occupancy: the time, the port that changed, its new occupancy and the
+        new total occupancy
+        """
+        return {'time': np.frombuffer(self.times, dtype=np.int_).copy(),
+                'port': np.frombuffer(self.ports, dtype=np.int_).copy(),
+                'port_bytes': np.frombuffer(self.port_bytes, dtype=np.int_).copy(),
+                'total_bytes': np.frombuffer(self.total_bytes, dtype=np.int_).copy()}
+
+    def port_occupancy(self, port):
+        """
+        Returns (times, bytes) of the occupancy of one port
+        """
+        columns = self.occupancy()
+        mask = columns['port'] == port
+        return (columns['time'][mask], columns['port_bytes'][mask])
@@ -0,0 +1,134 @@
+
+import os
+from simpy.events import Process
+from timeit import default_timer as timer
+
+# set this environment variable to profile the *_tb.py runs, e.g. SIM_PROFILE=1 python rr_tb.py
+PROFILE_VAR = 'SIM_PROFILE'
+
+class ProcessStats(object):
+    __slots__ = ('num_procs', 'resumes', 'wall_time', 'events')
+
+    def __init__(self):
+        self.num_procs = 0
+        # # of times the processes were resumed, i.e. the # of events they waited for
+        self.resumes = 0
+        self.wall_time = 0.0
+        # maps the type of event the processes yielded to its count
+        self.events = {}
+
+
+class ProfiledGenerator(object):
+    """
+    Stands in for the generator of a simpy process and charges the wall time
+    of every resumption and the events it yields to stats
+    """
+    __slots__ = ('generator', 'stats')
+
+    def __init__(self, generator, stats):
+        self.generator = generator
+        self.stats = stats
+
+    @property
+    def gi_frame(self):
+        # simpy describes the frame of a process that yields an invalid value
+        return self.generator.gi_frame
+
+    def send(self, value):
+        return self.resume(self.generator.send, value)
+
+    def throw(self, exc):
+        return self.resume(self.generator.throw, exc)
+
+    def close(self):
+        self.generator.close()
+
+    def resume(self, method, arg):
+        stats = self.stats
+        start = timer()
+        try:
+            event = method(arg)
+        finally:
+            stats.wall_time += timer() - start
+            stats.resumes += 1
+        name = type(event).__name__
+        stats.events[name] = stats.events.get(name, 0) + 1
+        return event
+
+
+class SimProfiler(object):
+    """
+    Attributes the events and wall time of a simpy run to the processes of
+    each HW_sim_object subclass, e.g. PIFO.read_sm or Arbiter.arbitrate.
+    It must be created before the processes are, i.e. before the testbench:
+      env = simpy.Environment()
+      profiler = SimProfiler(env)
+      tb = RR_tb(env, period)
+      env.run()
+      profiler.print_report()
+    The wall time that is not spent in a process is simpy's own event handling
+    (and the profiler's, which slows the run down by about 40%).
+    """
+    def __init__(self, env):
+        self.env = env
+        # maps 'Class.method' to the ProcessStats of its processes
+        self.stats = {}
+        self.num_steps = 0
+        self.step_time = 0.0
+        self.env_step = env.step
+        env.process = self.process
+        env.step = self.step
+
+    def process(self, generator):
+        stats = self.stats.setdefault(self.process_name(generator), ProcessStats())
+        stats.num_procs += 1
+        return Process(self.env, ProfiledGenerator(generator, stats))
+
+    @staticmethod
+    def process_name(generator):
+        frame = generator.gi_frame
+        owner = frame.f_locals.get('self') if frame is not None else None
+        name = generator.gi_code.co_name
+        return '{}.{}'.format(type(owner).__name__, name) if owner is not None else name
+
+    def step(self):
+        start = timer()
+        try:
+            self.env_step()
+        finally:
+            self.step_time += timer() - start
+            self.num_steps += 1
+
+    def report(self):
+        """
+        Returns a list of (process, # processes, # resumes, wall time, events yielded)
+        rows sorted by decreasing wall time, followed by a 'simpy' row with the
+        # of events processed and the time spent outside of the processes
+        """
+        rows = [(name, stats.num_procs, stats.resumes, stats.wall_time, stats.events) for (name, stats) in self.stats.items()]
+        rows.sort(key=lambda row: row[3], reverse=True)
+        proc_time = sum(row[3] for row in rows)
+        rows.append(('simpy', 1, self.num_steps, max(0.0, self.step_time - proc_time), {}))
+        return rows
+
+    def print_report(self):
+        rate = self.num_steps/self.step_time if self.step_time > 0 else float('nan')
+        print '{} events in {:.3f} s ({:.0f} events/s) over {} cycles'.format(self.num_steps, self.step_time, rate, self.env.now)
+        # the resumes are shown as a % of the events processed and the wall time as a % of the run
+        num_steps = max(1, self.num_steps)
+        step_time = max(1e-9, self.step_time)
+        print '{:<36} {:>7} {:>10} {:>7} {:>9} {:>7} {:>10}  {}'.format('process', '# procs', '# resumes', '%', 'wall (s)', '%', 'us/resume', 'events yielded')
+        for (name, num_procs, resumes, wall_time, events) in self.report():
+            per_resume = wall_time/resumes*1e6 if resumes > 0 else 0.0
+            events_str = ', '.join('{}: {}'.format(event, cnt) for (event, cnt) in sorted(events.items(), key=lambda item: -item[1]))
+            print '{:<36} {:>7} {:>10} {:>6.1f}% {:>9.3f} {:>6.1f}% {:>10.2f}  {}'.format(name, num_procs, resumes, resumes*100.0/num_steps, wall_time,
+                                                                                      wall_time*100/step_time, per_resume, events_str)
+
+
+def profile_env(env):
+    """
+    Returns a SimProfiler of env if the SIM_PROFILE environment variable is set, None otherwise
+    """
+    if os.environ.get(PROFILE_VAR):
+        return SimProfiler(env)
+    return None
@@ -0,0 +1,157 @@
+
+import sys, os
+import argparse, ast, json
+from timeit import default_timer as timer
+import simpy
+import sweep
+from bench_utils import CountingEnvironment
+from fast_sim import FastSwitchSim
+from sim_profiler import SimProfiler
+from trace_utils import ColumnRecorder
+
+# the sweep testbenches and trace replay, e.g. trace=data/trace.pcap or trace=data/trace.csv
+TESTBENCHES = dict(sweep.TESTBENCHES, Trace=('trace_tb', 'Trace_tb'))
+ENGINES = ['simpy', 'fast']
+
+def parse_params(args):
+    """
+    Parse NAME=VALUE testbench parameters, the values are python literals,
+    anything else (e.g. a file name) is taken as a string
+    """
+    params = {}
+    for arg in args:
+        (name, sep, value) = arg.partition('=')
+        if sep != '=' or name == '':
+            raise ValueError('expected NAME=VALUE, got {}'.format(arg))
+        try:
+            params[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            params[name] = value
+    return params
+
+def run_simpy(tb_class, params, profile=False):
+    """
+    Run the testbench in simpy. Returns (tb, results).
+    """
+    env = CountingEnvironment()
+    profiler = SimProfiler(env) if profile else None
+    tb = tb_class(env, 1, **params)
+    start = timer()
+    env.run()
+    wall_time = timer() - start
+    if profiler is not None:
+        profiler.print_report()
+    results = sweep.summarize(tb)
+    results.update({'wall_time': wall_time,
+                    'events': env.event_cnt,
+                    'cycles': env.now,
+                    'nodes': tb.switch.tm.metrics()})
+    return (tb, results)
+
+def run_fast(tb_class, params):
+    """
+    Run the testbench in the fast engine, the input and output pkts are recorded
+    into new ColumnRecorders of tb. Returns (tb, results).
+    """
+    tb = tb_class(simpy.Environment(), 1, **params)
+    sim = FastSwitchSim.from_testbench(tb)
+    start = timer()
+    sim.run()
+    wall_time = timer() - start
+    (tb.input_columns, tb.output_columns) = (ColumnRecorder(sim.flowID_func), ColumnRecorder(sim.flowID_func))
+    for (columns, pkts) in [(tb.input_columns, sim.input_pkts), (tb.output_columns, sim.output_pkts)]:
+        for (time, meta, pkt) in pkts:
+            columns.record(time, meta, pkt)
+    results = sweep.summarize_columns(tb.input_columns, tb.output_columns, sim.drop_cnt, sim.latency)
+    results.update({'wall_time': wall_time,
+                    'events': sim.event_cnt,
+                    'cycles': sim.clock.now,
+                    'nodes': sim.metrics()})
+    return (tb, results)
+
+def to_json(val):
+    """
+    Convert the results to JSON types, NaN (e.g. the latency of a run without
+    output pkts) becomes null
+    """
+    if isinstance(val, dict):
+        return dict((str(key), to_json(item)) for (key, item) in val.items())
+    if hasattr(val, '_asdict'):
+        return to_json(val._asdict())
+    if isinstance(val, (list, tuple)):
+        return [to_json(item) for item in val]
+    if hasattr(val, 'item'):
+        # numpy scalar
+        val = val.item()
+    if isinstance(val, float) and val != val:
+        return None
+    return val
+
+def plot(module, tb, plot_file):
+    """
+    Show the flow rate plots of the testbench, or save them to plot_file if given
+    """
+    # scapy has already imported pyplot (see hwsim_utils), so the backend is
+    # switched rather than picked with matplotlib.use()
+    import matplotlib.pyplot as plt
+    if plot_file:
+        plt.switch_backend('Agg')
+    module.plot_stats(tb.input_columns, tb.output_columns, tb.egress_link_rate)
+    if plot_file:
+        plt.savefig(plot_file)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run one testbench configuration and print its results as JSON')
+    parser.add_argument('testbench', choices=sorted(TESTBENCHES.keys()))
+    parser.add_argument('params', nargs='*', metavar='NAME=VALUE',
+                        help='testbench parameters as python literals, e.g. cycle_limit=5000 "rates=[10, 20]", keep_pkts is False unless given')
+    parser.add_argument('--engine', choices=ENGINES, default='simpy', help='simulation engine (default: %(default)s)')
+    parser.add_argument('--output', type=str, default=None, help='write the JSON results to this file instead of stdout')
+    parser.add_argument('--plot', nargs='?', const='', default=None, metavar='FILE',
+                        help='plot the input and output flow rates, into FILE without a display if given')
+    parser.add_argument('--profile', action='store_true', help='print the simpy profiler report (see sim_profiler) to stderr')
+    args = parser.parse_args()
+
+    try:
+        params = parse_params(args.params)
+    except ValueError as e:
+        parser.error(str(e))
+    params.setdefault('keep_pkts', False)
+    if args.testbench == 'Trace':
+        # the results are summarized from the pkt columns, which Trace_tb only records on request
+        params.setdefault('record_columns', True)
+    (module_name, cls) = TESTBENCHES[args.testbench]
+    module = __import__(module_name)
+    if args.plot is not None and not hasattr(module, 'plot_stats'):
+        parser.error('the {} testbench cannot plot'.format(args.testbench))
+    if args.profile and args.engine != 'simpy':
+        parser.error('--profile needs the simpy engine')
+
+    # the testbenches print their progress, keep stdout for the JSON results
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        if args.engine == 'fast':
+            (tb, results) = run_fast(getattr(module, cls), params)
+        else:
+            (tb, results) = run_simpy(getattr(module, cls), params, args.profile)
+    finally:
+        sys.stdout = stdout
+
+    results.update({'testbench': args.testbench, 'engine': args.engine, 'params': params})
+    results = to_json(results)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True, separators=(',', ': '))
+    else:
+        json.dump(results, sys.stdout, indent=1, sort_keys=True, separators=(',', ': '))
+        print
+
+    if args.plot is not None:
+        sys.stdout = sys.stderr
+        plot(module, tb, args.plot)
+        sys.stdout = stdout
+
+
+if __name__ == '__main__':
+    main()
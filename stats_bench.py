@@ -0,0 +1,52 @@
+
+import numpy as np
+from timeit import default_timer as timer
+from hwsim_utils import PktRecord, IP
+from stats_utils import StatsGenerator
+
+NUM_PKTS = 10000000
+LEGACY_PKTS = 1000000
+NUM_FLOWS = 16
+AVG_INTERVAL = 1000
+SEED = 1
+
+def make_trace(num_pkts):
+    """
+    Columnar trace of num_pkts pkts from NUM_FLOWS flows with bursty arrivals
+    """
+    rng = np.random.RandomState(SEED)
+    gaps = rng.choice([0, 1, 2, 5, 10, 20], size=num_pkts)
+    times = np.cumsum(gaps)
+    flow_ids = rng.randint(0, NUM_FLOWS, size=num_pkts)
+    lengths = rng.randint(64, 1501, size=num_pkts)
+    return (times, flow_ids, lengths)
+
+def bench_legacy(times, flow_ids, lengths):
+    pkt_list = [(t, PktRecord(l, sport=f)) for (t, f, l) in zip(times.tolist(), flow_ids.tolist(), lengths.tolist())]
+    start = timer()
+    stats = StatsGenerator(((IP, 'sport'),), pkt_list, avg_interval=AVG_INTERVAL)
+    return (stats, timer() - start)
+
+def bench_numpy(times, flow_ids, lengths):
+    start = timer()
+    stats = StatsGenerator.from_arrays(times, flow_ids, lengths, avg_interval=AVG_INTERVAL)
+    return (stats, timer() - start)
+
+def main():
+    """
+    Compare the per-pkt calc_flow_rates with the NumPy path
+    """
+    (times, flow_ids, lengths) = make_trace(LEGACY_PKTS)
+    (legacy, legacy_time) = bench_legacy(times, flow_ids, lengths)
+    (fast, fast_time) = bench_numpy(times, flow_ids, lengths)
+    assert legacy.flow_rates == fast.flow_rates, 'NumPy rates differ from calc_flow_rates'
+    print '{:>10} {:>12} {:>12} {:>10}'.format('# pkts', 'legacy (s)', 'numpy (s)', 'speedup')
+    print '{:>10} {:>12.2f} {:>12.2f} {:>9.1f}x'.format(LEGACY_PKTS, legacy_time, fast_time, legacy_time/fast_time)
+
+    (times, flow_ids, lengths) = make_trace(NUM_PKTS)
+    (fast, fast_time) = bench_numpy(times, flow_ids, lengths)
+    print '{:>10} {:>12} {:>12.2f}'.format(NUM_PKTS, '-', fast_time)
+
+
+if __name__ == '__main__':
+    main()
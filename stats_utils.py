@@ -1,8 +1,6 @@
 
 import sys, os
-from scapy.all import *
-import matplotlib
-import matplotlib.pyplot as plt
+import numpy as np
 
 
 class StatsGenerator(object):
@@ -18,6 +16,23 @@ class StatsGenerator(object):
         self.flow_pkts = self.parse_pkt_list(pkt_list)
         self.flow_rates = self.calc_flow_rates(self.flow_pkts)
 
+    @classmethod
+    def from_arrays(cls, times, flow_ids, lengths, avg_interval=1000):
+        """
+        Build a StatsGenerator from columnar pkt data rather than a pkt_list:
+        times: nanosecond timestamps (non-decreasing)
+        flow_ids: integer flow ID of each pkt
+        lengths: length of each pkt in bytes
+        """
+        stats = cls.__new__(cls)
+        stats.avg_interval = avg_interval
+        stats.flowID_tuple = None
+        stats.flow_pkts = None
+        stats.flow_rates = {}
+        for flowID, (sample_times, rates) in calc_flow_rates_arrays(times, flow_ids, lengths, avg_interval).items():
+            stats.flow_rates[(flowID,)] = list(zip(sample_times.tolist(), rates.tolist()))
+        return stats
+
     def extract_flowID(self, pkt):
         flowID = []
         for (layer, field) in self.flowID_tuple:
@@ -39,7 +54,7 @@ class StatsGenerator(object):
         flow_pkts = {}
         for (t, pkt) in pkt_list:
             flowID = self.extract_flowID(pkt)
-            if flowID not in flow_pkts.keys():
+            if flowID not in flow_pkts:
                 flow_pkts[flowID] = [(t, pkt)]
             else:
                 flow_pkts[flowID].append((t,pkt))
@@ -61,7 +76,7 @@ class StatsGenerator(object):
                     byte_cnt += len(pkt)
                 else:
                     # insert 0 samples if needed
-                    for t in range(prev_time, cur_time, self.avg_interval)[0:-2]:
+                    for t in list(range(prev_time, cur_time, self.avg_interval))[0:-2]:
                         avg_time = (t + self.avg_interval/2.0)
                         flow_rates[flowID].append((avg_time, 0))
                         prev_time = t + self.avg_interval
@@ -88,6 +103,7 @@ class StatsGenerator(object):
         """
         Plots the flow rates
         """
+        import matplotlib.pyplot as plt
         line_generator = self.line_gen()
         for flowID, rate_points in self.flow_rates.items():
             times = [point[0] for point in rate_points]
@@ -104,4 +120,73 @@ class StatsGenerator(object):
             plt.ylim(0, ymax)
 
 
+def calc_flow_rates_arrays(times, flow_ids, lengths, avg_interval):
+    """
+    NumPy implementation of StatsGenerator.calc_flow_rates on columnar pkt data.
+    Returns a dictionary mapping each flowID to arrays (sample_times, rates)
+    that are identical to the samples calc_flow_rates would compute.
+    """
+    times = np.asarray(times)
+    flow_ids = np.asarray(flow_ids)
+    lengths = np.asarray(lengths)
+    # stable sort so that each flow's pkts stay in time order
+    order = np.argsort(flow_ids, kind='mergesort')
+    sorted_ids = flow_ids[order]
+    bounds = np.flatnonzero(sorted_ids[1:] != sorted_ids[:-1]) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(order)]))
+    flow_rates = {}
+    for (start, end) in zip(starts, ends):
+        idx = order[start:end]
+        flow_rates[sorted_ids[start].item()] = calc_rates_arrays(times[idx], lengths[idx], avg_interval)
+    return flow_rates
+
+def calc_rates_arrays(times, lengths, avg_interval):
+    """
+    Rate samples of a single flow. An averaging interval starts at its first
+    pkt and ends at the first pkt more than avg_interval later, which then
+    starts the next interval. The pkt that ends an interval is not counted
+    in either one and there is no sample for the last (open) interval.
+    """
+    if len(times) == 0:
+        return (np.zeros(0), np.zeros(0))
+    # find the pkts that end each interval
+    ends = []
+    i = 0
+    while True:
+        i = times.searchsorted(times[i] + avg_interval, side='right')
+        if i >= len(times):
+            break
+        ends.append(i)
+    if len(ends) == 0:
+        return (np.zeros(0), np.zeros(0))
+    ends = np.array(ends)
+    starts = np.concatenate(([0], ends[:-1]))
+
+    byte_cnts = np.concatenate(([0], np.cumsum(lengths)))
+    first = starts + 1
+    first[0] = 0
+    byte_cnt = byte_cnts[ends] - byte_cnts[first]
+
+    # long gaps are filled with zero samples, all but the last two avg_intervals of the gap
+    prev_time = times[starts]
+    cur_time = times[ends]
+    num_zeros = np.maximum((cur_time - prev_time + avg_interval - 1)//avg_interval - 2, 0)
+    prev_time = prev_time + num_zeros*avg_interval
+
+    rates = (byte_cnt*8.0)/(cur_time - prev_time)
+    avg_times = (cur_time + prev_time)/2.0
 
+    # interleave the zero samples before the sample of their interval
+    num_samples = num_zeros + 1
+    positions = np.cumsum(num_samples) - 1
+    sample_times = np.zeros(positions[-1] + 1)
+    sample_rates = np.zeros(positions[-1] + 1)
+    sample_times[positions] = avg_times
+    sample_rates[positions] = rates
+    zero_mask = np.ones(len(sample_times), dtype=bool)
+    zero_mask[positions] = False
+    group_start = np.repeat(positions - num_zeros, num_zeros)
+    offsets = np.flatnonzero(zero_mask) - group_start
+    sample_times[zero_mask] = np.repeat(times[starts], num_zeros) + offsets*avg_interval + avg_interval/2.0
+    return (sample_times, sample_rates)
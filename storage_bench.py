@@ -0,0 +1,50 @@
+
+import sys
+import gc
+import random
+from timeit import default_timer as timer
+from pifo_storage import HeapStorage, CalendarQueue
+
+SIZES = [10**4, 10**5, 10**6, 10**7]
+NUM_OPS = 200000
+# ranks of new pkts are up to RANK_SPREAD above the rank being dequeued (like RR / WRR)
+RANK_SPREAD = 1000
+NUM_BUCKETS = 1024
+SEED = 1
+
+def fill(values, size, rng):
+    for i in range(size):
+        values.push((rng.randint(0, RANK_SPREAD), i))
+
+def bench(make_values, size):
+    """
+    Hold model: fill the PIFO with size pkts, then repeatedly dequeue one and
+    enqueue one with a slightly larger rank. Returns the # of dequeue +
+    enqueue pairs per second.
+    """
+    rng = random.Random(SEED)
+    values = make_values()
+    fill(values, size, rng)
+    incs = [rng.randint(1, RANK_SPREAD) for i in range(NUM_OPS)]
+    gc.collect()
+    start = timer()
+    for i in range(NUM_OPS):
+        (rank, data) = values.pop()
+        values.push((rank + incs[i], data))
+    return NUM_OPS/(timer() - start)
+
+def main():
+    """
+    Compare the heapq and calendar queue PIFO storage with integer ranks
+    """
+    sizes = SIZES if len(sys.argv) < 2 else [int(size) for size in sys.argv[1:]]
+    print '{:>10} {:>16} {:>18} {:>9}'.format('# pkts', 'heapq (op/s)', 'calendar (op/s)', 'speedup')
+    for size in sizes:
+        heap_rate = bench(HeapStorage, size)
+        calendar_rate = bench(lambda: CalendarQueue(NUM_BUCKETS), size)
+        print '{:>10} {:>16.0f} {:>18.0f} {:>8.2f}x'.format(size, heap_rate, calendar_rate, calendar_rate/heap_rate)
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
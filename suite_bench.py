@@ -0,0 +1,194 @@
+import os
+import sys
+import json
+import argparse
+import multiprocessing
+import time
+from bench_utils import CountingEnvironment
+from sweep import TESTBENCHES, quiet_worker
+
+SCHED_ALGS = ['Strict', 'RR', 'WRR', 'STFQ', 'HSTFQ', 'MinRate']
+# scheduling tree shapes by # of levels
+SHAPES = {1: {0: []},
+          2: {0: [1, 2]},
+          3: {0: [{1: [3, 4]}, {2: [5, 6]}]}}
+# HSTFQ and MinRate put every pkt into node 1 or 2
+MIN_LEVELS = {'HSTFQ': 2, 'MinRate': 2}
+FLOW_COUNTS = [4, 16, 64]
+# the # of pkts grows with the cycle limit
+CYCLE_LIMITS = [5000, 20000]
+# offered load of all flows together, twice the 10 Gbps egress link
+TOTAL_RATE = 20 # Gbps
+# pkts/s is measured in CPU time and the median of this many runs of each configuration
+REPEAT = 3
+BASELINE_FILE = 'bench_baseline.json'
+# the saved baseline is the median of this many runs of the whole suite
+BASELINE_RUNS = 3
+# maps each metric to (larger is better, relative change that counts as a regression),
+# events/pkt is deterministic while pkts/s varies by up to ~40% between runs on a busy machine
+THRESHOLDS = {'pkts_per_sec': (True, 0.40),
+              'peak_rss_mb': (False, 0.10),
+              'events_per_pkt': (False, 0.01)}
+
+def configs(sched_algs=SCHED_ALGS):
+    return [(alg, levels, num_flows, cycle_limit) for alg in sched_algs for levels in sorted(SHAPES) if levels >= MIN_LEVELS.get(alg, 1)
+            for num_flows in FLOW_COUNTS for cycle_limit in CYCLE_LIMITS]
+
+def config_key(config):
+    return '{},{}-level,{} flows,{} cycles'.format(*config)
+
+def tb_kwargs(alg, num_flows):
+    kwargs = {'rates': [float(TOTAL_RATE)/num_flows]*num_flows}
+    if alg == 'WRR':
+        kwargs['weights'] = dict((i, 2 if i == 0 else 1) for i in range(num_flows))
+    return kwargs
+
+def extend_paths(tb):
+    """
+    Make every pkt enter the scheduling tree at a leaf on the deepest level:
+    below the node that its sched_alg picked, the pkt follows the children
+    selected by its flowID and gets the rank it has in that node, which does
+    not change the order in which the tree sends the pkts
+    """
+    ingress = tb.switch.ingress
+    nodes = tb.switch.tm.nodes
+    alg_ingress = ingress.alg_ingress
+    def deep_ingress(pipe, meta, pkt):
+        for event in alg_ingress(pipe, meta, pkt):
+            yield event
+        node = nodes[meta.leaf_node]
+        while len(node.children) > 0:
+            node = node.children[pkt.sport % len(node.children)]
+            meta.ranks.insert(0, meta.ranks[0])
+        meta.leaf_node = node.ID
+    ingress.alg_ingress = deep_ingress
+
+def median(values):
+    """
+    The upper of the two middle values for an even count, so the deterministic metrics stay exact
+    """
+    return sorted(values)[len(values)//2]
+
+def peak_rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])/1024.0
+
+def run_config(job):
+    """
+    Run one configuration repeat times in a fresh worker process and return
+    its metrics, with the median CPU time of the runs
+    """
+    ((alg, levels, num_flows, cycle_limit), repeat) = job
+    (module, cls) = TESTBENCHES[alg]
+    tb_class = getattr(__import__(module), cls)
+    cpu_times = []
+    for i in range(repeat):
+        env = CountingEnvironment()
+        tb = tb_class(env, 1, sched_tree_shape=SHAPES[levels], cycle_limit=cycle_limit, keep_pkts=False, **tb_kwargs(alg, num_flows))
+        extend_paths(tb)
+        start = time.clock()
+        env.run()
+        cpu_times.append(time.clock() - start)
+    cpu_time = median(cpu_times)
+    num_pkts = tb.receiver.pkt_cnt
+    return {'pkts': num_pkts,
+            'cpu_time': cpu_time,
+            'pkts_per_sec': num_pkts/cpu_time,
+            'events_per_pkt': float(env.event_cnt)/max(1, num_pkts),
+            'peak_rss_mb': peak_rss_mb()}
+
+def run_suite(configs, repeat=REPEAT, processes=1):
+    """
+    Every configuration gets its own worker so that its peak RSS is its own.
+    Runs one configuration at a time by default so they do not compete for the CPU.
+    """
+    # import the testbenches once so that the forked workers do not have to
+    for (module, cls) in TESTBENCHES.values():
+        __import__(module)
+    pool = multiprocessing.Pool(processes, initializer=quiet_worker, maxtasksperchild=1)
+    try:
+        results = pool.map(run_config, [(config, repeat) for config in configs], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return dict((config_key(config), result) for (config, result) in zip(configs, results))
+
+def combine_runs(runs):
+    """
+    Returns the median of every metric of every configuration over several runs of the suite
+    """
+    return dict((key, dict((metric, median([run[key][metric] for run in runs])) for metric in result))
+                for (key, result) in runs[0].items())
+
+def regressions(result, baseline, thresholds):
+    """
+    Returns the metrics of result that regressed by more than their threshold from baseline
+    """
+    regressed = []
+    for (metric, (larger_is_better, threshold)) in sorted(thresholds.items()):
+        if metric not in baseline:
+            continue
+        change = (result[metric] - baseline[metric])/baseline[metric]
+        if (larger_is_better and change < -threshold) or (not larger_is_better and change > threshold):
+            regressed.append('{} {:+.1f}%'.format(metric, change*100))
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every sched_alg on 1, 2 and 3 level scheduling trees and compare against a baseline')
+    parser.add_argument('--algs', nargs='+', choices=SCHED_ALGS, default=SCHED_ALGS)
+    parser.add_argument('--baseline', type=str, default=BASELINE_FILE, help='JSON file with the baseline results (default: %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results to the baseline file instead of comparing against it')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='# of runs of each configuration (default: %(default)s)')
+    parser.add_argument('--baseline-runs', type=int, default=BASELINE_RUNS,
+                        help='# of runs of the suite whose median is saved with --save-baseline (default: %(default)s)')
+    parser.add_argument('--processes', type=int, default=1, help='# of configurations to run in parallel (default: %(default)s)')
+    parser.add_argument('--threshold', action='append', default=[], metavar='METRIC=FRACTION',
+                        help='override the regression threshold of a metric ({}), e.g. pkts_per_sec=0.1'.format(', '.join(sorted(THRESHOLDS))))
+    args = parser.parse_args()
+
+    thresholds = dict(THRESHOLDS)
+    for arg in args.threshold:
+        (metric, sep, fraction) = arg.partition('=')
+        if metric not in thresholds or sep != '=':
+            parser.error('invalid threshold {}'.format(arg))
+        thresholds[metric] = (thresholds[metric][0], float(fraction))
+
+    suite_configs = configs(args.algs)
+    num_runs = args.baseline_runs if args.save_baseline else 1
+    results = combine_runs([run_suite(suite_configs, args.repeat, args.processes) for i in range(num_runs)])
+
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    num_regressions = 0
+    print '{:<8} {:>6} {:>6} {:>7} {:>7} {:>10} {:>12} {:>9}  {}'.format('alg', 'levels', 'flows', 'cycles', '# pkts', 'pkts/s', 'events/pkt', 'RSS (MB)', 'regressions')
+    for config in suite_configs:
+        key = config_key(config)
+        result = results[key]
+        regressed = regressions(result, baseline[key], thresholds) if key in baseline else []
+        num_regressions += len(regressed)
+        print '{:<8} {:>6} {:>6} {:>7} {:>7} {:>10.0f} {:>12.2f} {:>9.1f}  {}'.format(config[0], config[1], config[2], config[3], result['pkts'], result['pkts_per_sec'],
+                                                                                    result['events_per_pkt'], result['peak_rss_mb'], ', '.join(regressed))
+
+    if args.save_baseline:
+        # keep the baseline of the configurations that were not run
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True, separators=(',', ': '))
+        print 'saved the baseline of {} configurations to {}'.format(len(results), args.baseline)
+    elif len(baseline) == 0:
+        print 'no baseline in {}, run with --save-baseline to create it'.format(args.baseline)
+    elif num_regressions > 0:
+        print >> sys.stderr, '{} regressions against {}'.format(num_regressions, args.baseline)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
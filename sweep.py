@@ -0,0 +1,139 @@
+
+import sys, os
+import argparse, ast, csv, itertools
+import multiprocessing
+import numpy as np
+import simpy
+
+# maps testbench name to (module, class)
+TESTBENCHES = {'Strict': ('strict_tb', 'Strict_tb'),
+               'RR': ('rr_tb', 'RR_tb'),
+               'WRR': ('wrr_tb', 'WRR_tb'),
+               'STFQ': ('stfq_tb', 'STFQ_tb'),
+               'HSTFQ': ('hstfq_tb', 'HSTFQ_tb'),
+               'MinRate': ('minRate_tb', 'MinRate_tb')}
+
+NSEC_PER_CYCLE = 5
+LATENCY_PERCENTILES = [50, 99, 99.9]
+
+def param_grid(grid):
+    """
+    grid: dictionary mapping each testbench parameter to the list of values to sweep
+    Returns the list of parameter dictionaries in the cartesian product of the grid
+    """
+    names = sorted(grid.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+def run_config(job):
+    """
+    Run one testbench configuration to completion in a fresh simpy Environment
+    and return its summary statistics. Runs in a worker process.
+    """
+    (tb_name, params) = job
+    (module, cls) = TESTBENCHES[tb_name]
+    tb_class = getattr(__import__(module), cls)
+    env = simpy.Environment()
+    period = 1
+    tb = tb_class(env, period, keep_pkts=False, **params)
+    env.run()
+    return summarize(tb)
+
+def summarize(tb):
+    """
+    Per flow throughput, drop count and latency percentiles of a testbench run.
+    Latency is the ingress to egress time of the pkts that left the switch (see latency_stats).
+    """
+    return summarize_columns(tb.input_columns, tb.output_columns, tb.switch.tm.drop_cnt, tb.switch.latency)
+
+def summarize_columns(input_columns, output_columns, drops, latency):
+    """
+    Same as summarize from the ColumnRecorders of the pkts entering and leaving
+    the switch, its drop count and its LatencyStats
+    """
+    input_pkts = input_columns.arrays()
+    output_pkts = output_columns.arrays()
+    summary = {'pkts_in': len(input_pkts['time']),
+               'pkts_out': len(output_pkts['time']),
+               'drops': drops,
+               'throughput': {}}
+    for p in LATENCY_PERCENTILES:
+        summary['latency_p{}'.format(p)] = float('nan')
+    if summary['pkts_out'] == 0:
+        return summary
+
+    # Gbps over the whole run
+    duration = (output_pkts['time'][-1] - input_pkts['time'][0])*NSEC_PER_CYCLE
+    for flowID in np.unique(input_pkts['flow_id']).tolist():
+        out_mask = output_pkts['flow_id'] == flowID
+        summary['throughput'][flowID] = output_pkts['length'][out_mask].sum()*8.0/duration
+    latencies = latency.percentiles('total', LATENCY_PERCENTILES)
+    for (p, value) in zip(LATENCY_PERCENTILES, latencies):
+        summary['latency_p{}'.format(p)] = value
+    return summary
+
+def quiet_worker():
+    # the testbenches print progress that would interleave across workers
+    sys.stdout = open(os.devnull, 'w')
+
+def run_sweep(tb_name, grid, processes=None):
+    """
+    Run every configuration in the grid, each in its own worker process.
+    Returns a list of (params, summary) in grid order.
+    """
+    configs = param_grid(grid)
+    pool = multiprocessing.Pool(processes, initializer=quiet_worker)
+    try:
+        summaries = pool.map(run_config, [(tb_name, params) for params in configs], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return zip(configs, summaries)
+
+def make_table(results):
+    """
+    Flatten the sweep results into a header and one row per configuration
+    """
+    param_names = sorted(set(name for (params, summary) in results for name in params))
+    flowIDs = sorted(set(flowID for (params, summary) in results for flowID in summary['throughput']))
+    header = param_names + ['pkts_in', 'pkts_out', 'drops'] + ['latency_p{}'.format(p) for p in LATENCY_PERCENTILES] + ['tput_{}'.format(f) for f in flowIDs]
+    rows = []
+    for (params, summary) in results:
+        row = [params.get(name) for name in param_names]
+        row += [summary['pkts_in'], summary['pkts_out'], summary['drops']]
+        row += [summary['latency_p{}'.format(p)] for p in LATENCY_PERCENTILES]
+        row += [summary['throughput'].get(f) for f in flowIDs]
+        rows.append(row)
+    return (header, rows)
+
+def format_cell(val):
+    if type(val) == float or isinstance(val, np.floating):
+        return '{:.3f}'.format(val)
+    return str(val)
+
+def print_table(header, rows):
+    cells = [header] + [[format_cell(val) for val in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(header))]
+    for row in cells:
+        print '  '.join(cell.rjust(width) for (cell, width) in zip(row, widths))
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a grid of testbench configurations in parallel')
+    parser.add_argument('testbench', choices=sorted(TESTBENCHES.keys()))
+    parser.add_argument('grid', type=str, help='python dict mapping parameter names to lists of values, e.g. "{\'rates\': [[10, 20], [5, 25]], \'cycle_limit\': [2000, 5000]}"')
+    parser.add_argument('--processes', type=int, default=None, help='# of worker processes (default: # of cores)')
+    parser.add_argument('--csv', type=str, default=None, help='also write the table to this CSV file')
+    args = parser.parse_args()
+
+    grid = ast.literal_eval(args.grid)
+    results = run_sweep(args.testbench, grid, args.processes)
+    (header, rows) = make_table(results)
+    print_table(header, rows)
+    if args.csv is not None:
+        with open(args.csv, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    main()
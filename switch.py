@@ -4,18 +4,37 @@ from hwsim_utils import *
 from p4_ingress import *
 from scheduling_tree import *
 from p4_egress import *
+from latency_stats import LatencyStats
 
 import json
 PCAP_FILE = 'data/pkts.pcap'
 RANK_FILE = 'data/ranks.json'
 
 class Switch(HW_sim_object):
-    def __init__(self, env, period, ready_out_pipe, pkt_in_pipe, pkt_out_pipe, start_dequeue_pipe, sched_tree_shape, sched_alg, istate=None, sched_node_size=None):
+    def __init__(self, env, period, ready_out_pipe, pkt_in_pipe, pkt_out_pipe, start_dequeue_pipe, sched_tree_shape, sched_alg, istate=None, sched_node_size=None, trace=None, keep_pkts=True, pipelined_writes=False, prefetch_reads=False,
+                 sched_drop_policy=DROP_MAX, shared_buffer=None, port=0, sched_storage=None, keep_latency=True, metrics_interval=None, metrics_csv=None):
+        """
+        sched_node_size: default capacity of the scheduling tree nodes (the shape may override it per node)
+        sched_drop_policy: default drop policy of the scheduling tree nodes
+        shared_buffer: optional SharedBuffer that the scheduling tree allocates the pkts from
+        port: identifies this switch (port) in shared_buffer
+        sched_storage: default storage engine of the scheduling tree nodes
+        trace: optional TraceSink that the ingress pkts and ranks are streamed to
+               instead of being written out by cleanup_switch
+        keep_pkts: keep the ingress pkts and ranks in memory
+        pipelined_writes: pipeline the scheduling tree enqueue across levels
+        prefetch_reads: read the next pkt out of the scheduling tree before the egress asks for it
+        keep_latency: record the latency of every outgoing pkt in self.latency (see latency_stats)
+        metrics_interval: sample the PIFOMetrics of the scheduling tree nodes every this many cycles
+                          into self.metrics (see pifo_metrics), optionally streaming them to metrics_csv
+        """
         super(Switch, self).__init__(env, period)
         self.ready_out_pipe = ready_out_pipe
         self.pkt_in_pipe = pkt_in_pipe
         self.pkt_out_pipe = pkt_out_pipe
         self.start_dequeue_pipe = start_dequeue_pipe
+        self.trace = trace
+        self.keep_pkts = keep_pkts
 
         ingress_tm_ready_pipe = simpy.Store(env)
         ingress_tm_pkt_pipe = simpy.Store(env)
@@ -23,24 +42,17 @@ class Switch(HW_sim_object):
         tm_egress_pkt_pipe = simpy.Store(env)
         ingress_egress_pipe = simpy.Store(env)
 
-        if sched_alg == "Invert_pkts":
-            self.global_state = None
-        elif sched_alg == "STFQ":
-            self.global_state = STFQ_global_state()
-        elif sched_alg == "HSTFQ":
-            self.global_state = HSTFQ_global_state()
-        elif sched_alg == "MinRate":
-            self.global_state = None
-        elif sched_alg == "RR":
-            self.global_state = None
-        elif sched_alg == "WRR":
-            self.global_state = None
-        elif sched_alg == "Strict":
-            self.global_state = None
+        self.global_state = get_sched_alg(sched_alg).make_gstate()
 
-        self.ingress = IngressPipe(env, period, ingress_tm_ready_pipe, self.pkt_in_pipe, ingress_tm_pkt_pipe, self.global_state, sched_alg, istate)
-        self.tm = Scheduling_tree(env, period, ingress_tm_ready_pipe, tm_egress_ready_pipe, ingress_tm_pkt_pipe, tm_egress_pkt_pipe, sched_tree_shape, max_node_size=sched_node_size)
-        self.egress = EgressPipe(env, period, tm_egress_ready_pipe, self.ready_out_pipe, tm_egress_pkt_pipe, self.pkt_out_pipe, self.start_dequeue_pipe, self.global_state, sched_alg)
+        self.ingress = IngressPipe(env, period, ingress_tm_ready_pipe, self.pkt_in_pipe, ingress_tm_pkt_pipe, self.global_state, sched_alg, istate, trace, keep_pkts)
+        self.tm = Scheduling_tree(env, period, ingress_tm_ready_pipe, tm_egress_ready_pipe, ingress_tm_pkt_pipe, tm_egress_pkt_pipe, sched_tree_shape, max_node_size=sched_node_size, pipelined_writes=pipelined_writes, prefetch_reads=prefetch_reads,
+                                  drop_policy=sched_drop_policy, buffer=shared_buffer, port=port, storage=sched_storage)
+        # maps flowID to the # of its pkts dropped anywhere in the scheduling tree
+        self.flow_drop_cnts = self.tm.flow_drop_cnts
+        self.metrics = PIFOMetricsSampler(env, period, self.tm, metrics_interval, csv_file=metrics_csv) if metrics_interval is not None else None
+        self.latency = LatencyStats(period, self.tm.flowID_func) if keep_latency else None
+        self.egress = EgressPipe(env, period, tm_egress_ready_pipe, self.ready_out_pipe, tm_egress_pkt_pipe, self.pkt_out_pipe, self.start_dequeue_pipe, self.global_state, sched_alg,
+                                 self.latency)
 
     def cleanup_switch(self):
         self.ingress.sim_done = True
@@ -48,22 +60,82 @@ class Switch(HW_sim_object):
         self.tm.sim_done = True
         for node in self.tm.nodes.values():
             node.sim_done = True
+        if self.metrics is not None:
+            self.metrics.close()
         yield self.wait_clock()
 
         # record the recorded pkts and ranks
-        wrpcap(PCAP_FILE, self.ingress.pkts)
-        with open(RANK_FILE, 'w') as f:
-            json.dump(self.ingress.ranks, f)
+        if self.trace is not None:
+            self.trace.close()
+        elif self.keep_pkts:
+            wrpcap(PCAP_FILE, to_scapy_pkts(self.ingress.pkts))
+            with open(RANK_FILE, 'w') as f:
+                json.dump(self.ingress.ranks, f)
 
 
-class STFQ_global_state(object):
-    def __init__(self):
-        self.virtual_time = 0
+class MultiPortSwitch(HW_sim_object):
+    def __init__(self, env, period, pkt_in_pipe, ready_out_pipes, pkt_out_pipes, start_dequeue_pipes, sched_tree_shape, sched_alg, istates=None, sched_node_size=None, keep_pkts=False, sched_drop_policy=DROP_MAX,
+                 shared_buffer=None, pipelined_writes=False, prefetch_reads=False, sched_storage=None, keep_latency=True, metrics_interval=None, metrics_csv=None):
+        """
+        N-port switch: pkts are demultiplexed on the one-hot meta.dst_port into
+        one Switch per egress port, each with its own ingress state, scheduling
+        tree and egress pipe. Pkts with several dst_port bits set are replicated.
+        ready_out_pipes, pkt_out_pipes, start_dequeue_pipes: one per port
+        istates: optional list with the ingress state of each port
+        keep_pkts: passed on to every port (the ports would all write the same pcap file)
+        drop_cnt counts the pkts without a valid port, each port counts its own scheduling tree drops
+        shared_buffer: optional SharedBuffer shared by the scheduling trees of all ports
+        pipelined_writes, prefetch_reads, sched_storage, keep_latency, metrics_interval: passed on to every port, see Switch
+        metrics_csv: CSV file name of each port with a {port} field, e.g. 'data/metrics_{port}.csv'
+        """
+        super(MultiPortSwitch, self).__init__(env, period)
+        self.pkt_in_pipe = pkt_in_pipe
+        self.num_ports = len(pkt_out_pipes)
+        self.drop_cnt = 0
+        if metrics_csv is not None and '{port}' not in metrics_csv:
+            raise ValueError('metrics_csv must contain a {{port}} field so that the ports write separate files, got {}'.format(metrics_csv))
+
+        self.port_in_pipes = []
+        self.ports = []
+        for port in range(self.num_ports):
+            port_in_pipe = simpy.Store(env)
+            istate = istates[port] if istates is not None else None
+            switch = Switch(env, period, ready_out_pipes[port], port_in_pipe, pkt_out_pipes[port], start_dequeue_pipes[port],
+                            sched_tree_shape, sched_alg, istate, sched_node_size=sched_node_size, keep_pkts=keep_pkts,
+                            sched_drop_policy=sched_drop_policy, shared_buffer=shared_buffer, port=port, pipelined_writes=pipelined_writes,
+                            prefetch_reads=prefetch_reads, sched_storage=sched_storage, keep_latency=keep_latency, metrics_interval=metrics_interval,
+                            metrics_csv=metrics_csv.format(port=port) if metrics_csv is not None else None)
+            self.port_in_pipes.append(port_in_pipe)
+            self.ports.append(switch)
 
-class HSTFQ_global_state(object):
-    def __init__(self):
-        self.flow_virtual_time = [0, 0]
-        self.class_virtual_time = 0
+        # register processes for simulation
+        self.run()
 
+    def run(self):
+        self.env.process(self.demux())
 
+    def demux(self):
+        """
+        Forward each pkt to the ports selected by its dst_port bitmap, one pkt per cycle
+        """
+        while not self.sim_done:
+            (meta, pkt) = yield self.pkt_in_pipe.get()
+            dst_port = meta.dst_port
+            ports = []
+            while dst_port:
+                port = (dst_port & -dst_port).bit_length() - 1
+                dst_port &= dst_port - 1
+                if port < self.num_ports:
+                    ports.append(port)
+            if len(ports) == 0:
+                # no valid egress port
+                self.drop_cnt += 1
+            for (i, port) in enumerate(ports):
+                # the last copy can reuse the original metadata
+                port_meta = meta if i == len(ports) - 1 else meta.clone()
+                self.port_in_pipes[port].put((port_meta, pkt))
+            yield self.wait_clock()
 
+    def cleanup_switch(self):
+        self.sim_done = True
+        yield self.env.all_of([self.env.process(switch.cleanup_switch()) for switch in self.ports])
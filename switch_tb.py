@@ -2,9 +2,14 @@
 import simpy
 from hwsim_utils import *
 from switch import Switch
+from trace_utils import ColumnRecorder
 
 class Switch_testbench(HW_sim_object):
-    def __init__(self, env, period):
+    def __init__(self, env, period, record_columns=True):
+        """
+        record_columns: record the pkts entering and leaving the switch into
+                        input_columns and output_columns, otherwise both are None
+        """
         self.env = env
         self.period = period
         self.sw_ready_out_pipe = simpy.Store(env)
@@ -15,6 +20,10 @@ class Switch_testbench(HW_sim_object):
         self.input_done = False
         self.input_pkts = []
 
+        # pkts entering and leaving the switch
+        self.input_columns = ColumnRecorder() if record_columns else None
+        self.output_columns = ColumnRecorder() if record_columns else None
+
     def reconcile_pkts(self, expected_pkts, rcvd_pkts):
         for ((exp_meta, exp_pkt), (rcvd_meta, rcvd_pkt), i) in zip(expected_pkts, rcvd_pkts, range(len(rcvd_pkts))):
             if str(exp_meta) != str(rcvd_meta):
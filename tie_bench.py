@@ -0,0 +1,69 @@
+import random
+import gc
+from timeit import default_timer as timer
+from hwsim_utils import *
+from pifo_storage import PIFOEntry, HeapStorage
+from bench_utils import LegacyPIFOEntries, run_tb
+from strict_tb import Strict_tb
+
+SIZES = [64, 1024, 16384]
+NUM_OPS = 100000
+# Strict gives every pkt of a flow the same rank
+NUM_FLOWS = 2
+SEED = 1
+
+def make_pkts(size, scapy_pkts):
+    pkts = []
+    for i in range(size):
+        pkt = Ether()/IP()/TCP(sport=i % NUM_FLOWS)/('\x00'*10)
+        if not scapy_pkts:
+            pkt = PktRecord.from_scapy(pkt)
+        meta = StdMetadata(len(pkt), 0b00000001, 0b00000100, [i % NUM_FLOWS], 0)
+        pkts.append((meta, pkt))
+    return pkts
+
+def bench_storage(size, scapy_pkts, legacy):
+    """
+    Hold model on a PIFO holding size pkts of NUM_FLOWS flows: dequeue one
+    pkt and enqueue it again with the same rank. Returns ops per second.
+    """
+    rng = random.Random(SEED)
+    values = HeapStorage()
+    seq = 0
+    for (meta, pkt) in make_pkts(size, scapy_pkts):
+        values.push((meta.ranks[0], (meta, pkt)) if legacy else PIFOEntry(meta.ranks[0], seq, (meta, pkt)))
+        seq += 1
+    gc.collect()
+    start = timer()
+    if legacy:
+        for i in range(NUM_OPS):
+            (rank, data) = values.pop()
+            values.push((rank, data))
+    else:
+        for i in range(NUM_OPS):
+            (rank, old_seq, data) = values.pop()
+            values.push(PIFOEntry(rank, seq, data))
+            seq += 1
+    return NUM_OPS/(timer() - start)
+
+def main():
+    """
+    Compare PIFO entries whose ties are broken by comparing the (meta, pkt)
+    data with entries that carry an insertion sequence number
+    """
+    print '{:>8} {:>8} {:>18} {:>18} {:>9}'.format('size', 'pkts', '(rank, data) op/s', 'PIFOEntry op/s', 'speedup')
+    for size in SIZES:
+        for scapy_pkts in [False, True]:
+            legacy_rate = bench_storage(size, scapy_pkts, True)
+            entry_rate = bench_storage(size, scapy_pkts, False)
+            print '{:>8} {:>8} {:>18.0f} {:>18.0f} {:>8.2f}x'.format(size, 'scapy' if scapy_pkts else 'record', legacy_rate, entry_rate, entry_rate/legacy_rate)
+
+    with LegacyPIFOEntries():
+        (tb, env, legacy_time) = run_tb(Strict_tb)
+    (tb, env, entry_time) = run_tb(Strict_tb)
+    print
+    print 'Strict_tb: (rank, data) {:.2f} s, PIFOEntry {:.2f} s, speedup {:.2f}x'.format(legacy_time, entry_time, legacy_time/entry_time)
+
+
+if __name__ == '__main__':
+    main()
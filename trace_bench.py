@@ -0,0 +1,125 @@
+import os
+import sys
+import struct
+import random
+import tempfile
+import multiprocessing
+import simpy
+from timeit import default_timer as timer
+from hwsim_utils import *
+from trace_utils import TracePktGenerator, DenseFlowIDs, write_binary_trace, write_csv_trace
+from trace_tb import Trace_tb
+
+SIZES = [10**5, 10**6, 10**7]
+# formats that are written for each size, pcap and CSV are slow to write so they stop at 1M pkts
+FORMATS = [('binary', '.bin', None), ('csv', '.csv', 10**6), ('pcap', '.pcap', 10**6)]
+NUM_FLOWS = 1000
+SEED = 1
+# sample the RSS every this many pkts
+RSS_INTERVAL = 100000
+# sizes of the end-to-end replays through the simpy switch, which are much slower
+REPLAY_SIZES = [10**4, 10**5]
+# Gbps, fast enough for the ~63 Gbps of the synthetic trace
+REPLAY_LINK_RATE = 100
+
+def synthetic_trace(num_pkts):
+    """
+    Yields trace records of NUM_FLOWS flows with exponential inter-arrival times
+    """
+    rng = random.Random(SEED)
+    time = 0
+    for i in xrange(num_pkts):
+        time += int(rng.expovariate(1/100.0))
+        flow = rng.randint(0, NUM_FLOWS - 1)
+        yield (time, 0x0a000000 + flow, 0x0a010001, 1024 + flow, 80, 6, rng.randint(64, 1500))
+
+def write_pcap(filename, records):
+    """
+    Write the records as a raw IP pcap file with only the IP and L4 port headers captured
+    """
+    ip_hdr = struct.Struct('!BBHHHBBHIIHH')
+    rec_hdr = struct.Struct('<IIII')
+    with open(filename, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 101))
+        for (time, src, dst, sport, dport, proto, length) in records:
+            f.write(rec_hdr.pack(time//1000000000, (time % 1000000000)//1000, ip_hdr.size, length))
+            f.write(ip_hdr.pack(0x45, 0, length, 0, 0, 64, proto, 0, src, dst, sport, dport))
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])/1024.0
+
+def bench(filename):
+    """
+    Stream every pkt of a trace through TracePktGenerator.arrivals(). Returns
+    (# pkts, pkts per second, max RSS growth in MB)
+    """
+    env = simpy.Environment()
+    gen = TracePktGenerator(env, 1, NotifyStore(env), filename, StdMetadata(0, 0, 0, [0], 0), flowID_map=DenseFlowIDs())
+    start_rss = rss_mb()
+    max_rss = start_rss
+    num_pkts = 0
+    start = timer()
+    for (cycle, meta, pkt) in gen.arrivals():
+        num_pkts += 1
+        if num_pkts % RSS_INTERVAL == 0:
+            max_rss = max(max_rss, rss_mb())
+    return (num_pkts, num_pkts/(timer() - start), max_rss - start_rss)
+
+def replay(job):
+    """
+    Replay a trace end to end through Trace_tb in simpy. Runs in a fresh worker
+    process so that memory freed by earlier runs does not hide the RSS growth.
+    Returns (# pkts, pkts per second, RSS growth in MB)
+    """
+    (filename, record_columns) = job
+    # the testbench prints its pkt counts
+    sys.stdout = open(os.devnull, 'w')
+    env = simpy.Environment()
+    start_rss = rss_mb()
+    tb = Trace_tb(env, 1, filename, egress_link_rate=REPLAY_LINK_RATE, record_columns=record_columns)
+    start = timer()
+    env.run()
+    elapsed = timer() - start
+    return (tb.receiver.pkt_cnt, tb.receiver.pkt_cnt/elapsed, rss_mb() - start_rss)
+
+def main():
+    """
+    Measure the replay rate and memory use of trace files of increasing size,
+    reading the pkt arrivals only and replaying smaller traces end to end
+    with and without the per-pkt columns
+    """
+    sizes = SIZES if len(sys.argv) < 2 else [int(size) for size in sys.argv[1:]]
+    writers = {'binary': write_binary_trace, 'csv': write_csv_trace, 'pcap': write_pcap}
+    tmp_dir = tempfile.mkdtemp()
+    print '{:>8} {:>10} {:>10} {:>12} {:>14}'.format('format', '# pkts', 'size (MB)', 'pkts/s', 'RSS growth (MB)')
+    for size in sizes:
+        for (fmt, ext, max_size) in FORMATS:
+            if max_size is not None and size > max_size:
+                continue
+            filename = os.path.join(tmp_dir, 'trace{}'.format(ext))
+            writers[fmt](filename, synthetic_trace(size))
+            (num_pkts, rate, rss_growth) = bench(filename)
+            print '{:>8} {:>10} {:>10.1f} {:>12.0f} {:>14.1f}'.format(fmt, num_pkts, os.path.getsize(filename)/1e6, rate, rss_growth)
+            sys.stdout.flush()
+            os.remove(filename)
+
+    print
+    print '{:>8} {:>10} {:>8} {:>12} {:>14}'.format('replay', '# pkts', 'columns', 'pkts/s', 'RSS growth (MB)')
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    for size in REPLAY_SIZES:
+        filename = os.path.join(tmp_dir, 'trace.bin')
+        write_binary_trace(filename, synthetic_trace(size))
+        for record_columns in [False, True]:
+            (num_pkts, rate, rss_growth) = pool.apply(replay, [(filename, record_columns)])
+            print '{:>8} {:>10} {:>8} {:>12.0f} {:>14.1f}'.format('binary', num_pkts, 'yes' if record_columns else 'no', rate, rss_growth)
+            sys.stdout.flush()
+        os.remove(filename)
+    pool.close()
+    os.rmdir(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
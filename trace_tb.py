@@ -0,0 +1,131 @@
+
+import sys
+import simpy
+from collections import defaultdict
+from hwsim_utils import *
+from switch import Switch
+from switch_tb import Switch_testbench
+from p4_ingress import STFQMeta, HSTFQMeta, HSTFQIngressState
+from trace_utils import TracePktGenerator, DenseFlowIDs, FlowCounters
+from sim_profiler import profile_env
+
+SCHED_TREE_SHAPE = {0: []}
+# HSTFQ splits the flows into two classes
+HSTFQ_TREE_SHAPE = {0: [1, 2]}
+CLASS_WEIGHTS = {0: 1, 1: 1}
+# sched_algs whose ingress state works without per-flow configuration
+SCHED_ALGS = ["RR", "Strict", "STFQ", "HSTFQ"]
+
+class Trace_tb(Switch_testbench):
+    def __init__(self, env, period, trace, sched_alg="RR", sched_tree_shape=None, sched_node_size=None, time_scale=1.0, num_flows=None,
+                 egress_link_rate=10, pkt_limit=None, cycle_limit=None, keep_pkts=False, sched_storage=None, class_weights=CLASS_WEIGHTS,
+                 metrics_interval=None, metrics_csv=None, record_columns=False):
+        """
+        Replay a pcap, CSV or binary trace (see trace_utils.open_trace) or a
+        traffic model from traffic_gen through the switch.
+        The 5-tuples of the trace are numbered 0, 1, 2, ... (modulo num_flows if given)
+        and carried in sport, which is what the sched_algs use as the flowID.
+        HSTFQ gives every flow a weight of 1 and puts even and odd flows into class 0 and 1.
+        metrics_interval, metrics_csv: see Switch
+        record_columns: also record every pkt into input_columns and output_columns
+                        (see Switch_testbench), flow_stats only needs the per-flow
+                        counters that are always kept, so a long replay uses constant memory
+        """
+        super(Trace_tb, self).__init__(env, period, record_columns)
+
+        if sched_alg not in SCHED_ALGS:
+            raise ValueError('Trace_tb supports sched_alg {}, got {}'.format(SCHED_ALGS, sched_alg))
+        self.sched_alg = sched_alg
+        if sched_tree_shape is None:
+            sched_tree_shape = HSTFQ_TREE_SHAPE if sched_alg == "HSTFQ" else SCHED_TREE_SHAPE
+        self.sched_tree_shape = sched_tree_shape
+        istate = HSTFQIngressState(defaultdict(lambda: 1), class_weights) if sched_alg == "HSTFQ" else None
+        self.switch = Switch(self.env, self.period, self.sw_ready_out_pipe, self.sw_pkt_in_pipe, self.sw_pkt_out_pipe, self.start_dequeue_pipe, self.sched_tree_shape, self.sched_alg,
+                             istate, sched_node_size=sched_node_size, keep_pkts=keep_pkts, sched_storage=sched_storage,
+                             metrics_interval=metrics_interval, metrics_csv=metrics_csv)
+
+        # start dequeueing immediately
+        self.start_dequeue_pipe.put(1)
+
+        pipe = NotifyStore(env)
+        if sched_alg == "HSTFQ":
+            meta = StdMetadata(0, 0b00000001, 0b00000100, [0, 0], 0, sched_meta=HSTFQMeta())
+        else:
+            sched_meta = STFQMeta() if sched_alg == "STFQ" else None
+            meta = StdMetadata(0, 0b00000001, 0b00000100, [0], 0, sched_meta=sched_meta)
+        pkt_gen = TracePktGenerator(env, period, pipe, trace, meta, time_scale=time_scale, flowID_map=DenseFlowIDs(num_flows),
+                                    pkt_limit=pkt_limit, cycle_limit=cycle_limit)
+        self.generators = [pkt_gen]
+        self.pkt_gen_pipes = [pipe]
+
+        self.egress_link_rate = egress_link_rate # Gbps
+
+        # pkts entering and leaving the switch per flow
+        self.input_flows = FlowCounters(recorder=self.input_columns)
+        self.output_flows = FlowCounters(recorder=self.output_columns)
+        self.arbiter = Arbiter(env, period, self.pkt_gen_pipes, self.sw_pkt_in_pipe, keep_pkts=keep_pkts, recorder=self.input_flows)
+        self.receiver = PktReceiver(env, period, self.sw_pkt_out_pipe, self.sw_ready_out_pipe, self.egress_link_rate, keep_pkts=keep_pkts, recorder=self.output_flows)
+
+        self.env.process(self.wait_complete())
+
+    def wait_complete(self):
+        # wait for all pkts to be inserted
+        for gen in self.generators:
+            yield gen.proc
+
+        # wait for receiver to receive all pkts that were not dropped, the trace
+        # generator ends as soon as it puts its last pkt so the arbiter may not have it yet
+        num_pkts = sum(gen.pkt_cnt for gen in self.generators)
+        timeout_val = 1000000 # cycles
+        cnt = 0
+        while self.receiver.pkt_cnt + self.switch.tm.drop_cnt < num_pkts and cnt < timeout_val:
+            yield self.wait_clock()
+            cnt += 1
+
+        yield self.env.process(self.cleanup_switch())
+        self.arbiter.sim_done = True
+        self.receiver.sim_done = True
+
+        print '# input pkts = {}'.format(self.arbiter.pkt_cnt)
+        print '# output pkts = {}'.format(self.receiver.pkt_cnt)
+
+    def flow_stats(self):
+        """
+        Returns a list of (flowID, # pkts, input Gbps, output Gbps) over the whole run
+        """
+        (inputs, outputs) = (self.input_flows, self.output_flows)
+        duration = (outputs.last_time - inputs.first_time)*NSEC_PER_CYCLE
+        num_flows = max(inputs.flow_pkts.keys() + outputs.flow_pkts.keys()) + 1
+        return [(flowID, outputs.flow_pkts.get(flowID, 0), inputs.flow_bytes.get(flowID, 0)*8.0/duration,
+                 outputs.flow_bytes.get(flowID, 0)*8.0/duration) for flowID in range(num_flows)]
+
+
+def main():
+    if len(sys.argv) < 2:
+        print >> sys.stderr, 'usage: {} TRACE [SCHED_ALG [TIME_SCALE]]'.format(sys.argv[0])
+        sys.exit(1)
+    sched_alg = sys.argv[2] if len(sys.argv) > 2 else "RR"
+    time_scale = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+    env = simpy.Environment()
+    profiler = profile_env(env)
+    period = 1
+    tb = Trace_tb(env, period, sys.argv[1], sched_alg=sched_alg, time_scale=time_scale)
+    env.run()
+    if profiler is not None:
+        profiler.print_report()
+
+    print '{:>6} {:>8} {:>10} {:>11}'.format('flow', '# pkts', 'in (Gbps)', 'out (Gbps)')
+    for (flowID, num_pkts, in_rate, out_rate) in tb.flow_stats():
+        print '{:>6} {:>8} {:>10.3f} {:>11.3f}'.format(flowID, num_pkts, in_rate, out_rate)
+    print
+    tb.switch.latency.print_report()
+
+    print
+    print '{:>6} {:>10} {:>10} {:>8} {:>10} {:>10} {:>8}'.format('node', '# enq', '# deq', '# drops', 'max depth', 'avg depth', 'stalls')
+    for (ID, metrics) in sorted(tb.switch.tm.metrics().items()):
+        print '{:>6} {:>10} {:>10} {:>8} {:>10} {:>10.1f} {:>8}'.format(ID, metrics.enq_cnt, metrics.deq_cnt, metrics.drop_cnt, metrics.max_depth, metrics.avg_depth,
+                                                                        metrics.stall_cycles)
+
+
+if __name__ == '__main__':
+    main()
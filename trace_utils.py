@@ -0,0 +1,432 @@
+
+import os
+import json
+import mmap
+import struct
+import socket
+from array import array
+import numpy as np
+from hwsim_utils import HW_sim_object, PktRecord, NSEC_PER_CYCLE, to_scapy_pkts, PcapWriter
+
+class TraceSink(object):
+    """
+    Streams recorded pkts to a pcap file and their ranks to a file with one
+    JSON value per line. At most buffer_size records are held in memory.
+    """
+    def __init__(self, pcap_file, rank_file, buffer_size=1024):
+        self.pcap_writer = PcapWriter(pcap_file)
+        self.rank_file = open(rank_file, 'w')
+        self.buffer_size = buffer_size
+        self.pkts = []
+        self.ranks = []
+        self.pkt_cnt = 0
+
+    def record(self, pkt, rank):
+        self.pkts.append(pkt)
+        self.ranks.append(rank)
+        self.pkt_cnt += 1
+        if len(self.pkts) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.pkts) > 0:
+            self.pcap_writer.write(to_scapy_pkts(self.pkts))
+            self.rank_file.write(''.join(json.dumps(rank) + '\n' for rank in self.ranks))
+        self.pcap_writer.flush()
+        self.rank_file.flush()
+        self.pkts = []
+        self.ranks = []
+
+    def close(self):
+        self.flush()
+        self.pcap_writer.close()
+        self.rank_file.close()
+
+def read_ranks(rank_file):
+    """
+    Read back the ranks written by a TraceSink
+    """
+    with open(rank_file) as f:
+        return [json.loads(line) for line in f]
+
+
+##################
+## Trace replay ##
+##################
+
+# Input traces are streamed as (time in ns, src IP, dst IP, sport, dport,
+# proto, length) records with the IPs as integers. Besides pcap, traces can be
+# CSV files with a header line and one record per line (IPs in dotted quad
+# notation) or compact binary files: BINARY_TRACE_MAGIC followed by one
+# BINARY_TRACE_DTYPE row per pkt.
+CSV_TRACE_HEADER = 'time_ns,src,dst,sport,dport,proto,length'
+BINARY_TRACE_MAGIC = 'PIFOTRC1'
+BINARY_TRACE_DTYPE = np.dtype([('time', '<u8'), ('src', '<u4'), ('dst', '<u4'), ('sport', '<u2'),
+                               ('dport', '<u2'), ('length', '<u2'), ('proto', 'u1'), ('pad', 'u1')])
+# # of bytes of a trace file that are mapped at once
+TRACE_WINDOW = 8 << 20
+# # of binary trace rows that are converted at once
+TRACE_CHUNK = 1 << 13
+
+class MappedFile(object):
+    """
+    Read-only mmap of a file that maps at most about window bytes at a time,
+    so that the memory used to stream through it does not depend on its size
+    """
+    def __init__(self, filename, window=TRACE_WINDOW):
+        self.f = open(filename, 'rb')
+        self.size = os.fstat(self.f.fileno()).st_size
+        self.window = window
+        self.mm = None
+        # file offset of self.mm[0]
+        self.start = 0
+
+    def view(self, offset, length):
+        """
+        Returns (mm, pos) such that mm[pos:pos + length] holds the bytes at
+        offset in the file (cut short at the end of the file)
+        """
+        length = min(length, self.size - offset)
+        if self.mm is None or offset < self.start or offset + length > self.start + len(self.mm):
+            if self.mm is not None:
+                self.mm.close()
+            self.start = offset - offset % mmap.ALLOCATIONGRANULARITY
+            map_len = min(max(self.window, offset + length - self.start), self.size - self.start)
+            self.mm = mmap.mmap(self.f.fileno(), map_len, access=mmap.ACCESS_READ, offset=self.start)
+        return (self.mm, offset - self.start)
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.f.close()
+
+def ip_to_int(ip):
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+def int_to_ip(ip):
+    return socket.inet_ntoa(struct.pack('!I', ip))
+
+def read_pcap_trace(filename):
+    """
+    Stream the IPv4 pkts of an Ethernet or raw IP pcap file as trace records,
+    the length of a pkt is its length on the wire
+    """
+    trace = MappedFile(filename)
+    try:
+        (mm, pos) = trace.view(0, 24)
+        magic = struct.unpack_from('<I', mm, pos)[0]
+        if magic in (0xa1b2c3d4, 0xa1b23c4d):
+            endian = '<'
+        else:
+            endian = '>'
+            magic = struct.unpack_from('>I', mm, pos)[0]
+            if magic not in (0xa1b2c3d4, 0xa1b23c4d):
+                raise ValueError('{} is not a pcap file'.format(filename))
+        frac_ns = 1 if magic == 0xa1b23c4d else 1000
+        linktype = struct.unpack_from(endian + 'I', mm, pos + 20)[0]
+        if linktype not in (1, 101):
+            raise ValueError('Unsupported pcap link type {} in {}, expected Ethernet (1) or raw IP (101)'.format(linktype, filename))
+        rec_hdr = struct.Struct(endian + 'IIII')
+        offset = 24
+        while offset + rec_hdr.size <= trace.size:
+            (mm, pos) = trace.view(offset, rec_hdr.size)
+            (sec, frac, incl_len, orig_len) = rec_hdr.unpack_from(mm, pos)
+            offset += rec_hdr.size
+            # Ethernet + VLAN tag + the longest IP header + the L4 ports
+            hdr_len = min(incl_len, 18 + 60 + 4)
+            (mm, pos) = trace.view(offset, hdr_len)
+            end = pos + hdr_len
+            offset += incl_len
+            ip = pos
+            if linktype == 1:
+                ethertype = struct.unpack_from('!H', mm, pos + 12)[0] if pos + 14 <= end else None
+                ip = pos + 14
+                if ethertype == 0x8100 and ip + 4 <= end:
+                    ethertype = struct.unpack_from('!H', mm, ip + 2)[0]
+                    ip += 4
+                if ethertype != 0x0800:
+                    continue
+            if ip + 20 > end or ord(mm[ip]) >> 4 != 4:
+                continue
+            proto = ord(mm[ip + 9])
+            (src, dst) = struct.unpack_from('!II', mm, ip + 12)
+            l4 = ip + (ord(mm[ip]) & 0xf)*4
+            if proto in (6, 17) and l4 + 4 <= end:
+                (sport, dport) = struct.unpack_from('!HH', mm, l4)
+            else:
+                (sport, dport) = (0, 0)
+            yield (sec*1000000000 + frac*frac_ns, src, dst, sport, dport, proto, orig_len)
+    finally:
+        trace.close()
+
+def read_csv_trace(filename):
+    """
+    Stream the records of a CSV trace (see CSV_TRACE_HEADER)
+    """
+    max_line = 256
+    trace = MappedFile(filename)
+    try:
+        offset = 0
+        while offset < trace.size:
+            (mm, pos) = trace.view(offset, max_line)
+            end = mm.find('\n', pos, pos + max_line)
+            if end == -1:
+                end = min(pos + max_line, len(mm))
+            line = mm[pos:end].strip()
+            offset += end - pos + 1
+            if len(line) == 0 or line[0].isalpha():
+                # header
+                continue
+            (time, src, dst, sport, dport, proto, length) = line.split(',')
+            yield (int(time), ip_to_int(src), ip_to_int(dst), int(sport), int(dport), int(proto), int(length))
+    finally:
+        trace.close()
+
+def read_binary_trace(filename):
+    """
+    Stream the records of a binary trace (see BINARY_TRACE_DTYPE)
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(BINARY_TRACE_MAGIC)) != BINARY_TRACE_MAGIC:
+            raise ValueError('{} is not a binary trace'.format(filename))
+    num_rows = (os.path.getsize(filename) - len(BINARY_TRACE_MAGIC)) // BINARY_TRACE_DTYPE.itemsize
+    for start in xrange(0, num_rows, TRACE_CHUNK):
+        count = min(TRACE_CHUNK, num_rows - start)
+        rows = np.memmap(filename, dtype=BINARY_TRACE_DTYPE, mode='r', shape=(count,),
+                         offset=len(BINARY_TRACE_MAGIC) + start*BINARY_TRACE_DTYPE.itemsize)
+        columns = [rows[name].tolist() for name in ('time', 'src', 'dst', 'sport', 'dport', 'proto', 'length')]
+        del rows
+        for record in zip(*columns):
+            yield record
+
+def open_trace(filename, fmt=None):
+    """
+    Stream the records of a trace file. fmt is 'pcap', 'csv' or 'binary',
+    by default it is picked from the file extension (binary unless .pcap or .csv).
+    """
+    if fmt is None:
+        ext = os.path.splitext(filename)[1].lower()
+        fmt = {'.pcap': 'pcap', '.cap': 'pcap', '.csv': 'csv'}.get(ext, 'binary')
+    readers = {'pcap': read_pcap_trace, 'csv': read_csv_trace, 'binary': read_binary_trace}
+    if fmt not in readers:
+        raise ValueError('Unknown trace format {}, expected one of {}'.format(fmt, sorted(readers.keys())))
+    return readers[fmt](filename)
+
+def write_binary_trace(filename, records):
+    """
+    Write trace records (e.g. from open_trace) to a binary trace, TRACE_CHUNK records at a time
+    """
+    with open(filename, 'wb') as f:
+        f.write(BINARY_TRACE_MAGIC)
+        rows = np.zeros(TRACE_CHUNK, dtype=BINARY_TRACE_DTYPE)
+        n = 0
+        for (time, src, dst, sport, dport, proto, length) in records:
+            rows[n] = (time, src, dst, sport, dport, length, proto, 0)
+            n += 1
+            if n == TRACE_CHUNK:
+                rows.tofile(f)
+                n = 0
+        rows[:n].tofile(f)
+
+def write_csv_trace(filename, records):
+    with open(filename, 'w') as f:
+        f.write(CSV_TRACE_HEADER + '\n')
+        for (time, src, dst, sport, dport, proto, length) in records:
+            f.write('{},{},{},{},{},{},{}\n'.format(time, int_to_ip(src), int_to_ip(dst), sport, dport, proto, length))
+
+
+class DenseFlowIDs(object):
+    """
+    flowID_map for a TracePktGenerator that numbers the 5-tuples of a trace
+    0, 1, 2, ... in order of their first pkt (modulo num_flows if given).
+    Holds one entry per distinct 5-tuple.
+    """
+    def __init__(self, num_flows=None):
+        self.num_flows = num_flows
+        self.flowIDs = {}
+
+    def __call__(self, proto, src, dst, sport, dport):
+        key = (proto, src, dst, sport, dport)
+        flowID = self.flowIDs.get(key)
+        if flowID is None:
+            flowID = len(self.flowIDs)
+            if self.num_flows is not None:
+                flowID %= self.num_flows
+            self.flowIDs[key] = flowID
+        return flowID
+
+
+class TracePktGenerator(HW_sim_object):
+    """
+    Replays the pkts of a trace into pkt_out_pipe at their recorded arrival
+    times, measured from the first pkt of the trace. The trace is streamed so
+    the generator holds one pkt at a time.
+    """
+    def __init__(self, env, period, pkt_out_pipe, trace, base_meta, time_scale=1.0, flowID_map=None, pkt_limit=None, cycle_limit=None):
+        """
+        trace: pcap, CSV or binary trace file (see open_trace) or an iterable of trace records
+        base_meta: metadata that is cloned for every pkt, with pkt_len set to the pkt's length
+        time_scale: factor applied to the arrival times (e.g. 2.0 replays the trace at half speed)
+        flowID_map: optional function (proto, src, dst, sport, dport) -> sport, since the
+                    sched_algs identify flows by sport (e.g. a DenseFlowIDs)
+        """
+        super(TracePktGenerator, self).__init__(env, period)
+        self.pkt_out_pipe = pkt_out_pipe
+        self.trace = trace
+        self.base_meta = base_meta
+        self.time_scale = time_scale
+        self.flowID_map = flowID_map
+        self.pkt_limit = pkt_limit
+        self.cycle_limit = cycle_limit
+        self.pkt_cnt = 0
+
+        self.run()
+
+    def run(self):
+        self.proc = self.env.process(self.gen_pkts())
+
+    def arrivals(self):
+        """
+        Yields the (cycle, meta, pkt) of every pkt to replay
+        """
+        records = open_trace(self.trace) if isinstance(self.trace, basestring) else iter(self.trace)
+        start = None
+        num_pkts = 0
+        for (time, src, dst, sport, dport, proto, length) in records:
+            if self.pkt_limit is not None and num_pkts >= self.pkt_limit:
+                break
+            if start is None:
+                start = time
+            cycle = int(round((time - start)*self.time_scale/NSEC_PER_CYCLE))
+            if self.cycle_limit is not None and cycle >= self.cycle_limit:
+                break
+            if self.flowID_map is not None:
+                sport = self.flowID_map(proto, src, dst, sport, dport)
+            pkt = PktRecord(length, int_to_ip(src), int_to_ip(dst), sport, dport, proto, id=num_pkts & 0xffff)
+            meta = self.base_meta.clone()
+            meta.pkt_len = length
+            num_pkts += 1
+            yield (cycle, meta, pkt)
+
+    def gen_pkts(self):
+        now = 0
+        for (cycle, meta, pkt) in self.arrivals():
+            if cycle > now:
+                yield self.wait_cycles(cycle - now)
+                now = cycle
+            self.pkt_out_pipe.put((meta, pkt))
+            self.pkt_cnt += 1
+
+
+def sport_flowID(pkt):
+    return pkt.sport
+
+class ColumnRecorder(object):
+    """
+    Records the time, flow ID, length, leaf node and ranks of pkts into
+    growable typed arrays rather than keeping the pkt and metadata objects.
+    Pkts with fewer ranks than the deepest pkt seen have NaN ranks for the
+    missing levels.
+    """
+    def __init__(self, flowID_func=sport_flowID):
+        """
+        flowID_func: maps a pkt to its (integer) flow ID
+        """
+        self.flowID_func = flowID_func
+        self.times = array('l')
+        self.flow_ids = array('l')
+        self.lengths = array('l')
+        self.leaf_nodes = array('l')
+        # one array per level of the scheduling tree
+        self.ranks = []
+
+    def __len__(self):
+        return len(self.times)
+
+    def record(self, time, meta, pkt):
+        self.times.append(time)
+        self.flow_ids.append(self.flowID_func(pkt))
+        self.lengths.append(len(pkt))
+        self.leaf_nodes.append(meta.leaf_node)
+        ranks = meta.ranks
+        while len(self.ranks) < len(ranks):
+            self.ranks.append(array('d', [float('nan')])*(len(self.times) - 1))
+        for (level, level_ranks) in enumerate(self.ranks):
+            level_ranks.append(ranks[level] if level < len(ranks) else float('nan'))
+
+    def arrays(self):
+        """
+        Returns a dictionary of NumPy arrays holding copies of the recorded columns
+        """
+        columns = {'time': np.frombuffer(self.times, dtype=np.int_).copy(),
+                   'flow_id': np.frombuffer(self.flow_ids, dtype=np.int_).copy(),
+                   'length': np.frombuffer(self.lengths, dtype=np.int_).copy(),
+                   'leaf_node': np.frombuffer(self.leaf_nodes, dtype=np.int_).copy()}
+        for (level, level_ranks) in enumerate(self.ranks):
+            columns['rank{}'.format(level)] = np.frombuffer(level_ranks, dtype=np.float64).copy()
+        return columns
+
+    def flow_ranks(self, level=0):
+        """
+        Returns a dictionary mapping each flowID to the array of its ranks, in record order
+        """
+        if len(self) == 0:
+            return {}
+        columns = self.arrays()
+        flow_ids = columns['flow_id']
+        ranks = columns['rank{}'.format(level)]
+        return dict((flowID, ranks[flow_ids == flowID]) for flowID in np.unique(flow_ids).tolist())
+
+    def save_npz(self, filename):
+        np.savez(filename, **self.arrays())
+
+    def save_parquet(self, filename):
+        """
+        Requires pyarrow
+        """
+        import pyarrow
+        import pyarrow.parquet
+        columns = self.arrays()
+        names = sorted(columns.keys())
+        table = pyarrow.Table.from_arrays([pyarrow.array(columns[name]) for name in names], names)
+        pyarrow.parquet.write_table(table, filename)
+
+class FlowCounters(object):
+    """
+    Streaming per-flow pkt and byte counts, and the times of the first and
+    last pkt, for runs that are too long to keep a ColumnRecorder
+    """
+    def __init__(self, flowID_func=sport_flowID, recorder=None):
+        """
+        flowID_func: maps a pkt to its (integer) flow ID
+        recorder: optional recorder (e.g. a ColumnRecorder) that every pkt is passed on to
+        """
+        self.flowID_func = flowID_func
+        self.recorder = recorder
+        self.flow_pkts = {}
+        self.flow_bytes = {}
+        self.first_time = None
+        self.last_time = None
+        self.pkt_cnt = 0
+
+    def __len__(self):
+        return self.pkt_cnt
+
+    def record(self, time, meta, pkt):
+        flowID = self.flowID_func(pkt)
+        self.flow_pkts[flowID] = self.flow_pkts.get(flowID, 0) + 1
+        self.flow_bytes[flowID] = self.flow_bytes.get(flowID, 0) + len(pkt)
+        if self.first_time is None:
+            self.first_time = time
+        self.last_time = time
+        self.pkt_cnt += 1
+        if self.recorder is not None:
+            self.recorder.record(time, meta, pkt)
+
+def load_npz(filename):
+    """
+    Read back the columns written by ColumnRecorder.save_npz
+    """
+    with np.load(filename) as data:
+        return dict((name, data[name]) for name in data.files)
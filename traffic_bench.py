@@ -0,0 +1,107 @@
+import random
+import simpy
+from itertools import islice
+from timeit import default_timer as timer
+from hwsim_utils import *
+from trace_utils import TracePktGenerator
+from traffic_gen import PoissonTraffic, OnOffTraffic, FlowSizeTraffic, WEB_SEARCH_CDF, DATA_MINING_CDF
+from trace_tb import Trace_tb
+from fast_sim import FastSwitchSim
+
+NUM_RECORDS = 1000000
+FLOW_COUNTS = [100, 1000, 10000, 100000]
+# Poisson arrivals of 64 byte pkts at a total of 100 Gbps, about one pkt per cycle
+RATE = 100 # Gbps
+PKT_LEN = 64
+CYCLE_LIMIT = 100000
+# 10 ms
+SIM_CYCLE_LIMIT = 2000000
+SEED = 1
+
+def models():
+    return [('Poisson', PoissonTraffic(10000, 10, seed=SEED)),
+            ('on/off', OnOffTraffic(10000, 1, 20000, 180000, seed=SEED)),
+            ('web search', FlowSizeTraffic(WEB_SEARCH_CDF, 0.8, seed=SEED)),
+            ('data mining', FlowSizeTraffic(DATA_MINING_CDF, 0.8, seed=SEED))]
+
+def sim_models():
+    """
+    Traffic that loads the 10 Gbps egress link of a Trace_tb
+    """
+    return [('Poisson', PoissonTraffic(1000, 9.5, seed=SEED)),
+            ('on/off', OnOffTraffic(1000, 1, 20000, 3000000, seed=SEED)),
+            ('web search', FlowSizeTraffic(WEB_SEARCH_CDF, 0.9, flow_rate=1, seed=SEED))]
+
+def bench_model(model):
+    """
+    Returns the # of trace records the model produces per second
+    """
+    start = timer()
+    for record in islice(iter(model), NUM_RECORDS):
+        pass
+    return NUM_RECORDS/(timer() - start)
+
+def poisson_flow(env, pipe, rng, mean_gap, meta, pkt):
+    """
+    One Poisson source as its own simpy process
+    """
+    while True:
+        yield env.timeout(max(1, int(round(rng.expovariate(1/mean_gap)))))
+        pipe.put((meta.clone(), pkt.copy()))
+
+def bench_per_flow(num_flows):
+    env = simpy.Environment()
+    pipe = simpy.Store(env)
+    meta = StdMetadata(PKT_LEN, 0, 0, [0], 0)
+    mean_gap = PKT_LEN*8.0/RATE*num_flows/NSEC_PER_CYCLE # cycles
+    for flowID in range(num_flows):
+        pkt = PktRecord(PKT_LEN, sport=flowID)
+        env.process(poisson_flow(env, pipe, random.Random(SEED + flowID), mean_gap, meta, pkt))
+    start = timer()
+    env.run(until=CYCLE_LIMIT)
+    return (len(pipe.items), timer() - start)
+
+def bench_batched(num_flows):
+    env = simpy.Environment()
+    pipe = simpy.Store(env)
+    meta = StdMetadata(PKT_LEN, 0, 0, [0], 0)
+    traffic = PoissonTraffic(num_flows, RATE, pkt_len=PKT_LEN, seed=SEED)
+    gen = TracePktGenerator(env, 1, pipe, traffic, meta, cycle_limit=CYCLE_LIMIT)
+    start = timer()
+    env.run(until=CYCLE_LIMIT)
+    return (len(pipe.items), timer() - start)
+
+def main():
+    """
+    Measure the sampling rate of the traffic models, the cost of generating
+    Poisson arrivals with one simpy process per flow vs. one TracePktGenerator
+    fed by a PoissonTraffic, and drive STFQ / HSTFQ with each model in the fast engine
+    """
+    print '{:>12} {:>12}'.format('model', 'records/s')
+    for (name, model) in models():
+        print '{:>12} {:>12.0f}'.format(name, bench_model(model))
+
+    print
+    print '{:>8} {:>22} {:>22} {:>9}'.format('# flows', 'per-flow procs (pkt/s)', 'batched (pkt/s)', 'speedup')
+    for num_flows in FLOW_COUNTS:
+        (per_flow_pkts, per_flow_time) = bench_per_flow(num_flows)
+        (batched_pkts, batched_time) = bench_batched(num_flows)
+        per_flow_rate = per_flow_pkts/per_flow_time
+        batched_rate = batched_pkts/batched_time
+        print '{:>8} {:>22.0f} {:>22.0f} {:>8.2f}x'.format(num_flows, per_flow_rate, batched_rate, batched_rate/per_flow_rate)
+
+    print
+    print '{:>12} {:>8} {:>8} {:>10} {:>10}'.format('model', 'alg', '# flows', '# pkts', 'wall (s)')
+    for (name, traffic) in sim_models():
+        for sched_alg in ["STFQ", "HSTFQ"]:
+            tb = Trace_tb(simpy.Environment(), 1, traffic, sched_alg=sched_alg, cycle_limit=SIM_CYCLE_LIMIT)
+            sim = FastSwitchSim.from_testbench(tb)
+            start = timer()
+            sim.run()
+            wall_time = timer() - start
+            num_flows = len(set(pkt.sport for (t, meta, pkt) in sim.input_pkts))
+            print '{:>12} {:>8} {:>8} {:>10} {:>10.2f}'.format(name, sched_alg, num_flows, len(sim.output_pkts), wall_time)
+
+
+if __name__ == '__main__':
+    main()
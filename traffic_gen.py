@@ -0,0 +1,234 @@
+
+import numpy as np
+
+# # of pkts or flows that are sampled at once
+BATCH_SIZE = 1 << 14
+# all flows share these fields, the flowID is carried in sport (and src for flowIDs >= 2^16)
+BASE_SRC_IP = 0x0a000000 # 10.0.0.0
+DST_IP = 0x0a800001 # 10.128.0.1
+DPORT = 80
+PROTO = 6
+
+class EmpiricalCDF(object):
+    """
+    Distribution given by points (value, cumulative probability) of its CDF,
+    sampled by interpolating linearly between the points
+    """
+    def __init__(self, points, scale=1):
+        """
+        scale: factor applied to the values (e.g. to convert pkts to bytes)
+        """
+        self.values = np.array([value for (value, prob) in points], dtype=np.float64)*scale
+        self.probs = np.array([prob for (value, prob) in points], dtype=np.float64)
+        if self.probs[0] != 0 or self.probs[-1] != 1 or np.any(np.diff(self.probs) < 0):
+            raise ValueError('CDF probabilities must increase from 0 to 1, got {}'.format(self.probs.tolist()))
+
+    def sample(self, rng, size):
+        return np.interp(rng.random_sample(size), self.probs, self.values)
+
+    def mean(self):
+        # the mean of each linear piece is the average of its end points
+        return float(np.sum(np.diff(self.probs)*(self.values[1:] + self.values[:-1])/2))
+
+# Flow size distributions used in the pFabric / PIAS simulations, in 1460 byte pkts:
+# web search (from the DCTCP paper) and data mining (from the VL2 paper)
+WEB_SEARCH_CDF = EmpiricalCDF([(6, 0), (6, 0.15), (13, 0.2), (19, 0.3), (33, 0.4), (53, 0.53), (133, 0.6),
+                               (667, 0.7), (1333, 0.8), (3333, 0.9), (6667, 0.97), (20000, 1)], scale=1460)
+DATA_MINING_CDF = EmpiricalCDF([(1, 0), (1, 0.5), (2, 0.6), (3, 0.7), (7, 0.8), (267, 0.9), (2107, 0.95),
+                                (66667, 0.99), (666667, 1)], scale=1460)
+
+def serialization_ns(length, rate):
+    """
+    ns to send length bytes at rate (Gbps)
+    """
+    return length*8.0/rate
+
+
+class StochasticTraffic(object):
+    """
+    Base class of the synthetic traffic models. The pkts of all flows are
+    sampled in NumPy batches and merged into one time ordered stream of trace
+    records (see trace_utils), so any number of flows can be replayed by a
+    single TracePktGenerator:
+      TracePktGenerator(env, period, pipe, PoissonTraffic(1000, 8, seed=1), meta)
+    Iterating over a model always replays the same pkts for the same seed.
+    """
+    def __init__(self, pkt_len=1500, seed=None, duration=None):
+        """
+        pkt_len: pkt length in bytes or an EmpiricalCDF to sample it from
+        duration: stop after this many ns (None to never stop, e.g. when the
+                  TracePktGenerator has a pkt_limit or cycle_limit)
+        """
+        self.pkt_len = pkt_len
+        self.seed = seed
+        self.duration = duration
+
+    def __iter__(self):
+        return self.records()
+
+    def mean_pkt_len(self):
+        return self.pkt_len.mean() if isinstance(self.pkt_len, EmpiricalCDF) else float(self.pkt_len)
+
+    def sample_pkt_lens(self, rng, size):
+        if isinstance(self.pkt_len, EmpiricalCDF):
+            return self.pkt_len.sample(rng, size).astype(np.int64)
+        return np.full(size, self.pkt_len, dtype=np.int64)
+
+    def batches(self, rng):
+        """
+        Yields (horizon, times, flowIDs, lengths) arrays of pkts, not
+        necessarily in time order, such that all pkts before horizon (ns)
+        have been yielded
+        """
+        raise NotImplementedError
+
+    def records(self):
+        rng = np.random.RandomState(self.seed)
+        # pkts that were sampled past the horizon
+        times = np.zeros(0)
+        flowIDs = np.zeros(0, dtype=np.int64)
+        lengths = np.zeros(0, dtype=np.int64)
+        for (horizon, batch_times, batch_flowIDs, batch_lengths) in self.batches(rng):
+            times = np.concatenate((times, batch_times))
+            flowIDs = np.concatenate((flowIDs, batch_flowIDs))
+            lengths = np.concatenate((lengths, batch_lengths))
+            order = np.argsort(times, kind='mergesort')
+            (times, flowIDs, lengths) = (times[order], flowIDs[order], lengths[order])
+            done = self.duration is not None and horizon >= self.duration
+            if done:
+                horizon = self.duration
+            n = np.searchsorted(times, horizon)
+            for record in self.to_records(times[:n], flowIDs[:n], lengths[:n]):
+                yield record
+            (times, flowIDs, lengths) = (times[n:], flowIDs[n:], lengths[n:])
+            if done:
+                return
+
+    @staticmethod
+    def to_records(times, flowIDs, lengths):
+        srcs = (BASE_SRC_IP + (flowIDs >> 16)).tolist()
+        sports = (flowIDs & 0xffff).tolist()
+        for (time, src, sport, length) in zip(times.astype(np.int64).tolist(), srcs, sports, lengths.tolist()):
+            yield (time, src, DST_IP, sport, DPORT, PROTO, length)
+
+
+class PoissonTraffic(StochasticTraffic):
+    """
+    num_flows flows with Poisson pkt arrivals. Their superposition is a
+    Poisson process in which every pkt belongs to flow i with probability
+    proportional to the rate of flow i.
+    """
+    def __init__(self, num_flows, rate, flow_weights=None, **kwargs):
+        """
+        rate: total rate of all flows (Gbps)
+        flow_weights: relative rates of the flows (equal by default)
+        """
+        super(PoissonTraffic, self).__init__(**kwargs)
+        self.num_flows = num_flows
+        self.rate = rate
+        weights = np.ones(num_flows) if flow_weights is None else np.asarray(flow_weights, dtype=np.float64)
+        self.flow_probs = weights/weights.sum()
+
+    def batches(self, rng):
+        mean_gap = serialization_ns(self.mean_pkt_len(), self.rate)
+        now = 0.0
+        while True:
+            times = now + np.cumsum(rng.exponential(mean_gap, BATCH_SIZE))
+            now = times[-1]
+            flowIDs = rng.choice(self.num_flows, BATCH_SIZE, p=self.flow_probs)
+            yield (now, times, flowIDs, self.sample_pkt_lens(rng, BATCH_SIZE))
+
+
+class OnOffTraffic(StochasticTraffic):
+    """
+    num_flows Markov on/off sources: every flow alternates between
+    exponentially distributed ON periods, in which it sends at peak_rate, and
+    exponentially distributed OFF periods, in which it is silent. Every ON
+    period has at least one pkt.
+    """
+    def __init__(self, num_flows, peak_rate, mean_on, mean_off, window=100000, **kwargs):
+        """
+        peak_rate: rate of a flow during its ON periods (Gbps)
+        mean_on, mean_off: mean length of the ON and OFF periods (ns)
+        window: ns of traffic that are sampled at once
+        """
+        super(OnOffTraffic, self).__init__(**kwargs)
+        self.num_flows = num_flows
+        self.peak_rate = peak_rate
+        self.mean_on = mean_on
+        self.mean_off = mean_off
+        self.window = window
+
+    def batches(self, rng):
+        gap = serialization_ns(self.mean_pkt_len(), self.peak_rate)
+        # start of the next ON period of every flow, each flow starts in an OFF period
+        next_on = rng.exponential(self.mean_off, self.num_flows)
+        horizon = 0.0
+        while True:
+            horizon += self.window
+            (times, flowIDs) = ([], [])
+            active = np.flatnonzero(next_on < horizon)
+            while len(active) > 0:
+                # one ON period for every flow that starts one before the horizon
+                starts = next_on[active]
+                num_pkts = (rng.exponential(self.mean_on, len(active))//gap).astype(np.int64) + 1
+                times.append(np.repeat(starts, num_pkts) + gap*burst_offsets(num_pkts))
+                flowIDs.append(np.repeat(active, num_pkts))
+                next_on[active] = starts + num_pkts*gap + rng.exponential(self.mean_off, len(active))
+                active = active[next_on[active] < horizon]
+            times = np.concatenate(times) if len(times) > 0 else np.zeros(0)
+            flowIDs = np.concatenate(flowIDs) if len(flowIDs) > 0 else np.zeros(0, dtype=np.int64)
+            yield (horizon, times, flowIDs, self.sample_pkt_lens(rng, len(times)))
+
+
+class FlowSizeTraffic(StochasticTraffic):
+    """
+    Flows arrive as a Poisson process with sizes drawn from a flow size
+    distribution (e.g. WEB_SEARCH_CDF or DATA_MINING_CDF) and send their bytes
+    in mtu sized pkts at flow_rate. The arrival rate is set so that the flows
+    offer load times link_rate on average. Every flow gets a new flowID.
+    """
+    def __init__(self, flow_size_cdf, load, link_rate=10, flow_rate=None, mtu=1500, min_pkt_len=64, **kwargs):
+        """
+        load: offered load as a fraction of link_rate (Gbps)
+        flow_rate: rate at which a flow sends its pkts (Gbps), link_rate by default
+        """
+        super(FlowSizeTraffic, self).__init__(pkt_len=mtu, **kwargs)
+        self.flow_size_cdf = flow_size_cdf
+        self.load = load
+        self.link_rate = link_rate
+        self.flow_rate = flow_rate if flow_rate is not None else link_rate
+        self.mtu = mtu
+        self.min_pkt_len = min_pkt_len
+
+    def batches(self, rng):
+        mean_size = self.flow_size_cdf.mean()
+        mean_flow_gap = serialization_ns(mean_size, self.load*self.link_rate)
+        gap = serialization_ns(self.mtu, self.flow_rate)
+        # sample about BATCH_SIZE pkts at once
+        num_flows = max(1, int(BATCH_SIZE*self.mtu/mean_size))
+        now = 0.0
+        first_flowID = 0
+        while True:
+            starts = now + np.cumsum(rng.exponential(mean_flow_gap, num_flows))
+            now = starts[-1]
+            sizes = np.maximum(self.flow_size_cdf.sample(rng, num_flows).astype(np.int64), 1)
+            num_pkts = (sizes + self.mtu - 1)//self.mtu
+            offsets = burst_offsets(num_pkts)
+            times = np.repeat(starts, num_pkts) + gap*offsets
+            flowIDs = np.repeat(np.arange(first_flowID, first_flowID + num_flows), num_pkts)
+            first_flowID += num_flows
+            # mtu sized pkts except for the last pkt of each flow
+            lengths = np.full(len(times), self.mtu, dtype=np.int64)
+            last = np.cumsum(num_pkts) - 1
+            lengths[last] = np.maximum(sizes - (num_pkts - 1)*self.mtu, self.min_pkt_len)
+            yield (now, times, flowIDs, lengths)
+
+
+def burst_offsets(num_pkts):
+    """
+    Returns 0, 1, ..., num_pkts[0] - 1, 0, 1, ..., num_pkts[1] - 1, ...
+    """
+    total = num_pkts.sum()
+    firsts = np.cumsum(num_pkts) - num_pkts
+    return np.arange(total) - np.repeat(firsts, num_pkts)
@@ -0,0 +1,73 @@
+
+import random
+import simpy
+from hwsim_utils import *
+from scheduling_tree import Scheduling_tree
+from pifo_storage import PIFOEntry
+
+NUM_PKTS = 2000
+SEED = 1
+# 1- to 4-level trees
+SHAPES = [0,
+          {0: [1, 2]},
+          {0: [{1: [3, 4]}, {2: [5, 6]}]},
+          {0: [{1: [{3: [7, 8]}, {4: [9, 10]}]}, {2: [{5: [11, 12]}, {6: [13, 14]}]}]}]
+# cycles the consumer spends on each pkt before asking for the next one
+CONSUMER_DELAYS = [0, 4]
+
+def fill(tree, leaves):
+    """
+    Write NUM_PKTS pkts directly into the nodes so that every read finds data
+    """
+    rng = random.Random(SEED)
+    pkt = PktRecord(64)
+    for i in range(NUM_PKTS):
+        ranks = [rng.randint(0, 1000) for level in range(4)]
+        meta = StdMetadata(len(pkt), 0, 0, ranks, rng.choice(leaves))
+        node = tree.nodes[meta.leaf_node]
+        data = (meta, pkt)
+        level = 0
+        while node is not None:
+            node.values.push(PIFOEntry(meta.ranks[level], next(node.seq), data))
+            data = node.ID
+            node = node.parent
+            level += 1
+
+def drain(env, tree, delay, done):
+    """
+    Request pkts one at a time, spending delay cycles on each
+    """
+    for i in range(NUM_PKTS):
+        tree.ready_out_pipe.put(1)
+        yield tree.pkt_out_pipe.get()
+        if delay > 0:
+            yield env.timeout(delay)
+    done.succeed(env.now)
+
+def bench(shape, delay, prefetch_reads):
+    """
+    Returns the achieved dequeue rate in pkts per cycle
+    """
+    env = simpy.Environment()
+    tree = Scheduling_tree(env, 1, simpy.Store(env), simpy.Store(env), simpy.Store(env), simpy.Store(env), shape, prefetch_reads=prefetch_reads)
+    leaves = [node.ID for node in tree.nodes.values() if len(node.children) == 0]
+    fill(tree, leaves)
+    done = env.event()
+    env.process(drain(env, tree, delay, done))
+    cycles = env.run(until=done)
+    return float(NUM_PKTS)/cycles
+
+def main():
+    """
+    Measure the scheduling tree dequeue throughput vs tree depth
+    """
+    print '{:>7} {:>6} {:>16} {:>19} {:>9}'.format('levels', 'delay', 'serial (pkt/cyc)', 'prefetch (pkt/cyc)', 'speedup')
+    for (levels, shape) in enumerate(SHAPES, 1):
+        for delay in CONSUMER_DELAYS:
+            serial = bench(shape, delay, False)
+            prefetch = bench(shape, delay, True)
+            print '{:>7} {:>6} {:>16.3f} {:>19.3f} {:>8.2f}x'.format(levels, delay, serial, prefetch, prefetch/serial)
+
+
+if __name__ == '__main__':
+    main()
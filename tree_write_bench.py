@@ -0,0 +1,55 @@
+
+import random
+import simpy
+from hwsim_utils import *
+from scheduling_tree import Scheduling_tree
+
+NUM_PKTS = 2000
+SEED = 1
+# 1- to 4-level trees
+SHAPES = [0,
+          {0: [1, 2]},
+          {0: [{1: [3, 4]}, {2: [5, 6]}]},
+          {0: [{1: [{3: [7, 8]}, {4: [9, 10]}]}, {2: [{5: [11, 12]}, {6: [13, 14]}]}]}]
+
+def feed(env, tree, leaves, done):
+    """
+    Offer a pkt to the tree as soon as it is ready to receive one
+    """
+    rng = random.Random(SEED)
+    pkt = PktRecord(64)
+    for i in range(NUM_PKTS):
+        yield tree.ready_in_pipe.get()
+        ranks = [rng.randint(0, 1000) for level in range(4)]
+        meta = StdMetadata(len(pkt), 0, 0, ranks, rng.choice(leaves))
+        tree.pkt_in_pipe.put((meta, pkt))
+    # wait for the last pointer to reach the root
+    while len(tree.tree.values) < NUM_PKTS:
+        yield env.timeout(1)
+    done.succeed(env.now)
+
+def bench(shape, pipelined_writes):
+    """
+    Returns the achieved enqueue rate in pkts per cycle
+    """
+    env = simpy.Environment()
+    tree = Scheduling_tree(env, 1, simpy.Store(env), simpy.Store(env), simpy.Store(env), simpy.Store(env), shape, pipelined_writes=pipelined_writes)
+    leaves = [node.ID for node in tree.nodes.values() if len(node.children) == 0]
+    done = env.event()
+    env.process(feed(env, tree, leaves, done))
+    cycles = env.run(until=done)
+    return float(NUM_PKTS)/cycles
+
+def main():
+    """
+    Measure the scheduling tree enqueue throughput vs tree depth
+    """
+    print '{:>7} {:>16} {:>16} {:>9}'.format('levels', 'serial (pkt/cyc)', 'pipelined (pkt/cyc)', 'speedup')
+    for (levels, shape) in enumerate(SHAPES, 1):
+        serial = bench(shape, False)
+        pipelined = bench(shape, True)
+        print '{:>7} {:>16.3f} {:>19.3f} {:>8.2f}x'.format(levels, serial, pipelined, pipelined/serial)
+
+
+if __name__ == '__main__':
+    main()